@@ -1,7 +1,22 @@
+import gc
+import imp
+import itertools
 import sys
 import os
+import posixpath
+import re
+import threading
+import time
+import tokenize
+import weakref
+import zlib
 import pkg_resources
 
+try:
+    from hashlib import sha1 as sha
+except ImportError: # pragma: no cover
+    from sha import sha
+
 from zope.interface import implements
 
 try:
@@ -13,42 +28,737 @@ except ImportError: # pragma: no cover
         def __init__(self, *arg, **kw):
             raise ImportError, exc, tb
 
+from pyramid.interfaces import IChameleonLookup
+from pyramid.interfaces import IRendererGlobalsFactory
 from pyramid.interfaces import ITemplateRenderer
 
-from pyramid.decorator import reify
+from pyramid.events import BeforeRender
+from pyramid.events import NewRequest
 from pyramid.path import caller_package
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_registry
+from pyramid.threadlocal import manager
 from pyramid import renderers
 
+from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+from pyramid_chameleon_genshi.cache import MtimeCache
+from pyramid_chameleon_genshi.cache import OutputCache
+from pyramid_chameleon_genshi.cache import TemplateLRUCache
+from pyramid_chameleon_genshi.dependencies import DependencyGraph
+from pyramid_chameleon_genshi.executor import RenderExecutor
+from pyramid_chameleon_genshi.interfaces import ICompiledTemplateCache
+from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+from pyramid_chameleon_genshi.profiler import find_profile
+
+timer = time.time
+
 def renderer_factory(path):
     return renderers.template_renderer_factory(path, GenshiTemplateRenderer)
 
+class PyramidGenshiTemplateFile(GenshiTemplateFile):
+    """ A ``chameleon.genshi`` template file which can keep its compiled
+    code in a :class:`pyramid_chameleon_genshi.cache.CompiledTemplateCache`
+    (passed as ``cache``) and which hands its settings on to the templates
+    it XIncludes.
+
+    If ``stream`` is true, the template is compiled so that a top-level
+    render produces the list of output fragments instead of joining them
+    into one string; see :meth:`iterrender`.
+
+    Instances are registered by filename in the class attribute
+    ``global_registry``, which is where XIncludes and renderers look up
+    templates; it is a
+    :class:`pyramid_chameleon_genshi.cache.TemplateLRUCache` (see
+    :func:`configure_xinclude_cache`).  Templates in stream mode are never
+    registered.
+
+    With ``auto_reload`` on, the source file is normally stat'ed on every
+    render.  If ``reload_interval`` is a positive number of seconds, the
+    modification time of each file is instead checked at most once per
+    interval (see :class:`pyramid_chameleon_genshi.cache.MtimeCache`), so
+    changes take up to that long to be picked up.
+
+    Every instance is tracked (without being kept alive) in the class
+    attribute ``instances``, a mapping of ``id(template)`` to template,
+    and counts its ``renders`` and remembers when it was ``last_rendered``
+    (see :func:`pyramid_chameleon_genshi.memory.template_report`).
+
+    If ``inline_xincludes`` is true, the XIncludes with a literal ``href``
+    are compiled into the code of a top-level render instead of being
+    resolved on every render; see :meth:`inline_includes`.
+
+    If the class attribute ``profiling`` is true, the renders made on
+    behalf of a request which asks for it are recorded in the profile of
+    the request (see :class:`pyramid_chameleon_genshi.profiler.RenderProfile`)."""
+    cache = None
+    metrics = None
+    output_cache = None
+    stream = False
+    reload_interval = 0
+    renders = 0
+    last_rendered = None
+    fold_static = True
+    # part of the keys of compiled template caches; increment it whenever
+    # filter_source changes the code it generates
+    source_version = 1
+    inline_xincludes = False
+    inlined = ()
+    profiling = False
+    global_registry = TemplateLRUCache()
+    mtimes = MtimeCache()
+    instances = weakref.WeakValueDictionary()
+
+    def __init__(self, filename, parser=None, cache=None, metrics=None,
+                 output_cache=None, stream=False, reload_interval=None,
+                 inline_xincludes=False, **kw):
+        if output_cache is not None:
+            self.output_cache = output_cache
+        if reload_interval:
+            self.reload_interval = reload_interval
+        if cache is not None:
+            self.cache = cache
+            self.registry = cache.get_registry(self)
+        if metrics is not None:
+            self.metrics = metrics
+        if stream:
+            self.stream = True
+        if inline_xincludes:
+            self.inline_xincludes = True
+        super(PyramidGenshiTemplateFile, self).__init__(filename, parser, **kw)
+        self.instances[id(self)] = self
+        if stream:
+            # code compiled in stream mode must never be mistaken for
+            # regular code (e.g. in a compiled template cache) nor be
+            # XIncluded
+            self.signature = sha(self.signature + ';stream').hexdigest()
+            if self.global_registry.get(self.filename) is self:
+                self.global_registry.pop(self.filename, None)
+        if inline_xincludes:
+            # nor must code with inlined includes
+            self.signature = sha(self.signature + ';inline').hexdigest()
+
+    def matches(self, settings):
+        """ Return whether this template was created with the keyword
+        arguments ``settings`` (as far as they are remembered), so that it
+        can be used in place of a template created with them.  The
+        ``format`` defaults to that of the class."""
+        settings = dict(settings)
+        settings.setdefault('format', type(self).format)
+        for name, value in settings.items():
+            if name == 'translate' and value is None:
+                value = type(self).translate
+            elif name == 'reload_interval':
+                value = value or 0
+            if getattr(self, name, None) != value:
+                return False
+        return True
+
+    def clone(self, filename, format=None):
+        return type(self)(filename, self.parser, format=format,
+                          doctype=self.explicit_doctype,
+                          auto_reload=self.auto_reload, debug=self.debug,
+                          translate=self.translate, cache=self.cache,
+                          metrics=self.metrics,
+                          output_cache=self.output_cache,
+                          reload_interval=self.reload_interval,
+                          inline_xincludes=self.inline_xincludes)
+
+    def cook_and_render(self, args, slots, macro, global_scope):
+        # counted without a lock, so the count is approximate
+        self.renders += 1
+        self.last_rendered = timer()
+        render = super(PyramidGenshiTemplateFile, self).cook_and_render
+        if self.profiling:
+            profile = find_profile(args.get('econtext') or args)
+            if profile is not None:
+                kind = macro is None and 'template' or 'xinclude'
+                return profile.measure(self.filename, kind, args.get('_out'),
+                                       render, args, slots, macro,
+                                       global_scope)
+        return render(args, slots, macro, global_scope)
+
+    def evict(self):
+        """ Free the parse tree of the template, which is kept to compile
+        code for macros and includes not compiled yet and is rebuilt from
+        the source when needed again.  Compiled code is kept."""
+        self.acquire()
+        try:
+            for name in ('compiler', 'slots', 'macros'):
+                self.__dict__.pop(name, None)
+        finally:
+            self.release()
+
+    def mtime(self):
+        """ Return the modification time of the source file or, if the
+        code holds inlined includes, of the most recently modified of the
+        source file and the included files, so that a change to any of
+        them has the template reloaded."""
+        result = self.getmtime(self.filename)
+        for path in self.inlined:
+            result = max(result, self.getmtime(path))
+        return result
+
+    def getmtime(self, path):
+        if not self.reload_interval:
+            try:
+                return os.path.getmtime(path)
+            except (IOError, OSError):
+                return 0
+        return self.mtimes.getmtime(path, self.reload_interval)
+
+    def parse(self):
+        super(PyramidGenshiTemplateFile, self).parse()
+        compiler = self.__dict__.get('compiler')
+        if compiler is not None:
+            self.__dict__['compiler'] = SourceFilter(compiler,
+                                                     self.filter_source)
+
+    def filter_source(self, source, macro, global_scope):
+        """ Return the generated Python ``source`` of the render function
+        for ``macro`` and ``global_scope``, possibly rewritten."""
+        if self.fold_static and not self.debug:
+            source = fold_static_writes(source)
+        if self.inline_xincludes and macro is None and not self.debug:
+            inlined = []
+            source = self.inline_includes(source, inlined)
+            self.inlined = tuple(inlined)
+            if self.auto_reload and self._v_last_read:
+                # the included files were read just now
+                self._v_last_read = self.mtime()
+        if self.stream and macro is None:
+            source = source.replace(RETURN_JOINED, RETURN_BUFFER)
+        return source
+
+    def inline_includes(self, source, inlined, functions=None, parents=()):
+        """ Return the generated Python ``source`` of a top-level render
+        function with the code of the templates it XIncludes through a
+        literal ``href`` (a relative filename, an absolute filename or a
+        resource specification) spliced into it, so that rendering them
+        is a plain function call instead of a lookup through
+        :class:`XIncludes`.  The includes of the included templates are
+        inlined as well, except for those forming a cycle, and the
+        includes whose output is cached (see :class:`TemplateOutputCache`)
+        are left alone, as are those naming a missing file or a template
+        which fails to compile.  Includes are resolved against the directory of
+        this template, as they are when rendering, and recorded in
+        :attr:`XIncludes.dependencies`; their filenames are appended to
+        the list ``inlined``.
+
+        The included templates are compiled anew from their files.  The
+        top-level render function of a template with inlined includes is
+        never stored in a compiled template cache, and neither the
+        ``renders`` of the included templates nor the includes reported to
+        the metrics utility count inlined renders."""
+        if functions is None:
+            functions = []
+        includer = parents and parents[-1] or self.filename
+        names = []
+        def replace(match):
+            indent, literal, href, target, format = match.groups()
+            path = self.xincludes.resolve(href)
+            if path in parents or path == self.filename:
+                return match.group(0)
+            # an include which cannot be inlined is left to fail, if it
+            # is ever rendered, the way it does without inlining
+            if not os.path.exists(path):
+                return match.group(0)
+            try:
+                child = self.clone(path, format=format)
+            except (IOError, OSError):
+                return match.group(0)
+            if self.output_cache is not None and \
+                   self.output_cache.fragment(path, child) is not child:
+                return match.group(0)
+            child.acquire()
+            try:
+                try:
+                    code = child.compiler('', False)
+                except Exception:
+                    return match.group(0)
+            finally:
+                child.release()
+            if path not in inlined:
+                inlined.append(path)
+            self.xincludes.dependencies.add(includer, path)
+            code = self.inline_includes(code, inlined, functions,
+                                        parents + (path,))
+            name = '_xinclude_%d' % len(functions)
+            functions.append(BIND.sub('def _bind%s():\n' % name, code, 1))
+            names.append(name)
+            return '%s_include = %s\n%s%s = _render_inlined(%s, ' % (
+                indent, literal, indent, target, name)
+        source = INCLUDE_CALL.sub(replace, source)
+        if not names:
+            return source
+        bind = ['def bind():\n']
+        for name in names:
+            bind.append('    %s = _bind%s()\n' % (name, name))
+        source = BIND.sub(''.join(bind), source, 1)
+        if parents:
+            return source
+        return '\n'.join(['from pyramid_chameleon_genshi import '
+                          'render_inlined as _render_inlined'] +
+                         functions + [source])
+
+    def render(self, *args, **kwargs):
+        if self.stream and not args:
+            return ''.join(self.iterrender(**kwargs))
+        return super(PyramidGenshiTemplateFile, self).render(*args, **kwargs)
+
+    def render_xinclude(self, **kwargs):
+        # the includes of an included template are resolved by the
+        # XIncludes of the top-level template, which must record them as
+        # includes of this one
+        from chameleon.core.config import SYMBOLS
+        econtext = kwargs.get('econtext')
+        xincludes = econtext and econtext.get(SYMBOLS.xincludes)
+        if getattr(xincludes, 'filename', self.filename) != self.filename:
+            kwargs[SYMBOLS.xincludes] = xincludes.including(self.filename)
+        return super(PyramidGenshiTemplateFile, self).render_xinclude(**kwargs)
+
+    def iterrender(self, **kwargs):
+        """ Render the template, returning a sequence of output fragments
+        which, joined, make up the result of :meth:`render`.  Unless the
+        template was created in stream mode, the sequence holds a single
+        string."""
+        if not self.stream:
+            return [self.render(**kwargs)]
+        from chameleon.core.config import SYMBOLS
+        from chameleon.core.template import Template
+        from chameleon.genshi.language import MatchTemplates
+        kwargs[SYMBOLS.xincludes] = self.xincludes
+        mt = kwargs['match_templates'] = MatchTemplates()
+        result = Template.render(self, **kwargs)
+        if mt:
+            # ``py:match`` templates operate on the complete document
+            result = [mt.process(''.join(result))]
+        return result
+
+class SourceFilter(object):
+    """ Wraps a Chameleon compiler, passing the source it generates through
+    ``filter``."""
+    def __init__(self, compiler, filter):
+        self.compiler = compiler
+        self.filter = filter
+
+    def __call__(self, macro, global_scope):
+        source = self.compiler(macro, global_scope)
+        return self.filter(source, macro, global_scope)
+
+# the statements Chameleon generates for static markup: writes of string
+# constants, assignments of the (constant) attributes of the element and
+# string expressions documenting the code
+STRING = r'''u?(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")'''
+STATIC_WRITE = re.compile(r'^( *)_write\((%s)\)$' % STRING)
+STATIC_ATTRS = re.compile(r'^( *)attrs = _attrs_\d+$')
+STATIC_NOOP = re.compile(r'^( *)%s$' % STRING)
+
+def fold_static_writes(source):
+    """ Return the generated Python ``source`` of a render function with
+    every run of consecutive static statements at the same indentation
+    (see above) replaced by the last ``attrs`` assignment of the run and
+    a single write of the adjacent string constants, which Python joins
+    into one constant when compiling.  Markup without directives or
+    expressions is thus written at once instead of element by element.
+    Only lines which are statements of their own are considered, so code
+    from ``<?python ?>`` blocks spanning several lines is left alone."""
+    statements = single_line_statements(source)
+    result = []
+    run = None
+    for number, line in enumerate(source.split('\n')):
+        match = None
+        if number + 1 in statements:
+            match = STATIC_WRITE.match(line) or STATIC_ATTRS.match(line) or \
+                    STATIC_NOOP.match(line)
+        indent = match and match.group(1)
+        if run is not None and indent != run[0]:
+            end_static_run(result, *run)
+            run = None
+        if match is None:
+            result.append(line)
+            continue
+        if run is None:
+            run = indent, None, []
+        if match.re is STATIC_WRITE:
+            run[2].append(match.group(2))
+        elif match.re is STATIC_ATTRS:
+            run = indent, line, run[2]
+    if run is not None:
+        end_static_run(result, *run)
+    return '\n'.join(result)
+
+def single_line_statements(source):
+    """ Return the set of the numbers of the lines of the Python
+    ``source`` which hold a whole statement (or several)."""
+    from cStringIO import StringIO
+    result = set()
+    start = None
+    ignored = (tokenize.INDENT, tokenize.DEDENT, tokenize.NL, tokenize.COMMENT)
+    for token in tokenize.generate_tokens(StringIO(source + '\n').readline):
+        if token[0] in ignored:
+            continue
+        if start is None:
+            start = token[2][0]
+        if token[0] == tokenize.NEWLINE:
+            if token[3][0] == start:
+                result.add(start)
+            start = None
+    return result
+
+def end_static_run(result, indent, attrs, strings):
+    if attrs is not None:
+        result.append(attrs)
+    if strings:
+        result.append('%s_write(%s)' % (indent, ' '.join(strings)))
+    if attrs is None and not strings and result and \
+           result[-1].endswith(':'):
+        # the run may have been the whole body of a block
+        result.append(indent + 'pass')
+
+# the code Chameleon generates to render an XInclude, when its ``href`` is
+# a literal
+INCLUDE_CALL = re.compile(
+    r"^( *)_include = (u?'([^'\\]*)')\n"
+    r"\1(\w+) = _lookup_attr\(_lookup_attr\(econtext\['xincludes'\], 'get'\)"
+    r"\(_include, '(\w+)'\), 'render_xinclude'\)\(", re.M)
+BIND = re.compile(r'^def bind\(\):\n', re.M)
+
+def render_inlined(_xinclude, econtext, **kwargs):
+    """ Call the render function ``_xinclude`` of a template whose code
+    was inlined into that of the template including it (see
+    :meth:`PyramidGenshiTemplateFile.inline_includes`) like
+    ``render_xinclude`` would: with a copy of the execution context
+    ``econtext`` updated with ``kwargs``."""
+    values = econtext.copy()
+    values.update(kwargs)
+    values['_slots'] = {}
+    return _xinclude(values, econtext)
+
+RETURN_JOINED = '        return _out.getvalue()\n    return render'
+RETURN_BUFFER = '        return _out\n    return render'
+
+def iter_chunks(fragments, encoding='utf-8', chunk_size=8192):
+    """ Yield the ``fragments`` of a rendered template as strings encoded
+    using ``encoding``, each holding at least ``chunk_size`` characters
+    (except for the last one)."""
+    buffer = []
+    size = 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode(encoding)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode(encoding)
+
+def configure_xinclude_cache(max_entries=None, max_bytes=None):
+    """ Replace the registry of templates used to resolve XIncludes by an
+    empty :class:`pyramid_chameleon_genshi.cache.TemplateLRUCache` holding
+    at most ``max_entries`` templates whose sources amount to at most
+    ``max_bytes`` bytes, and return it.  Either bound may be ``None``.
+    Evicted templates are simply loaded again when next included."""
+    cache = TemplateLRUCache(max_entries, max_bytes)
+    PyramidGenshiTemplateFile.global_registry = cache
+    return cache
+
+def get_xinclude_cache():
+    """ Return the registry of templates used to resolve XIncludes and
+    shared by renderers; its ``stats`` method reports its size, its hit,
+    miss and eviction counts and how many times a template was ``shared``
+    instead of being loaded again."""
+    return PyramidGenshiTemplateFile.global_registry
+
+class single_flight(object):
+    """ Computes the lazily filled slots of instances such that, when
+    several threads access an empty slot, only one of them computes its
+    value while the others wait for the result (see :meth:`fill`).  The
+    lock is shared by all instances with the same ``path``, and is not
+    needed anymore once the slot is filled."""
+    locks = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def fill(cls, inst, name, compute):
+        """ Return the value of the slot ``name`` of ``inst``, calling
+        ``compute()`` and storing its result in the slot unless another
+        thread did while we waited for the lock.  Meant to be called by
+        the ``__getattr__`` method of classes with ``__slots__``, which is
+        only called while the slot is empty."""
+        lock = cls.get_lock(inst.path)
+        lock.acquire()
+        try:
+            try:
+                # bypasses __getattr__
+                return object.__getattribute__(inst, name)
+            except AttributeError:
+                val = compute()
+                setattr(inst, name, val)
+                return val
+        finally:
+            lock.release()
+
+    @classmethod
+    def get_lock(cls, path):
+        lock = cls.locks.get(path)
+        if lock is None:
+            cls.lock.acquire()
+            try:
+                lock = cls.locks.setdefault(path, threading.RLock())
+            finally:
+                cls.lock.release()
+        return lock
+
+def namespace(system, value):
+    """ Return the Chameleon execution context a template is rendered
+    with: a dictionary holding the ``system`` values overridden by those in
+    ``value``.  Passed to a template as its ``econtext`` keyword argument,
+    it is used as is, instead of being built from keyword arguments.
+    Neither ``system`` nor ``value`` is modified."""
+    from chameleon.core.utils import econtext
+    result = econtext(system)
+    try:
+        result.update(value)
+    except (TypeError, ValueError):
+        raise ValueError('renderer was passed non-dictionary as value')
+    return result
+
 class GenshiTemplateRenderer(object):
+    """ Renders the template file at ``path`` with the settings of
+    ``lookup``.
+
+    Renderers have no ``__dict__``, only the slots below, so that
+    applications with many templates don't pay for a dictionary per
+    template.  The ``template``, ``stream_template``, ``metrics`` and
+    ``output_cache`` slots are computed when first read, by
+    :meth:`__getattr__`; they are then read like any other attribute, as
+    if reified by :class:`pyramid.decorator.reify`.  Subclasses which
+    don't define ``__slots__`` have a ``__dict__`` again."""
     implements(ITemplateRenderer)
+    __slots__ = ('path', 'lookup', 'template', 'stream_template', 'metrics',
+                 'output_cache')
+    executor = None # see get_render_executor
+    batches = {} # see render_pool
+    batch_keys = itertools.count()
+
     def __init__(self, path, lookup):
         self.path = path
         self.lookup = lookup
 
-    @reify # avoid looking up reload_templates before manager pushed
-    def template(self):
+    def __getattr__(self, name):
+        # only called while the slot ``name`` is empty
+        if name == 'template':
+            # avoid looking up reload_templates before manager pushed
+            return single_flight.fill(self, name, self.load_template)
+        if name == 'stream_template':
+            return single_flight.fill(self, name, self.load_stream_template)
+        if name == 'metrics':
+            metrics = self.metrics = self.query(ITemplateMetrics)
+            return metrics
+        if name == 'output_cache':
+            output_cache = self.output_cache = self.query(ITemplateOutputCache)
+            return output_cache
+        raise AttributeError(name)
+
+    def load_template(self):
+        """ Load and compile the template, see :attr:`template`."""
+        start = timer()
+        template = self.make_template()
+        cook(template)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.compiled(self.path, timer() - start)
+        return template
+
+    def load_stream_template(self):
+        """ Load and compile the template in stream mode, see
+        :attr:`stream_template`."""
+        template = self.make_template(stream=True)
+        cook(template)
+        return template
+
+    def make_template(self, **kw):
         if sys.platform.startswith('java'): # pragma: no cover
             raise RuntimeError(
                 'Chameleon templates are not compatible with Jython')
-        return GenshiTemplateFile(self.path,
-                                  auto_reload=self.lookup.auto_reload,
-                                  debug = self.lookup.debug,
-                                  translate = self.lookup.translate)
+        reload_interval = self.setting('chameleon_genshi.reload_interval')
+        settings = dict(auto_reload = self.lookup.auto_reload,
+                        debug = self.lookup.debug,
+                        translate = self.lookup.translate,
+                        cache = self.query(ICompiledTemplateCache),
+                        metrics = self.metrics,
+                        output_cache = self.output_cache,
+                        reload_interval = float(reload_interval or 0),
+                        inline_xincludes = asbool(self.setting(
+                            'chameleon_genshi.inline_xincludes')))
+        settings.update(kw)
+        # every renderer of a file (whatever the spec it was looked up by)
+        # and every XInclude of it share the template registered under
+        # its normalized filename, provided it has the same settings
+        filename = os.path.normpath(self.path)
+        def factory():
+            return PyramidGenshiTemplateFile(filename, **settings)
+        registry = PyramidGenshiTemplateFile.global_registry
+        share = getattr(registry, 'share', None)
+        if share is None:
+            return factory()
+        return share(filename, factory,
+                     lambda template: template.matches(settings))
+
+    def query(self, iface):
+        """ Return the utility registered for ``iface`` in the registry
+        of our lookup or ``None``."""
+        registry = getattr(self.lookup, 'registry', None)
+        if registry is None:
+            return None
+        return registry.queryUtility(iface)
+
+    def setting(self, name, default=None):
+        """ Return the deployment setting ``name`` from the registry of
+        our lookup or ``default``."""
+        registry = getattr(self.lookup, 'registry', None)
+        settings = getattr(registry, 'settings', None) or {}
+        return settings.get(name, default)
 
     def implementation(self):
         return self.template
     
     def __call__(self, value, system):
-        try:
-            system.update(value)
-        except (TypeError, ValueError):
-            raise ValueError('renderer was passed non-dictionary as value')
-        result = self.template(**system)
+        values = namespace(system, value)
+        output_cache = self.output_cache
+        if output_cache is not None:
+            return output_cache.render(self.path, self.render, values)
+        return self.render(values)
+
+    def render_gzip(self, value, system):
+        """ Render the template like ``__call__``, but return a ``(text,
+        body, etag)`` tuple, where ``body`` is the gzip-compressed UTF-8
+        encoding of the output and ``etag`` identifies it when the output
+        is cached with a ``gzip_level`` (see
+        :meth:`TemplateOutputCache.render_gzip`); ``text`` is then
+        ``None``.  Otherwise ``text`` is the output and ``body`` and
+        ``etag`` are ``None``."""
+        values = namespace(system, value)
+        render_gzip = getattr(self.output_cache, 'render_gzip', None)
+        if render_gzip is None:
+            return self.render(values), None, None
+        return render_gzip(self.path, self.render, values)
+
+    def render(self, values):
+        """ Render the template with ``values`` (as returned by
+        :func:`namespace`), bypassing the output cache."""
+        metrics = self.metrics
+        if metrics is None:
+            return self.template(econtext=values)
+        template = self.template
+        start = timer()
+        result = template(econtext=values)
+        metrics.rendered(self.path, timer() - start, len(result))
         return result
 
+    def stream(self, value, system, encoding='utf-8', chunk_size=8192):
+        """ Render the template like ``__call__`` but return an iterator
+        over the result encoded using ``encoding``, suitable for use as the
+        ``app_iter`` of a response.  The template is rendered before this
+        method returns, but its output fragments are never joined into a
+        single string; each chunk is assembled and encoded only when the
+        iterator is advanced."""
+        values = namespace(system, value)
+        fragments = self.stream_template.iterrender(econtext=values)
+        return iter_chunks(fragments, encoding, chunk_size)
+
+    def submit(self, value, system, executor=None):
+        """ Render the template like ``__call__`` in a thread of
+        ``executor`` (by default, see :func:`get_render_executor`) and
+        return a :class:`pyramid_chameleon_genshi.executor.RenderFuture`
+        for the result.  The thread renders with the current registry and
+        the ``request`` of ``system`` (or the current request) as the
+        :mod:`pyramid` thread-locals."""
+        if executor is None:
+            executor = get_render_executor()
+        threadlocals = manager.get().copy()
+        if system.get('request') is not None:
+            threadlocals['request'] = system['request']
+        return executor.submit(call_with_threadlocals, threadlocals, self,
+                               value, system)
+
+    def render_many(self, values, system, processes=None, chunksize=1):
+        """ Render the template like ``__call__`` once for each dictionary
+        in the iterable ``values``, all with the same ``system`` values,
+        and return an iterator over the results which renders each one
+        only when it is asked for.  The template is compiled before this
+        method returns.
+
+        If ``processes`` is given, the renders are spread over a pool of
+        that many forked processes, which receive the dictionaries (so
+        they must be picklable) in batches of ``chunksize`` and inherit
+        the renderer and ``system``.  ``values`` is then consumed ahead of
+        the iterator, whose results still come in order."""
+        self.template
+        if processes:
+            return self.render_pool(values, system, processes, chunksize)
+        return self.render_iter(values, system)
+
+    def render_iter(self, values, system):
+        for value in values:
+            yield self(value, system)
+
+    def render_pool(self, values, system, processes, chunksize):
+        import multiprocessing
+        # the workers are forked by the pool's constructor, so they find
+        # the batch under its key without it being pickled
+        key = self.batch_keys.next()
+        self.batches[key] = self, system
+        try:
+            pool = multiprocessing.Pool(processes)
+        finally:
+            del self.batches[key]
+        try:
+            tasks = ((key, value) for value in values)
+            for result in pool.imap(render_batch_item, tasks, chunksize):
+                yield result
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+
+def render_batch_item(args):
+    """ Render one item of a batch in a process forked by
+    :meth:`GenshiTemplateRenderer.render_pool`; ``args`` is the ``(key,
+    value)`` tuple (a single argument, to suit ``Pool.imap``)."""
+    key, value = args
+    renderer, system = GenshiTemplateRenderer.batches[key]
+    return renderer(value, system)
+
+def renderer_helper(path):
+    """ Return a :class:`pyramid.renderers.RendererHelper` for the
+    template implied by ``path``, relative to the package of the module
+    calling the function which calls this one.  Helpers (and so the
+    renderers they look up) are memoized in the current registry per
+    calling module and ``path``, so that the deprecated helpers below
+    neither look up the calling package nor create and set up a helper on
+    every call; they are not memoized when the ``reload_assets`` setting
+    is on."""
+    registry = get_current_registry()
+    settings = registry.settings or {}
+    if asbool(settings.get('reload_assets')):
+        return renderers.RendererHelper(name=path, package=caller_package(3),
+                                        registry=registry)
+    helpers = registry.__dict__.get('genshi_renderer_helpers')
+    if helpers is None:
+        helpers = registry.genshi_renderer_helpers = {}
+    key = sys._getframe(2).f_globals.get('__name__'), path
+    helper = helpers.get(key)
+    if helper is None:
+        helper = renderers.RendererHelper(name=path, package=caller_package(3),
+                                          registry=registry)
+        helpers[key] = helper
+    return helper
+
 def get_renderer(path):
     """ Return a callable object which can be used to render a
     :term:`Chameleon` ZPT template using the template implied by the
@@ -59,8 +769,7 @@ def get_renderer(path):
     .. warning:: This API is deprecated in :mod:`pyramid_chameleon_genshi`
        1.0.  Use :func:`pyramid.renderers.get_renderer` instead.
     """
-    package = caller_package()
-    factory = renderers.RendererHelper(name=path, package=package)
+    factory = renderer_helper(path)
     return factory.get_renderer()
 
 def get_template(path):
@@ -72,8 +781,7 @@ def get_template(path):
         .. warning:: This API is deprecated in :mod:`pyramid_chameleon_genshi`
        1.0.  Use :func:`pyramid.renderers.get_renderer` instead.
     """
-    package = caller_package()
-    factory = renderers.RendererHelper(name=path, package=package)
+    factory = renderer_helper(path)
     return factory.get_renderer().implementation()
 
 def render_template(path, **kw):
@@ -87,9 +795,8 @@ def render_template(path, **kw):
     .. warning:: This API is deprecated in :mod:`pyramid_chameleon_genshi`
        1.0.  Use :func:`pyramid.renderers.get_renderer` instead.
     """
-    package = caller_package()
     request = kw.pop('request', None)
-    renderer = renderers.RendererHelper(name=path, package=package)
+    renderer = renderer_helper(path)
     return renderer.render(kw, None, request=request)
 
 def render_template_to_response(path, **kw):
@@ -101,25 +808,242 @@ def render_template_to_response(path, **kw):
     itself.  Returns a :term:`Response` object with the body as the
     template result.
 
+    If the output of the template is cached with a ``gzip_level`` (see
+    :func:`add_genshi_output_cache`), the response charset is UTF-8 and
+    the ``Accept-Encoding`` header of ``request`` allows gzip, the body
+    is the compressed copy stored along with the output, with the
+    ``Content-Encoding`` and ``ETag`` headers set accordingly.  Responses
+    rendered with such a template have ``Accept-Encoding`` added to their
+    ``Vary`` header whether they are compressed or not.
+
     .. warning:: This API is deprecated in :mod:`pyramid_chameleon_genshi`
        1.0.  Use :func:`pyramid.renderers.get_renderer` instead.
     """
-    package = caller_package()
     request = kw.pop('request', None)
-    renderer = renderers.RendererHelper(name=path, package=package)
-    return renderer.render_to_response(kw, None, request=request)
+    helper = renderer_helper(path)
+    renderer = helper.get_renderer()
+    compresses = getattr(getattr(renderer, 'output_cache', None),
+                         'compresses', None)
+    if compresses is None or not compresses(renderer.path):
+        return helper.render_to_response(kw, None, request=request)
+    if accepts_gzip(request):
+        response = gzip_response(helper, renderer, kw, request)
+    else:
+        response = helper.render_to_response(kw, None, request=request)
+    # caches must tell compressed responses from uncompressed ones,
+    # besides anything the application already varies on
+    vary = tuple(response.vary or ())
+    if 'accept-encoding' not in [name.lower() for name in vary]:
+        response.vary = vary + ('Accept-Encoding',)
+    return response
+
+def gzip_response(helper, renderer, value, request):
+    """ Return the response of :func:`render_template_to_response` for a
+    ``request`` allowing gzip: its body is the compressed copy of the
+    output of ``renderer`` cached with it, unless the response charset is
+    not UTF-8 or the output is not cached."""
+    system = system_values(helper, request)
+    response = helper._make_response('', request)
+    if (response.charset or '').lower().replace('_', '-') not in \
+           ('utf-8', 'utf8'):
+        return helper._make_response(renderer(value, system), request)
+    text, body, etag = renderer.render_gzip(value, system)
+    if body is None:
+        return helper._make_response(text, request)
+    response.body = body
+    response.content_encoding = 'gzip'
+    response.etag = etag
+    response.conditional_response = True
+    return response
+
+def accepts_gzip(request):
+    """ Return whether the ``Accept-Encoding`` header of ``request``
+    allows a gzip-compressed response."""
+    accept_encoding = getattr(request, 'accept_encoding', None)
+    return accept_encoding is not None and 'gzip' in accept_encoding
+
+def stream_template_to_response(path, **kw):
+    """ Render a :term:`Chameleon` Genshi template using the template
+    implied by the ``path`` argument like
+    :func:`render_template_to_response`, but return a :term:`Response`
+    object whose ``app_iter`` yields the body in encoded chunks, without
+    ever holding the complete body as a single string.  The arguments in
+    ``*kw`` are passed as top-level names to the template, except for
+    ``request``."""
+    request = kw.pop('request', None)
+    helper = renderer_helper(path)
+    system = system_values(helper, request)
+    response = helper._make_response('', request)
+    encoding = response.charset or 'utf-8'
+    response.app_iter = helper.get_renderer().stream(kw, system, encoding)
+    response.content_length = None
+    return response
+
+def system_values(helper, request):
+    """ Return the system values :mod:`pyramid` passes to the renderer of
+    the :class:`pyramid.renderers.RendererHelper` ``helper`` when it is
+    used outside of a view, after applying the renderer globals factory
+    and notifying :class:`pyramid.events.BeforeRender` subscribers."""
+    registry = helper.registry
+    system = {
+        'view':None,
+        'renderer_name':helper.name,
+        'renderer_info':helper,
+        'context':getattr(request, 'context', None),
+        'request':request,
+        }
+    globals_factory = registry.queryUtility(IRendererGlobalsFactory)
+    if globals_factory is not None:
+        renderer_globals = globals_factory(system)
+        if renderer_globals:
+            system.update(renderer_globals)
+    registry.notify(BeforeRender(system))
+    return system
+
+def render_many(path, values, request=None, processes=None, chunksize=1):
+    """ Render the template implied by the ``path`` argument (as with
+    :func:`render_template`) once for each dictionary of top-level names
+    in the iterable ``values`` and return an iterator over the resulting
+    strings.  The renderer is looked up, its template compiled and the
+    system values computed (see :func:`system_values`) only once, so
+    :class:`pyramid.events.BeforeRender` subscribers are notified once
+    for the whole batch.  See :meth:`GenshiTemplateRenderer.render_many`
+    for ``processes`` and ``chunksize``; the template must be a
+    ``chameleon.genshi`` template."""
+    helper = renderer_helper(path)
+    system = system_values(helper, request)
+    return helper.get_renderer().render_many(values, system, processes,
+                                             chunksize)
+
+def configure_render_executor(max_workers=4):
+    """ Replace the executor used by :func:`async_render_template` and
+    :func:`async_stream_template` by a new
+    :class:`pyramid_chameleon_genshi.executor.RenderExecutor` running at
+    most ``max_workers`` threads, and return it.  The previous executor
+    finishes the renders already submitted to it."""
+    executor = RenderExecutor(max_workers)
+    previous, GenshiTemplateRenderer.executor = \
+        GenshiTemplateRenderer.executor, executor
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return executor
+
+def get_render_executor():
+    """ Return the executor used by :func:`async_render_template` and
+    :func:`async_stream_template`, creating it if necessary."""
+    executor = GenshiTemplateRenderer.executor
+    if executor is None:
+        executor = configure_render_executor()
+    return executor
+
+def async_render_template(path, **kw):
+    """ Like :func:`render_template`, but render the template in a thread
+    of the render executor (see :func:`get_render_executor`) and return a
+    :class:`pyramid_chameleon_genshi.executor.RenderFuture` for the
+    resulting string without blocking."""
+    request = kw.pop('request', None)
+    helper = renderer_helper(path)
+    threadlocals = {'registry':helper.registry, 'request':request}
+    return get_render_executor().submit(call_with_threadlocals, threadlocals,
+                                        helper.render, kw, None,
+                                        request=request)
+
+def async_stream_template(path, encoding='utf-8', chunk_size=8192, **kw):
+    """ Like :func:`async_render_template`, but the result of the returned
+    future is an iterator over the result encoded using ``encoding`` in
+    chunks of ``chunk_size`` characters, as returned by
+    :meth:`GenshiTemplateRenderer.stream`."""
+    request = kw.pop('request', None)
+    helper = renderer_helper(path)
+    system = system_values(helper, request)
+    threadlocals = {'registry':helper.registry, 'request':request}
+    return get_render_executor().submit(call_with_threadlocals, threadlocals,
+                                        helper.get_renderer().stream, kw,
+                                        system, encoding, chunk_size)
+
+def call_with_threadlocals(threadlocals, func, *arg, **kw):
+    """ Return ``func(*arg, **kw)``, called with the dictionary
+    ``threadlocals`` (holding a ``registry`` and a ``request``) pushed as
+    the :mod:`pyramid` thread-locals, as a render made in another thread
+    needs them: the translation of ``TranslationString`` values, the
+    :class:`pyramid.events.BeforeRender` subscribers and the renderer
+    globals factory look them up."""
+    manager.push(threadlocals)
+    try:
+        return func(*arg, **kw)
+    finally:
+        manager.pop()
 
 class XIncludes(object):
     """Dynamic XInclude registry providing a ``get``-method that will
     resolve a filename to a template instance. Format must be
-    explicitly provided."""
-    
+    explicitly provided.
+
+    Every template has one, so instances have no ``__dict__``, only the
+    slots below.
+
+    Resolved filenames are memoized per ``(relpath, filename)`` in the
+    class attribute ``resolved``, so that including the same file again
+    costs a single dictionary lookup.  Resource specifications included
+    by a template with ``auto_reload`` enabled are resolved every time,
+    so that changes to the resources they denote are noticed.
+
+    Every include resolved is recorded in the class attribute
+    ``dependencies``, a
+    :class:`pyramid_chameleon_genshi.dependencies.DependencyGraph` (see
+    :func:`get_dependencies`)."""
+
+    __slots__ = ('registry', 'relpath', 'factory', 'auto_reload', 'metrics',
+                 'output_cache', 'filename')
+    resolved = {}
+    dependencies = DependencyGraph()
+
     def __init__(self, registry, relpath, factory):
         self.registry = registry
         self.relpath = relpath
         self.factory = factory
+        template = getattr(factory, 'im_self', None)
+        self.auto_reload = getattr(template, 'auto_reload', False)
+        self.metrics = getattr(template, 'metrics', None)
+        self.output_cache = getattr(template, 'output_cache', None)
+        self.filename = getattr(template, 'filename', None)
 
     def get(self, filename, format):
+        key = self.relpath, filename
+        path = self.resolved.get(key)
+        if path is None:
+            path = self.resolve(filename)
+            if not (self.auto_reload and self.is_resource_spec(filename)):
+                self.resolved[key] = path
+        if self.filename is not None:
+            self.dependencies.add(self.filename, path)
+        if self.metrics is not None:
+            self.metrics.included(self.filename, path)
+        share = getattr(self.registry, 'share', None)
+        if share is not None:
+            template = share(path, lambda: self.factory(path, format=format))
+        else:
+            template = self.registry.get(path)
+            if template is None:
+                template = self.factory(path, format=format)
+        if self.output_cache is not None:
+            return self.output_cache.fragment(path, template)
+        return template
+
+    def including(self, filename):
+        """ Return a copy of this object which resolves includes the same
+        way, but records them as includes of the template ``filename``:
+        the XIncludes of a template included by ours, whose own includes
+        are resolved relative to our template."""
+        result = object.__new__(type(self))
+        for name in XIncludes.__slots__:
+            setattr(result, name, getattr(self, name))
+        result.filename = filename
+        return result
+
+    def resolve(self, filename):
+        """ Return the normalized absolute filename implied by the
+        ``filename`` of an include."""
         if not os.path.isabs(filename):
             if ':' in filename:
                 # it's a resource spec
@@ -127,17 +1051,232 @@ class XIncludes(object):
             else:
                 # it's a relative filename
                 filename = os.path.join(self.relpath, filename)
-        filename = os.path.normpath(filename)
-        template = self.registry.get(filename)
-        if template is not None:
-            return template
-        return self.factory(filename, format=format)
+        return os.path.normpath(filename)
+
+    def is_resource_spec(self, filename):
+        return ':' in filename and not os.path.isabs(filename)
+
+    @classmethod
+    def clear(cls):
+        """ Forget all memoized filename resolutions."""
+        cls.resolved.clear()
 
     @classmethod
     def activate(cls):
         from chameleon.core.template import TemplateFile
         TemplateFile.xincludes_class = cls # monkey patch ourselves in
 
+# our templates always resolve their XIncludes through the class above
+PyramidGenshiTemplateFile.xincludes_class = XIncludes
+
+def get_dependencies():
+    """ Return the
+    :class:`pyramid_chameleon_genshi.dependencies.DependencyGraph` of the
+    XIncludes resolved so far, keyed by normalized filename."""
+    return XIncludes.dependencies
+
+def invalidate_template(path, registry=None):
+    """ Take notice that the source of the template file at ``path`` has
+    changed, e.g. when told so by a file watcher, and return the set of
+    the filenames of the templates affected: ``path`` and every template
+    including it (see :meth:`DependencyGraph.dependents
+    <pyramid_chameleon_genshi.dependencies.DependencyGraph.dependents>`).
+
+    The modification time of the file is checked again on its next render
+    (even when ``chameleon_genshi.reload_interval`` is set), so a template
+    with ``auto_reload`` on is reloaded then; the includes it records are
+    forgotten until that render.  If ``registry`` is given, the output
+    cached by its :class:`TemplateOutputCache` for the affected templates
+    is no longer used.  Templates which are not affected are left
+    alone."""
+    path = os.path.normpath(path)
+    dependencies = XIncludes.dependencies
+    affected = dependencies.dependents(path)
+    affected.add(path)
+    dependencies.remove(path)
+    PyramidGenshiTemplateFile.mtimes.forget(path)
+    if registry is not None:
+        output_cache = registry.queryUtility(ITemplateOutputCache)
+        invalidate = getattr(output_cache, 'invalidate', None)
+        if invalidate is not None:
+            invalidate(affected)
+    return affected
+
+class OutputCachePolicy(object):
+    """ Describes how the output of one template is cached: under a key
+    made of the values of the names in ``vary`` and of the result of the
+    ``cache_key`` callable (if any) called with the dictionary of values
+    the template is rendered with, for ``ttl`` seconds (forever if ``0``).
+    If ``cache_key`` returns ``None``, the output is not cached.  Unless
+    ``gzip_level`` is ``None``, a copy of the output compressed at that
+    zlib level (from 1, fastest, to 9, smallest) is cached along with it
+    (see :func:`compress_output`)."""
+    generation = 0 # see TemplateOutputCache.invalidate
+
+    def __init__(self, vary=(), cache_key=None, ttl=0, gzip_level=None):
+        self.vary = tuple(vary)
+        self.cache_key = cache_key
+        self.ttl = ttl
+        self.gzip_level = gzip_level
+
+    def key(self, path, values):
+        """ Return the key for the output of the template at ``path``
+        rendered with ``values`` or ``None``."""
+        parts = [path, self.generation]
+        for name in self.vary:
+            parts.append(values.get(name))
+        if self.cache_key is not None:
+            custom = self.cache_key(values)
+            if custom is None:
+                return None
+            parts.append(custom)
+        return sha(repr(parts)).hexdigest()
+
+class TemplateOutputCache(object):
+    """ Caches the output of the templates for which a policy was added
+    in ``backend``, an object providing
+    :class:`pyramid_chameleon_genshi.interfaces.IOutputCache` (by default
+    an in-process :class:`pyramid_chameleon_genshi.cache.OutputCache`)."""
+    implements(ITemplateOutputCache)
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = OutputCache()
+        self.backend = backend
+        self.policies = {}
+
+    def add(self, path, vary=(), cache_key=None, ttl=0, gzip_level=None):
+        """ Cache the output of the template at the absolute filename
+        ``path``, see :class:`OutputCachePolicy`."""
+        self.policies[os.path.normpath(path)] = OutputCachePolicy(
+            vary, cache_key, ttl, gzip_level)
+
+    def compresses(self, path):
+        """ Return whether the output of the template at ``path`` is
+        cached with a ``gzip_level``."""
+        policy = self.policies.get(os.path.normpath(path))
+        return policy is not None and policy.gzip_level is not None
+
+    def render(self, path, render, values):
+        policy = self.policies.get(os.path.normpath(path))
+        if policy is None:
+            return render(values)
+        key = policy.key(path, values)
+        if key is None:
+            return render(values)
+        result = self.backend.get(key)
+        if result is None:
+            result = render(values)
+            self.store(policy, key, result)
+        return result
+
+    def render_gzip(self, path, render, values):
+        """ Return a ``(text, body, etag)`` tuple for the output of the
+        template at ``path`` rendered with ``values``.  If the output is
+        cached with a ``gzip_level``, ``text`` is ``None`` and ``body`` and
+        ``etag`` are those of the compressed copy cached along with it
+        (see :func:`compress_output`), which is made from the cached
+        output if it was evicted alone.  Otherwise ``text`` is the output,
+        as returned by :meth:`render`, and ``body`` and ``etag`` are
+        ``None``."""
+        policy = self.policies.get(os.path.normpath(path))
+        key = None
+        if policy is not None and policy.gzip_level is not None:
+            key = policy.key(path, values)
+        if key is None:
+            return self.render(path, render, values), None, None
+        compressed = self.backend.get(key + ':gzip')
+        if compressed is None:
+            result = self.backend.get(key)
+            if result is None:
+                result = render(values)
+                self.backend.set(key, result, policy.ttl)
+            compressed = compress_output(result, policy.gzip_level)
+            self.backend.set(key + ':gzip', compressed, policy.ttl)
+        return None, compressed[40:], compressed[:40]
+
+    def store(self, policy, key, result):
+        """ Cache ``result`` under ``key`` as ``policy`` says, with its
+        compressed copy if any.  Both are replaced together, so that the
+        copy never outlives the output it was made from."""
+        self.backend.set(key, result, policy.ttl)
+        if policy.gzip_level is not None:
+            self.backend.set(key + ':gzip',
+                             compress_output(result, policy.gzip_level),
+                             policy.ttl)
+
+    def invalidate(self, paths):
+        """ Stop using the output cached so far for the templates at the
+        absolute filenames ``paths``.  The keys of their policies change,
+        so entries already stored are left to expire from the backend;
+        other processes sharing the backend keep using them."""
+        for path in paths:
+            policy = self.policies.get(os.path.normpath(path))
+            if policy is not None:
+                policy.generation += 1
+
+    def fragment(self, path, template):
+        if os.path.normpath(path) not in self.policies:
+            return template
+        return CachedFragment(self, path, template)
+
+def compress_output(text, level=6):
+    """ Return the gzip-compressed UTF-8 encoding of ``text`` at the zlib
+    ``level``, preceded by the 40 characters of the SHA-1 hex digest of the
+    encoding, which serves as its ``ETag``.  The result is a plain string,
+    so that any ``IOutputCache`` can store it; the gzip header has no
+    timestamp, so compressing the same text again gives the same
+    result."""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return sha(text).hexdigest() + compressor.compress(text) + \
+           compressor.flush()
+
+class CachedFragment(object):
+    """ Stands in for an XIncluded ``template`` whose output is cached
+    by ``output_cache``."""
+    def __init__(self, output_cache, path, template):
+        self.output_cache = output_cache
+        self.path = path
+        self.template = template
+
+    def render_xinclude(self, **kwargs):
+        # the included template writes to the output stream of the
+        # including one; have it write to a stream of its own instead
+        from chameleon.core.generation import BufferIO
+        def render(values):
+            out = BufferIO()
+            kwargs['_out'], kwargs['_write'] = out, out.write
+            self.template.render_xinclude(**kwargs)
+            return out.getvalue()
+        write = kwargs['_write']
+        values = dict(kwargs.get('econtext') or {})
+        values.update(kwargs)
+        write(self.output_cache.render(self.path, render, values))
+
+def get_output_cache(registry):
+    """ Return the :class:`TemplateOutputCache` registered in
+    ``registry``, creating and registering one if there is none."""
+    output_cache = registry.queryUtility(ITemplateOutputCache)
+    if output_cache is None:
+        output_cache = TemplateOutputCache()
+        registry.registerUtility(output_cache, ITemplateOutputCache)
+    return output_cache
+
+def add_genshi_output_cache(config, spec, vary=(), cache_key=None, ttl=0,
+                            gzip_level=None):
+    """ Configuration directive caching the output of the template
+    named by ``spec`` (an absolute filename or a :term:`resource
+    specification`, relative to the package being configured) whenever
+    it is rendered by its renderer or XIncluded.  See
+    :class:`OutputCachePolicy` for ``vary``, ``cache_key``, ``ttl`` and
+    ``gzip_level``."""
+    pname = getattr(config.package, '__name__', '__main__')
+    path = abspath_from_resource_spec(spec, pname)
+    get_output_cache(config.registry).add(path, vary, cache_key, ttl,
+                                          gzip_level)
+
 def resolve_resource_spec(spec, pname='__main__'):
     if os.path.isabs(spec):
         return None, spec
@@ -156,6 +1295,400 @@ def abspath_from_resource_spec(spec, pname='__main__'):
         return filename
     return pkg_resources.resource_filename(pname, filename)
 
+def aslist(value):
+    """ Return ``value`` as a list of strings.  Strings (e.g. values read
+    from an ``.ini`` file) are split on whitespace, which includes
+    newlines."""
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        return value.split()
+    return list(value)
+
+def cook(template, macro=None, global_scope=True):
+    """ Compile ``template`` (a Chameleon template instance) for the
+    given ``macro`` and ``global_scope`` without rendering it and return
+    the compiled render function.  The defaults correspond to a plain
+    top-level render of the template; use ``macro=''`` and
+    ``global_scope=False`` for the function used when the template is
+    pulled in through an XInclude."""
+    key = macro, global_scope, template.signature
+    registry = template.registry
+    if key not in registry:
+        template.acquire()
+        try:
+            source = template.compiler(macro, global_scope)
+        finally:
+            template.release()
+        registry.add(key, source, template.filename)
+    return registry[key]
+
+def find_templates(spec, extension='.genshi'):
+    """ Yield ``(spec, abspath)`` pairs for every template file ending in
+    ``extension`` implied by ``spec``.  ``spec`` may be an absolute
+    filename, an absolute directory name or a :term:`resource
+    specification` naming a file or a directory; directories are walked
+    recursively.  The first element of each pair is the name under which
+    :mod:`pyramid` will look the template up (a resource specification if
+    ``spec`` was one, otherwise the absolute filename)."""
+    pname, filename = resolve_resource_spec(spec, None)
+    abspath = abspath_from_resource_spec(spec, pname)
+    if not os.path.isdir(abspath):
+        yield spec, abspath
+        return
+    for dirpath, dirnames, filenames in os.walk(abspath):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.endswith(extension):
+                continue
+            path = os.path.join(dirpath, name)
+            if pname is None:
+                yield path, path
+            else:
+                relpath = path[len(abspath):].lstrip(os.sep)
+                relpath = relpath.replace(os.sep, '/')
+                relpath = posixpath.join(filename, relpath)
+                yield '%s:%s' % (pname, relpath), path
+
+def get_lookup(registry, type='.genshi'):
+    """ Return the Chameleon renderer lookup :mod:`pyramid` uses for
+    templates of the renderer type ``type``, creating and registering it
+    if it does not exist yet."""
+    lookup = registry.queryUtility(IChameleonLookup, name=type)
+    if lookup is None:
+        lookup = renderers.ChameleonRendererLookup(GenshiTemplateRenderer,
+                                                   registry)
+        registry.registerUtility(lookup, IChameleonLookup, name=type)
+    return lookup
+
+def get_renderers(registry, specs, type='.genshi'):
+    """ Return the renderers for every template implied by the list of
+    ``specs`` (see :func:`find_templates`), creating and registering them
+    as necessary so that a later renderer lookup hands back the same
+    renderer."""
+    settings = registry.settings or {}
+    reload_assets = asbool(settings.get('reload_assets'))
+    lookup = get_lookup(registry, type)
+    result = []
+    for spec in specs:
+        for name, abspath in find_templates(spec, type):
+            renderer = registry.queryUtility(ITemplateRenderer, name=abspath)
+            if renderer is None:
+                renderer = GenshiTemplateRenderer(abspath, lookup)
+                registry.registerUtility(renderer, ITemplateRenderer,
+                                         name=abspath)
+            if name != abspath and not reload_assets:
+                registry.registerUtility(renderer, ITemplateRenderer,
+                                         name=name)
+            result.append(renderer)
+    return result
+
+def precompile(registry, specs, type='.genshi'):
+    """ Compile every template implied by the list of ``specs`` (see
+    :func:`find_templates`) and register a renderer for each of them, so
+    that a later renderer lookup hands back an already compiled template
+    instead of compiling it during the first request.  Returns the list of
+    renderers."""
+    result = get_renderers(registry, specs, type)
+    for renderer in result:
+        cook(renderer.template)
+    return result
+
+def preload(config, specs=None, type='.genshi'):
+    """ Compile every template implied by the list of ``specs`` (by
+    default, the ``chameleon_genshi.precompile_paths`` setting), both for
+    top-level renders and for being XIncluded, and register a renderer for
+    each of them.  Meant to be called in the master process of a
+    preforking server, after the configuration is complete and before
+    workers are forked, so that the compiled templates live in memory
+    shared by all workers.  On Python versions which have ``gc.freeze``,
+    the objects allocated so far are then moved out of reach of the
+    garbage collector, whose scans would otherwise touch (and so copy)
+    the shared pages.  Returns the list of renderers."""
+    registry = config.registry
+    if specs is None:
+        settings = registry.settings or {}
+        specs = aslist(settings.get('chameleon_genshi.precompile_paths'))
+    result = get_renderers(registry, specs, type)
+    for renderer in result:
+        template = renderer.template
+        cook(template)
+        cook(template, '', False)
+    gc.collect()
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None: # pragma: no cover
+        freeze()
+    return result
+
+class WarmUpReport(object):
+    """ The outcome of :func:`warm_up`: ``renderers`` is the list of
+    renderers warmed up, ``results`` a list of ``(path, seconds, error)``
+    tuples, one per template, where ``error`` describes the exception
+    raised while compiling the template or is ``None``, and ``seconds`` is
+    the wall clock time the whole warm-up took."""
+    def __init__(self, renderers, results, seconds):
+        self.renderers = renderers
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def errors(self):
+        return [(path, error) for path, seconds, error in self.results
+                if error is not None]
+
+    def slowest(self, number=10):
+        """ Return the ``number`` results which took longest."""
+        results = sorted(self.results, key=lambda result: -result[1])
+        return results[:number]
+
+    def format(self, number=10):
+        """ Return the report as text listing the ``number`` slowest
+        templates and every error."""
+        lines = ['%d templates compiled in %.3fs, %d errors' % (
+            len(self.results), self.seconds, len(self.errors))]
+        for path, seconds, error in self.slowest(number):
+            lines.append('%8.3fs  %s' % (seconds, path))
+        for path, error in self.errors:
+            lines.append('   ERROR  %s: %s' % (path, error))
+        return '\n'.join(lines) + '\n'
+
+def generate_source(args):
+    """ Return a ``(signature, debug, source, seconds, error)`` tuple
+    holding the Python source Chameleon generates for a top-level render
+    of the template at ``path`` with the ``debug`` setting, the template's
+    signature, the setting, the time it took and a description of the
+    error raised, if any, in which case ``source`` is ``None``.  ``args``
+    is the ``(path, debug)`` tuple (a single argument, to suit
+    ``Pool.map``).  Used by :func:`warm_up` in child processes."""
+    path, debug = args
+    debug = bool(debug)
+    start = timer()
+    try:
+        template = PyramidGenshiTemplateFile(path, debug=debug)
+        template.acquire()
+        try:
+            source = template.compiler(None, True)
+        finally:
+            template.release()
+    except Exception, e:
+        return None, debug, None, timer() - start, '%s: %s' % (
+            e.__class__.__name__, e)
+    return template.signature, debug, source, timer() - start, None
+
+def warm_up_renderer(renderer, generated=None):
+    """ Compile the template of ``renderer`` for a top-level render,
+    using the output of :func:`generate_source` if it is given and
+    matches the template (its signature and ``debug`` setting, which
+    changes the code generated but not the signature), and return a
+    ``(path, seconds, error)`` tuple."""
+    start = timer()
+    try:
+        if generated is not None:
+            signature, debug, source, seconds, error = generated
+            if error is not None:
+                return renderer.path, timer() - start + seconds, error
+            start -= seconds
+            # the template the renderer loads below, if it is shared
+            template = renderer.make_template()
+            key = None, True, signature
+            if signature == template.signature and \
+                   bool(template.debug) == debug and \
+                   key not in template.registry:
+                template.registry.add(key, source, template.filename)
+        cook(renderer.template)
+    except Exception, e:
+        return renderer.path, timer() - start, '%s: %s' % (
+            e.__class__.__name__, e)
+    return renderer.path, timer() - start, None
+
+def warm_up(registry, specs, type='.genshi', threads=None, processes=None,
+            out=None, strict=False):
+    """ Like :func:`precompile`, compile every template implied by the
+    list of ``specs`` and register a renderer for each, but do so
+    concurrently and return a :class:`WarmUpReport`.
+
+    If ``processes`` is given, Chameleon translates the templates into
+    Python source in a pool of that many processes (which sidesteps the
+    global interpreter lock); the source is then compiled and registered
+    in this process.  Otherwise the templates are compiled by ``threads``
+    threads (in this thread if ``None`` or ``1``).  Chameleon imports
+    modules while compiling, so if this thread holds the import lock, as
+    it does when the application is configured while a module is
+    imported (e.g. a WSGI server importing ``module:app``), threads and
+    processes would wait for it forever: the templates are then compiled
+    in this thread.  The report is written to ``out`` if it is
+    given.  If ``strict`` is true, a ``RuntimeError`` listing the
+    templates which failed to compile is raised after all templates have
+    been tried."""
+    start = timer()
+    renderers = get_renderers(registry, specs, type)
+    if imp.lock_held():
+        processes = threads = None
+    if processes and len(renderers) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            generated = pool.map(generate_source,
+                                 [(renderer.path, renderer.lookup.debug)
+                                  for renderer in renderers])
+        finally:
+            pool.close()
+            pool.join()
+        results = map(warm_up_renderer, renderers, generated)
+    else:
+        results = warm_up_threads(renderers, threads or 1)
+    report = WarmUpReport(renderers, results, timer() - start)
+    if out is not None:
+        out.write(report.format())
+    if strict and report.errors:
+        raise RuntimeError('Templates failed to compile:\n%s' % '\n'.join(
+            ['%s: %s' % error for error in report.errors]))
+    return report
+
+def warm_up_threads(renderers, threads):
+    """ Call :func:`warm_up_renderer` for each of ``renderers`` in
+    ``threads`` threads (in this thread if ``threads`` is ``1``) and
+    return the list of results."""
+    if threads == 1:
+        return map(warm_up_renderer, renderers)
+    results = [None] * len(renderers)
+    indexes = range(len(renderers))
+    indexes.reverse()
+    def work():
+        while True:
+            try:
+                index = indexes.pop()
+            except IndexError:
+                return
+            results[index] = warm_up_renderer(renderers[index])
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
 def includeme(config):
+    """ Register the ``.genshi`` renderer.  If the
+    ``chameleon_genshi.precompile`` setting is true, every template
+    implied by the ``chameleon_genshi.precompile_paths`` setting (a
+    whitespace-separated list of resource specifications or absolute
+    paths naming template files or directories) is compiled when the
+    configuration is committed.  If ``chameleon_genshi.precompile_threads``
+    or ``chameleon_genshi.precompile_processes`` is set, they are compiled
+    concurrently by :func:`warm_up`, which writes its report to standard
+    error if ``chameleon_genshi.precompile_report`` is true.
+
+    If the ``chameleon_genshi.cache_dir`` setting names a directory, the
+    code generated for templates is stored there and reused by every
+    process configured with the same directory (see
+    :class:`pyramid_chameleon_genshi.cache.CompiledTemplateCache`).
+
+    The ``chameleon_genshi.xinclude_cache_max_entries`` and
+    ``chameleon_genshi.xinclude_cache_max_bytes`` settings bound the
+    number and total source size of the templates held for resolving
+    XIncludes (see :func:`configure_xinclude_cache`).
+
+    The ``chameleon_genshi.metrics`` setting enables per-template render
+    metrics: ``registry`` accumulates them in memory (see
+    :class:`pyramid_chameleon_genshi.metrics.MetricsRegistry`) and
+    ``statsd`` sends them to the statsd daemon at
+    ``chameleon_genshi.statsd_host`` and ``chameleon_genshi.statsd_port``
+    using the ``chameleon_genshi.statsd_prefix`` prefix.  With
+    ``registry``, the ``chameleon_genshi.metrics_path`` setting adds a
+    view at that URL path returning the metrics as JSON.  The
+    ``chameleon_genshi.templates_path`` setting adds a view at that URL
+    path returning the memory report of the loaded templates as JSON (see
+    :func:`pyramid_chameleon_genshi.memory.templates_view`); like the
+    metrics view, it should only be exposed to trusted clients.
+
+    The ``add_genshi_output_cache`` directive is added to the
+    configurator (see :func:`add_genshi_output_cache`).  Cached output is
+    kept in a :class:`pyramid_chameleon_genshi.cache.OutputCache` bounded
+    by the ``chameleon_genshi.output_cache_max_entries`` (default 1000)
+    and ``chameleon_genshi.output_cache_max_bytes`` settings.
+
+    The ``chameleon_genshi.profile`` setting enables the profiling of the
+    renders made on behalf of requests whose ``genshi_profile`` attribute
+    is true, and the ``chameleon_genshi.profile_header`` setting enables
+    it for requests carrying that header with the value of the
+    ``chameleon_genshi.profile_header_secret`` setting as well, which is
+    then required (see :mod:`pyramid_chameleon_genshi.profiler`).
+
+    The ``chameleon_genshi.render_threads`` setting is the number of
+    threads used by :func:`async_render_template` and
+    :func:`async_stream_template` (see
+    :func:`configure_render_executor`)."""
     config.add_renderer('.genshi', renderer_factory)
-    
+    config.add_directive('add_genshi_output_cache', add_genshi_output_cache)
+    settings = config.registry.settings or {}
+    cache_dir = settings.get('chameleon_genshi.cache_dir')
+    if cache_dir:
+        config.registry.registerUtility(CompiledTemplateCache(cache_dir),
+                                        ICompiledTemplateCache)
+    max_entries = settings.get('chameleon_genshi.xinclude_cache_max_entries')
+    max_bytes = settings.get('chameleon_genshi.xinclude_cache_max_bytes')
+    if max_entries or max_bytes:
+        configure_xinclude_cache(max_entries and int(max_entries) or None,
+                                 max_bytes and int(max_bytes) or None)
+    max_entries = settings.get('chameleon_genshi.output_cache_max_entries')
+    max_bytes = settings.get('chameleon_genshi.output_cache_max_bytes')
+    if max_entries or max_bytes:
+        get_output_cache(config.registry).backend = OutputCache(
+            max_entries and int(max_entries) or None,
+            max_bytes and int(max_bytes) or None)
+    render_threads = settings.get('chameleon_genshi.render_threads')
+    if render_threads:
+        configure_render_executor(int(render_threads))
+    if asbool(settings.get('chameleon_genshi.precompile')):
+        specs = aslist(settings.get('chameleon_genshi.precompile_paths'))
+        threads = settings.get('chameleon_genshi.precompile_threads')
+        processes = settings.get('chameleon_genshi.precompile_processes')
+        if threads or processes:
+            out = None
+            if asbool(settings.get('chameleon_genshi.precompile_report')):
+                out = sys.stderr
+            config.action(None, warm_up, args=(config.registry, specs), kw={
+                'threads':threads and int(threads) or None,
+                'processes':processes and int(processes) or None,
+                'out':out,
+                'strict':True,
+                })
+        else:
+            config.action(None, precompile, args=(config.registry, specs))
+    metrics = settings.get('chameleon_genshi.metrics')
+    if metrics == 'registry':
+        from pyramid_chameleon_genshi.metrics import MetricsRegistry
+        from pyramid_chameleon_genshi.metrics import metrics_view
+        config.registry.registerUtility(MetricsRegistry(), ITemplateMetrics)
+        metrics_path = settings.get('chameleon_genshi.metrics_path')
+        if metrics_path:
+            config.add_route('chameleon_genshi.metrics', metrics_path)
+            config.add_view(metrics_view, route_name='chameleon_genshi.metrics',
+                            renderer='json')
+    elif metrics == 'statsd':
+        from pyramid_chameleon_genshi.metrics import StatsdMetrics
+        utility = StatsdMetrics(
+            settings.get('chameleon_genshi.statsd_host', '127.0.0.1'),
+            settings.get('chameleon_genshi.statsd_port', 8125),
+            settings.get('chameleon_genshi.statsd_prefix', 'genshi'))
+        config.registry.registerUtility(utility, ITemplateMetrics)
+    elif metrics:
+        raise ValueError('unknown chameleon_genshi.metrics setting: %r'
+                         % metrics)
+    profile_header = settings.get('chameleon_genshi.profile_header')
+    if profile_header:
+        from pyramid_chameleon_genshi.profiler import HeaderActivation
+        secret = settings.get('chameleon_genshi.profile_header_secret')
+        config.add_subscriber(HeaderActivation(profile_header, secret),
+                              NewRequest)
+    if profile_header or asbool(settings.get('chameleon_genshi.profile')):
+        PyramidGenshiTemplateFile.profiling = True
+    templates_path = settings.get('chameleon_genshi.templates_path')
+    if templates_path:
+        from pyramid_chameleon_genshi.memory import templates_view
+        config.add_route('chameleon_genshi.templates', templates_path)
+        config.add_view(templates_view,
+                        route_name='chameleon_genshi.templates',
+                        renderer='json')
+
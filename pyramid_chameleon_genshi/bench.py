@@ -0,0 +1,572 @@
+""" Benchmarks for compiling and rendering ``chameleon.genshi`` templates
+through :mod:`pyramid_chameleon_genshi`.
+
+Run ``python -m pyramid_chameleon_genshi.bench`` (or the ``pgenshi-bench``
+console script) to print a JSON report; save reports made with different
+versions and pass one of them to ``--compare`` to see the relative change
+of each timing.
+"""
+import gc
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import pkg_resources
+from translationstring import ChameleonTranslate
+from translationstring import TranslationStringFactory
+from translationstring import Translator
+
+try:
+    import json
+except ImportError: # pragma: no cover
+    import simplejson as json
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    resource = None
+
+from pyramid.interfaces import IChameleonTranslate
+
+from pyramid_chameleon_genshi import GenshiTemplateRenderer
+from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+from pyramid_chameleon_genshi import XIncludes
+from pyramid_chameleon_genshi import configure_xinclude_cache
+from pyramid_chameleon_genshi import cook
+from pyramid_chameleon_genshi import get_renderer
+from pyramid_chameleon_genshi import get_xinclude_cache
+from pyramid_chameleon_genshi import preload
+from pyramid_chameleon_genshi import render_template
+from pyramid_chameleon_genshi import renderer_factory
+from pyramid_chameleon_genshi.cache import CHAMELEON_VERSION
+
+here = os.path.abspath(os.path.dirname(__file__))
+templates = os.path.join(here, 'bench_templates')
+
+def loop_values():
+    rows = []
+    for i in range(500):
+        rows.append({'id':i, 'name':'Item %d' % i, 'owner':'user%d' % (i % 7),
+                     'size':i * 1024, 'active':i % 3 != 0})
+    return {'title':'Inventory', 'rows':rows}
+
+_ = TranslationStringFactory('bench')
+
+# chameleon.genshi ignores i18n:translate and friends, so the i18n page
+# translates the way pyramid applications do: its values are translation
+# strings, which the translate function of the Lookup below looks up in
+# this catalog and interpolates
+CATALOG = {
+    u'overview':u'Konto\xfcbersicht',
+    u'welcome':u'Willkommen zur\xfcck, ${user}.',
+    u'message':u'Sie haben eine Nachricht von ${sender} zum Thema '
+                u'${subject}.',
+    u'thanks':u'Vielen Dank, dass Sie unseren Dienst nutzen.',
+    u'questions':u'Fragen? Wenden Sie sich an unser Support-Team.',
+    }
+for i in range(50):
+    CATALOG[u'field-%d' % i] = u'Feld %d' % i
+
+class Translations(object):
+    """ The smallest ``gettext`` translations object."""
+    def ugettext(self, msgid):
+        return CATALOG.get(msgid, msgid)
+
+def i18n_values():
+    messages = []
+    for i in range(100):
+        messages.append(_(u'message',
+                          default=u'You have a message from ${sender} '
+                                  u'about ${subject}.',
+                          mapping={'sender':'sender%d' % i,
+                                   'subject':'Subject number %d' % i}))
+    fields = [(_(u'field-%d' % i, default=u'Field %d' % i), 'Value %d' % i)
+              for i in range(50)]
+    return {'title':_(u'overview', default=u'Account overview'),
+            'welcome':_(u'welcome', default=u'Welcome back, ${user}.',
+                        mapping={'user':'bob'}),
+            'messages':messages, 'fields':fields,
+            'thanks':_(u'thanks', default=u'Thank you for using our service.'),
+            'questions':_(u'questions', default=u'Questions? Contact the '
+                                                u'support team.')}
+
+def macros_values():
+    links = [('/section/%d' % i, 'Section %d' % i) for i in range(20)]
+    sections = []
+    for i in range(30):
+        items = [('Label %d' % j, 'Value %d.%d' % (i, j)) for j in range(10)]
+        sections.append(('Section %d' % i, items))
+    return {'title':'Dashboard', 'links':links, 'sections':sections}
+
+def include_values():
+    return {'title':'Nested', 'items':range(50)}
+
+def large_context_values():
+    values = {'title':'Large context', 'rows':loop_values()['rows'][:5]}
+    for i in range(2000):
+        values['extra%d' % i] = i
+    return values
+
+class Scenario(object):
+    """ A template (``filenames[0]``), the templates it XIncludes and a
+    function returning the values it is rendered with."""
+    def __init__(self, name, filenames, values):
+        self.name = name
+        self.filenames = filenames
+        self.values = values
+
+    @property
+    def paths(self):
+        return [os.path.join(templates, name) for name in self.filenames]
+
+    @property
+    def path(self):
+        return self.paths[0]
+
+SCENARIOS = [
+    Scenario('loop', ['loop.genshi'], loop_values),
+    Scenario('i18n', ['i18n.genshi'], i18n_values),
+    Scenario('macros', ['macros.genshi'], macros_values),
+    Scenario('xinclude_chain', ['include%d.genshi' % i for i in range(8)],
+             include_values),
+    Scenario('large_context', ['loop.genshi'], large_context_values),
+    ]
+
+class Lookup(object):
+    auto_reload = False
+    debug = False
+    translate = staticmethod(ChameleonTranslate(Translator(Translations())))
+
+def measure(func, number):
+    """ Call ``func`` ``number`` times and return a dictionary with the time
+    spent per call and the ``peak_objects`` and ``peak_bytes`` allocated
+    by one more call (see :func:`allocations`)."""
+    gc.collect()
+    timer = time.time
+    start = timer()
+    for i in xrange(number):
+        func()
+    elapsed = timer() - start
+    result = {
+        'number':number,
+        'seconds':elapsed / number,
+        'per_second':elapsed and number / elapsed or None,
+        }
+    result['peak_objects'], result['peak_bytes'] = allocations(func)
+    return result
+
+def allocations(func):
+    """ Return the number and size in bytes (as reported by
+    ``sys.getsizeof``) of the objects created by a call of ``func`` which
+    are alive at its peak, that is when most of them are.  Only objects
+    tracked by the garbage collector are counted: dictionaries, lists,
+    instances, frames and so on, but not strings nor the dictionaries
+    holding only strings and numbers, which Python 2.7 stops tracking.
+    Python 2 cannot trace allocations, so ``func`` is called twice with
+    garbage collection disabled: the first call, traced line by line,
+    finds when the number of objects the garbage collector has seen
+    allocated peaks; the second, traced the same way, lists the new
+    objects then.  Objects reused from the free lists Python keeps of a
+    few dozen recently freed lists, dictionaries and frames are not seen
+    by the first call, so small peaks may be missed."""
+    gettrace = getattr(sys, 'gettrace', lambda: None)
+    previous = gettrace()
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        counts = []
+        def count(frame, event, arg):
+            counts.append(gc.get_count()[0])
+            return count
+        sys.settrace(count)
+        try:
+            func()
+        finally:
+            sys.settrace(previous)
+        if not counts:
+            return 0, 0
+        peak = counts.index(max(counts))
+        gc.collect()
+        baseline = set([id(obj) for obj in gc.get_objects()])
+        state = {'event':0, 'result':(0, 0)}
+        def snapshot(frame, event, arg):
+            if state['event'] == peak:
+                objects = gc.get_objects()
+                ignored = set([id(objects), id(baseline), id(state),
+                               id(sys._getframe())])
+                new = [obj for obj in objects
+                       if id(obj) not in baseline and id(obj) not in ignored]
+                state['result'] = (len(new),
+                                   sum([sys.getsizeof(obj) for obj in new]))
+            state['event'] += 1
+            return snapshot
+        sys.settrace(snapshot)
+        try:
+            func()
+        finally:
+            sys.settrace(previous)
+        return state['result']
+    finally:
+        if enabled:
+            gc.enable()
+
+def max_rss():
+    """ Return the peak resident set size of this process in kilobytes or
+    ``None`` if it cannot be determined."""
+    if resource is None: # pragma: no cover
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def smaps():
+    """ Return the ``(shared, private)`` resident memory of this process
+    in kilobytes as reported by ``/proc/self/smaps`` or ``None`` if it is
+    not available."""
+    try:
+        f = open('/proc/self/smaps')
+    except (IOError, OSError):
+        return None
+    shared = private = 0
+    try:
+        for line in f:
+            if line.startswith('Shared_'):
+                shared += int(line.split()[1])
+            elif line.startswith('Private_'):
+                private += int(line.split()[1])
+    finally:
+        f.close()
+    return shared, private
+
+def fork_memory(preloaded, workers=2):
+    """ Fork a master process which sets up a fresh configuration,
+    :func:`pyramid_chameleon_genshi.preload` s the templates of every
+    scenario if ``preloaded`` is true and forks ``workers`` workers, each
+    of which renders every scenario once.  Return a dictionary holding the
+    average ``shared_kb`` and ``private_kb`` memory of the workers, or
+    ``None`` if it cannot be measured on this platform."""
+    if not hasattr(os, 'fork') or smaps() is None: # pragma: no cover
+        return None
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0: # pragma: no cover
+        try:
+            os.close(read)
+            os.write(write, json.dumps(fork_master(preloaded, workers)))
+        finally:
+            os._exit(0)
+    os.close(write)
+    data = read_all(read)
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+def read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(fd)
+    return ''.join(chunks)
+
+def fork_master(preloaded, workers): # pragma: no cover (runs in a child)
+    from pyramid import testing
+    from pyramid.renderers import render
+    configure_xinclude_cache()
+    XIncludes.clear()
+    config = testing.setUp()
+    config.add_renderer('.genshi', renderer_factory)
+    config.registry.registerUtility(Lookup.translate, IChameleonTranslate)
+    if preloaded:
+        preload(config, [templates])
+    pipes = []
+    for i in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read)
+                for scenario in SCENARIOS:
+                    render(scenario.path, scenario.values())
+                gc.collect()
+                os.write(write, json.dumps(smaps()))
+            finally:
+                os._exit(0)
+        os.close(write)
+        pipes.append((pid, read))
+    shared = private = 0
+    for pid, read in pipes:
+        worker_shared, worker_private = json.loads(read_all(read))
+        os.waitpid(pid, 0)
+        shared += worker_shared
+        private += worker_private
+    return {'shared_kb':shared // workers, 'private_kb':private // workers}
+
+def bench_compile(scenario, number):
+    """ Time loading and compiling every template of ``scenario`` from
+    scratch."""
+    def compile():
+        for path in scenario.paths:
+            template = PyramidGenshiTemplateFile(path)
+            cook(template)
+            cook(template, '', False)
+    return measure(compile, number)
+
+def bench_renderer(scenario, number):
+    """ Time warm renders through a :class:`GenshiTemplateRenderer`."""
+    renderer = GenshiTemplateRenderer(scenario.path, Lookup())
+    values = scenario.values()
+    renderer(values, {})
+    return measure(lambda: renderer(values, {}), number)
+
+def bench_renderer_unfolded(scenario, number):
+    """ Time the same renders as the ``renderer`` benchmark with templates
+    compiled without folding their static markup (see
+    :func:`pyramid_chameleon_genshi.fold_static_writes`)."""
+    original = get_xinclude_cache()
+    configure_xinclude_cache()
+    PyramidGenshiTemplateFile.fold_static = False
+    try:
+        return bench_renderer(scenario, number)
+    finally:
+        PyramidGenshiTemplateFile.fold_static = True
+        PyramidGenshiTemplateFile.global_registry = original
+
+def bench_renderer_inlined(scenario, number):
+    """ Time the same renders as the ``renderer`` benchmark with the
+    XIncludes of the templates inlined into their code (see
+    :meth:`pyramid_chameleon_genshi.PyramidGenshiTemplateFile.inline_includes`)."""
+    path = scenario.path
+    template = PyramidGenshiTemplateFile(path, inline_xincludes=True)
+    renderer = GenshiTemplateRenderer(path, Lookup())
+    renderer.template = template
+    values = scenario.values()
+    renderer(values, {})
+    return measure(lambda: renderer(values, {}), number)
+
+def bench_renderer_keywords(scenario, number):
+    """ Time warm renders the way renderers used to do them: merging the
+    values into the system dictionary and passing the result as keyword
+    arguments.  Compare with the ``renderer`` benchmark, see
+    :func:`keywords_extra_bytes`."""
+    renderer = GenshiTemplateRenderer(scenario.path, Lookup())
+    template = renderer.template
+    values = scenario.values()
+    def render():
+        system = {}
+        system.update(values)
+        return template(**system)
+    render()
+    return measure(render, number)
+
+def bench_render_template(scenario, number):
+    """ Time warm renders through :func:`render_template`, which includes
+    the cost of looking up the renderer."""
+    from pyramid import testing
+    config = testing.setUp()
+    try:
+        config.add_renderer('.genshi', renderer_factory)
+        config.registry.registerUtility(Lookup.translate, IChameleonTranslate)
+        path = scenario.path
+        values = scenario.values()
+        render_template(path, **values)
+        return measure(lambda: render_template(path, **values), number)
+    finally:
+        testing.tearDown()
+
+def bench_get_renderer(scenario, number, settings=None):
+    """ Time looking up the renderer of ``scenario`` through the
+    deprecated :func:`get_renderer` helper, which memoizes it per calling
+    module and path."""
+    from pyramid import testing
+    config = testing.setUp(settings=settings)
+    try:
+        config.add_renderer('.genshi', renderer_factory)
+        path = scenario.path
+        get_renderer(path)
+        return measure(lambda: get_renderer(path), number)
+    finally:
+        testing.tearDown()
+
+def bench_get_renderer_uncached(scenario, number):
+    """ Time the same lookups with ``reload_assets`` on, which disables
+    the memoization: every call looks up the calling package and sets up
+    a renderer helper, as all calls used to.  Compare with the
+    ``get_renderer`` benchmark."""
+    return bench_get_renderer(scenario, number, {'reload_assets':True})
+
+def bench_xincludes(scenario, number):
+    """ Time resolving the includes of ``scenario`` through
+    :meth:`XIncludes.get`."""
+    template = PyramidGenshiTemplateFile(scenario.path)
+    xincludes = XIncludes(get_xinclude_cache(), templates, template.clone)
+    filenames = scenario.filenames[1:]
+    def get():
+        for filename in filenames:
+            xincludes.get(filename, 'xml')
+    get()
+    return measure(get, number)
+
+def keywords_extra_bytes(result):
+    """ Return how many more bytes are alive at the peak of a render
+    passing the values as keyword arguments than at the peak of a
+    render through a renderer, according to the ``renderer_keywords`` and
+    ``renderer`` benchmarks in ``result``, or ``None`` if either is
+    missing.  This is the memory saved per request by not copying the
+    values."""
+    keywords = result.get('renderer_keywords')
+    renderer = result.get('renderer')
+    if keywords is None or renderer is None:
+        return None
+    return keywords['peak_bytes'] - renderer['peak_bytes']
+
+def instance_size(obj):
+    """ Return the size in bytes of ``obj`` and of its instance
+    dictionary, if it has one, but not of the objects they refer to."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def object_sizes():
+    """ Return a dictionary holding the memory (in bytes) held per loaded
+    template by the objects wrapping it: the ``renderer`` compiling and
+    rendering it (after a render) and the ``xincludes`` resolver of the
+    template, along with their ``total``."""
+    renderer = GenshiTemplateRenderer(os.path.join(templates, 'loop.genshi'),
+                                      Lookup())
+    renderer(loop_values(), {})
+    xincludes = renderer.template.xincludes
+    result = {
+        'renderer':instance_size(renderer),
+        'xincludes':instance_size(xincludes) +
+                    sys.getsizeof(xincludes.factory),
+        }
+    result['total'] = result['renderer'] + result['xincludes']
+    return result
+
+BENCHMARKS = [
+    ('compile', bench_compile),
+    ('renderer', bench_renderer),
+    ('renderer_unfolded', bench_renderer_unfolded),
+    ('renderer_inlined', bench_renderer_inlined),
+    ('renderer_keywords', bench_renderer_keywords),
+    ('render_template', bench_render_template),
+    ('get_renderer', bench_get_renderer),
+    ('get_renderer_uncached', bench_get_renderer_uncached),
+    ]
+
+def run(names=None, number=100, fork=False):
+    """ Run the scenarios named in ``names`` (all of them if ``None``) and
+    return the report as a dictionary, along with the ``object_bytes``
+    held per loaded template (see :func:`object_sizes`).  Compiling is
+    repeated a tenth as often as rendering.  If ``fork`` is true, the report also holds the
+    memory used by forked workers with and without preloading (see
+    :func:`fork_memory`)."""
+    try:
+        version = pkg_resources.get_distribution(
+            'pyramid_chameleon_genshi').version
+    except pkg_resources.DistributionNotFound: # pragma: no cover
+        version = None
+    report = {
+        'python':sys.version.split()[0],
+        'chameleon':CHAMELEON_VERSION,
+        'pyramid_chameleon_genshi':version,
+        'number':number,
+        'scenarios':{},
+        'object_bytes':object_sizes(),
+        }
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        result = {}
+        for name, bench in BENCHMARKS:
+            if name == 'compile':
+                result[name] = bench(scenario, max(1, number // 10))
+            else:
+                result[name] = bench(scenario, number)
+        if len(scenario.filenames) > 1:
+            result['xincludes_get'] = bench_xincludes(scenario, number)
+        result['keywords_extra_bytes'] = keywords_extra_bytes(result)
+        result['max_rss_kb'] = max_rss()
+        report['scenarios'][scenario.name] = result
+    if fork:
+        report['fork'] = {
+            'lazy':fork_memory(False),
+            'preloaded':fork_memory(True),
+            }
+    return report
+
+def compare(old, new):
+    """ Return a list of ``(scenario, benchmark, old seconds, new seconds,
+    ratio)`` tuples for every benchmark present in both reports."""
+    rows = []
+    for name, results in sorted(new['scenarios'].items()):
+        old_results = old.get('scenarios', {}).get(name, {})
+        for bench, result in sorted(results.items()):
+            if not isinstance(result, dict) or bench not in old_results:
+                continue
+            before = old_results[bench]['seconds']
+            after = result['seconds']
+            ratio = before and after / before or 0.0
+            rows.append((name, bench, before, after, ratio))
+    return rows
+
+def compare_objects(old, new):
+    """ Return a list of ``(object, old bytes, new bytes, ratio)`` tuples
+    for every object size (see :func:`object_sizes`) present in both
+    reports."""
+    rows = []
+    old_sizes = old.get('object_bytes') or {}
+    for name, after in sorted((new.get('object_bytes') or {}).items()):
+        if name not in old_sizes:
+            continue
+        before = old_sizes[name]
+        ratio = before and float(after) / before or 0.0
+        rows.append((name, before, after, ratio))
+    return rows
+
+def main(argv=sys.argv, out=sys.stdout):
+    parser = OptionParser(
+        usage='%prog [options] [scenario ...]',
+        description='Benchmark chameleon.genshi templates. Scenarios: ' +
+        ', '.join([scenario.name for scenario in SCENARIOS]) + '.')
+    parser.add_option('-n', '--number', type='int', default=100,
+                      help='number of renders per benchmark (default 100)')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='write the JSON report to FILE instead of stdout')
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help='compare the timings with an earlier JSON report')
+    parser.add_option('-f', '--fork', action='store_true', default=False,
+                      help='measure the shared and private memory of forked '
+                      'workers with and without preloading templates')
+    options, names = parser.parse_args(argv[1:])
+    known = [scenario.name for scenario in SCENARIOS]
+    for name in names:
+        if name not in known:
+            parser.error('unknown scenario: %s' % name)
+    report = run(names, options.number, options.fork)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            f.write(data + '\n')
+        finally:
+            f.close()
+    else:
+        out.write(data + '\n')
+    if options.compare:
+        f = open(options.compare)
+        try:
+            old = json.load(f)
+        finally:
+            f.close()
+        for row in compare_objects(old, report):
+            out.write('object_bytes     %-16s %12d  %12d  %7.2fx\n' % row)
+        for row in compare(old, report):
+            out.write('%-16s %-16s %12.6fs %12.6fs %7.2fx\n' % row)
+    return 0
+
+if __name__ == '__main__': # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,129 @@
+""" Compile ``chameleon.genshi`` templates ahead of time.
+
+Run ``pgenshi-compile -d DIRECTORY SPEC ...`` (or ``python -m
+pyramid_chameleon_genshi.build``) to compile every template implied by the
+resource specifications, package names or directories given, storing the
+generated code in ``DIRECTORY``.  Point the ``chameleon_genshi.cache_dir``
+setting of the application at the same directory to have it load the
+compiled code instead of compiling templates while serving requests.  The
+exit status is non-zero if any template failed to compile.
+"""
+import os
+import sys
+import time
+from optparse import OptionParser
+
+try:
+    import multiprocessing
+except ImportError: # pragma: no cover
+    multiprocessing = None
+
+from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+from pyramid_chameleon_genshi import cook
+from pyramid_chameleon_genshi import find_templates
+from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+
+def translate(msgid, domain=None, mapping=None, context=None,
+              target_language=None, default=None): # pragma: no cover
+    """ Stands in for the translation function of an application using
+    translation directories, which is part of the compiled template cache
+    key."""
+    return default
+
+def compile_template(args):
+    """ Compile the template file at ``path`` for a top-level render and
+    for being XIncluded (in the ``xml`` format XIncludes create templates
+    with), storing the code in the compiled template cache at
+    ``directory``.  ``args`` is the ``(path, directory, debug, i18n)``
+    tuple (a single argument, to suit ``Pool.imap``).  Return a ``(path,
+    seconds, error)`` tuple where ``error`` describes the exception raised
+    while compiling or is ``None``."""
+    path, directory, debug, i18n = args
+    start = time.time()
+    try:
+        template = PyramidGenshiTemplateFile(
+            path, cache=CompiledTemplateCache(directory), debug=debug,
+            translate=i18n and translate or None)
+        cook(template)
+        # the format is part of the signature, hence of the cache key
+        cook(template.clone(path, 'xml'), '', False)
+    except Exception, e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+    else:
+        error = None
+    return path, time.time() - start, error
+
+def normalize_spec(spec):
+    """ Return ``spec`` as understood by
+    :func:`pyramid_chameleon_genshi.find_templates`: existing relative
+    paths are made absolute and other names without a colon are taken to
+    be package names."""
+    if ':' in spec or os.path.isabs(spec):
+        return spec
+    if os.path.exists(spec):
+        return os.path.abspath(spec)
+    return spec + ':'
+
+def compile_templates(specs, directory, processes=None, debug=False,
+                      i18n=False, extension='.genshi'):
+    """ Compile every template implied by ``specs`` (see
+    :func:`normalize_spec`) into the compiled template cache at
+    ``directory`` using a pool of ``processes`` processes (as many as
+    there are CPUs if ``None``; ``1`` compiles in this process) and return
+    the list of results of :func:`compile_template`.  ``debug`` and
+    ``i18n`` must match the ``debug_templates`` setting of the application
+    and whether it uses translation directories."""
+    paths = []
+    for spec in specs:
+        for name, path in find_templates(normalize_spec(spec), extension):
+            if path not in paths:
+                paths.append(path)
+    tasks = [(path, directory, debug, i18n) for path in paths]
+    if processes == 1 or multiprocessing is None or len(tasks) < 2:
+        return map(compile_template, tasks)
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(compile_template, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv=sys.argv, out=sys.stdout):
+    parser = OptionParser(
+        usage='%prog [options] -d DIRECTORY SPEC [SPEC ...]',
+        description='Compile chameleon.genshi templates into a compiled '
+        'template cache directory. Each SPEC is a package name, an asset '
+        'specification, a directory or a template file.')
+    parser.add_option('-d', '--cache-dir', metavar='DIRECTORY',
+                      help='directory to store the compiled templates in '
+                      '(the chameleon_genshi.cache_dir setting)')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of processes (default: number of CPUs)')
+    parser.add_option('-e', '--extension', default='.genshi',
+                      help='template filename extension (default .genshi)')
+    parser.add_option('--debug', action='store_true', default=False,
+                      help='compile for applications with debug_templates on')
+    parser.add_option('--i18n', action='store_true', default=False,
+                      help='compile for applications using translation '
+                      'directories')
+    options, specs = parser.parse_args(argv[1:])
+    if not options.cache_dir:
+        parser.error('no cache directory given')
+    if not specs:
+        parser.error('no templates given')
+    results = compile_templates(specs, options.cache_dir, options.jobs,
+                                options.debug, options.i18n,
+                                options.extension)
+    errors = 0
+    for path, seconds, error in results:
+        if error is None:
+            out.write('%8.3fs  %s\n' % (seconds, path))
+        else:
+            errors += 1
+            out.write('   ERROR  %s\n          %s\n' % (path, error))
+    out.write('%d templates compiled, %d errors\n' % (
+        len(results) - errors, errors))
+    return errors and 1 or 0
+
+if __name__ == '__main__': # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,437 @@
+import imp
+import marshal
+import os
+import tempfile
+import threading
+import time
+
+import pkg_resources
+
+try:
+    from hashlib import sha1 as sha
+except ImportError: # pragma: no cover
+    from sha import sha
+
+from zope.interface import implements
+
+from pyramid_chameleon_genshi.interfaces import ICompiledTemplateCache
+from pyramid_chameleon_genshi.interfaces import IOutputCache
+
+try:
+    CHAMELEON_VERSION = pkg_resources.get_distribution('Chameleon').version
+except pkg_resources.DistributionNotFound: # pragma: no cover
+    CHAMELEON_VERSION = None
+
+try:
+    VERSION = pkg_resources.get_distribution(
+        'pyramid_chameleon_genshi').version
+except pkg_resources.DistributionNotFound: # pragma: no cover
+    VERSION = None
+
+MAGIC = imp.get_magic()
+
+class CompiledTemplateCache(object):
+    """ A directory holding the code Chameleon generates for templates,
+    shared by every process configured to use the same ``directory``.
+
+    Each entry holds the marshalled code object of one render function.
+    It is keyed by the normalized template filename, the modification
+    time, size and content hash of its source, the Chameleon and
+    :mod:`pyramid_chameleon_genshi` versions, the template's ``debug``,
+    ``translate`` and ``fold_static`` settings and the version of the
+    rewrites applied to the generated source (its ``source_version``), so
+    a stale entry is never used: a change to any of them simply produces a different
+    key.  Entries are written to a temporary file which is then renamed
+    into place, so concurrent readers never see partial entries."""
+    implements(ICompiledTemplateCache)
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.normpath(directory))
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another process may have created it in the meantime
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def get_registry(self, template):
+        """ Return a Chameleon template registry for ``template`` that
+        reads from and writes to this cache."""
+        return CachingTemplateRegistry(self, template)
+
+    def digest(self, template, key):
+        filename = os.path.normpath(template.filename)
+        if isinstance(filename, unicode):
+            # XIncludes resolve unicode hrefs; the key must not change
+            filename = filename.encode('utf-8')
+        try:
+            st = os.stat(filename)
+        except (IOError, OSError):
+            mtime = size = None
+        else:
+            mtime, size = st.st_mtime, st.st_size
+        body = template.body or ''
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        translate = template.translate is not type(template).translate
+        parts = (filename, mtime, size, sha(body).hexdigest(),
+                 CHAMELEON_VERSION, VERSION,
+                 getattr(template, 'source_version', None),
+                 bool(template.debug), translate,
+                 bool(getattr(template, 'fold_static', False)), key)
+        return sha(repr(parts)).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + os.extsep + 'pyc')
+
+    def load(self, digest):
+        """ Return the code object stored under ``digest`` or ``None`` if
+        there is no usable entry."""
+        try:
+            f = open(self.path(digest), 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if not data.startswith(MAGIC):
+            return None
+        try:
+            return marshal.loads(data[len(MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, digest, code):
+        """ Store the code object ``code`` under ``digest``.  The cache is
+        an optimization only, so failing to write an entry (e.g. on a
+        read-only filesystem) is not an error."""
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        except (IOError, OSError):
+            return
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(MAGIC)
+                f.write(marshal.dumps(code))
+            finally:
+                f.close()
+            os.rename(tmp, self.path(digest))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+class CachingTemplateRegistry(object):
+    """ Chameleon template registry which consults a
+    :class:`CompiledTemplateCache` before compiling a render function and
+    stores freshly compiled functions in it."""
+    mtime = None
+
+    def __init__(self, cache, template):
+        self.cache = cache
+        self.template = template
+        self.registry = {}
+
+    def __getitem__(self, key):
+        return self.registry[key]
+
+    def __contains__(self, key):
+        if key in self.registry:
+            return True
+        if not self.cacheable(key):
+            return False
+        code = self.cache.load(self.cache.digest(self.template, key))
+        if code is None:
+            return False
+        self.registry[key] = self.bind(code, self.template.filename)
+        return True
+
+    def add(self, key, source, filename):
+        code = compile(source, '<string>', 'exec')
+        if self.cacheable(key):
+            self.cache.store(self.cache.digest(self.template, key), code)
+        self.registry[key] = self.bind(code, filename)
+
+    def cacheable(self, key):
+        """ Return whether the render function under ``key`` may be
+        stored in the cache: the code of a top-level render with inlined
+        XIncludes depends on files which are not part of the digest."""
+        macro = key[0]
+        return not (macro is None and
+                    getattr(self.template, 'inline_xincludes', False))
+
+    def bind(self, code, filename):
+        _locals = {'__filename__': filename}
+        exec code in _locals
+        return _locals['bind']()
+
+    def clear(self):
+        self.registry.clear()
+
+    purge = clear
+
+PREV, NEXT, KEY, VALUE, SIZE = 0, 1, 2, 3, 4
+
+class LRUCache(object):
+    """ A thread-safe mapping holding at most ``max_entries`` items whose
+    approximate total size (as computed by :meth:`sizeof`) does not exceed
+    ``max_bytes``; either bound may be ``None``.  When a bound is exceeded,
+    the least recently used items are evicted.  Lookups, hits, misses and
+    evictions are counted, see :meth:`stats`."""
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ Remove all items and reset the counters."""
+        self.lock.acquire()
+        try:
+            # a circular doubly linked list of [prev, next, key, value,
+            # size] links, ordered from least to most recently used
+            root = []
+            root[:] = [root, root, None, None, 0]
+            self.root = root
+            self.data = {}
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+        finally:
+            self.lock.release()
+
+    def sizeof(self, value):
+        """ Return the approximate size of ``value`` in bytes."""
+        return 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.lock.acquire()
+        try:
+            self._set(key, value)
+        finally:
+            self.lock.release()
+
+    def __delitem__(self, key):
+        if self.pop(key, self) is self:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._touch(link)
+            return link[VALUE]
+        finally:
+            self.lock.release()
+
+    def peek(self, key, default=None):
+        """ Like :meth:`get`, but neither counted nor marking the item as
+        recently used."""
+        link = self.data.get(key)
+        if link is None:
+            return default
+        return link[VALUE]
+
+    def setdefault(self, key, value):
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is not None:
+                self._touch(link)
+                return link[VALUE]
+            self._set(key, value)
+            return value
+        finally:
+            self.lock.release()
+
+    def pop(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[VALUE]
+        finally:
+            self.lock.release()
+
+    def keys(self):
+        self.lock.acquire()
+        try:
+            return self.data.keys()
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """ Return a dictionary describing the state of the cache."""
+        return {
+            'entries':len(self.data),
+            'bytes':self.size,
+            'max_entries':self.max_entries,
+            'max_bytes':self.max_bytes,
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            }
+
+    def _touch(self, link):
+        root = self.root
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+        last = root[PREV]
+        last[NEXT] = root[PREV] = link
+        link[PREV] = last
+        link[NEXT] = root
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+        del self.data[link[KEY]]
+        self.size -= link[SIZE]
+
+    def _set(self, key, value):
+        link = self.data.get(key)
+        if link is not None:
+            self._unlink(link)
+        root = self.root
+        last = root[PREV]
+        size = self.sizeof(value)
+        link = [last, root, key, value, size]
+        last[NEXT] = root[PREV] = link
+        self.data[key] = link
+        self.size += size
+        max_entries, max_bytes = self.max_entries, self.max_bytes
+        # never evict the item just added, even if it exceeds the budget
+        while len(self.data) > 1 and (
+            (max_entries is not None and len(self.data) > max_entries) or
+            (max_bytes is not None and self.size > max_bytes)):
+            self._unlink(root[NEXT])
+            self.evictions += 1
+
+class TemplateLRUCache(LRUCache):
+    """ A :class:`LRUCache` of template instances keyed by filename, whose
+    size is approximated by the length of the template source.  The number
+    of times :meth:`share` handed out a template held by the cache instead
+    of creating another one is reported as ``shared`` by :meth:`stats`."""
+
+    def clear(self):
+        LRUCache.clear(self)
+        self.shared = 0
+
+    def sizeof(self, template):
+        return len(getattr(template, 'body', None) or '')
+
+    def share(self, key, factory, accept=None):
+        """ Return the template stored under ``key`` if there is one and
+        ``accept`` (unless ``None``) returns true for it; otherwise return
+        ``factory()``.  Templates register themselves in the cache when
+        created, so the template created for a key which is not stored is
+        the one shared afterwards."""
+        template = self.get(key)
+        if template is not None and (accept is None or accept(template)):
+            self.lock.acquire()
+            try:
+                self.shared += 1
+            finally:
+                self.lock.release()
+            return template
+        return factory()
+
+    def stats(self):
+        stats = LRUCache.stats(self)
+        stats['shared'] = self.shared
+        return stats
+
+class ExpiringLRUCache(LRUCache):
+    """ A :class:`LRUCache` of ``(value, expires)`` pairs whose size is
+    approximated by the length of the value."""
+
+    def sizeof(self, item):
+        return len(item[0])
+
+class OutputCache(object):
+    """ An in-process store for rendered template output holding at most
+    ``max_entries`` strings of at most ``max_bytes`` characters in total
+    (either may be ``None``), evicting the least recently used ones first.
+    Values stored with a ``time`` are dropped once that many seconds have
+    passed."""
+    implements(IOutputCache)
+
+    def __init__(self, max_entries=1000, max_bytes=None, timer=time.time):
+        self.timer = timer
+        self.items = ExpiringLRUCache(max_entries, max_bytes)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= self.timer():
+            self.items.pop(key)
+            return None
+        return value
+
+    def set(self, key, value, time=0):
+        expires = None
+        if time:
+            expires = self.timer() + time
+        self.items[key] = (value, expires)
+
+    def delete(self, key):
+        self.items.pop(key)
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        """ Return a dictionary describing the state of the store, see
+        :meth:`LRUCache.stats`."""
+        return self.items.stats()
+
+class MtimeCache(object):
+    """ Remembers the modification time of files so that each file is
+    stat'ed at most once every ``interval`` seconds, however many
+    templates are loaded from it."""
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.data = {}
+
+    def getmtime(self, filename, interval):
+        """ Return the modification time of ``filename`` (``0`` if it
+        cannot be determined) as of at most ``interval`` seconds ago."""
+        now = self.timer()
+        entry = self.data.get(filename)
+        if entry is not None and 0 <= now - entry[0] < interval:
+            return entry[1]
+        try:
+            mtime = os.path.getmtime(filename)
+        except (IOError, OSError):
+            mtime = 0
+        self.data[filename] = (now, mtime)
+        return mtime
+
+    def forget(self, filename):
+        """ Have the next call for ``filename`` stat it."""
+        self.data.pop(filename, None)
+
+    def clear(self):
+        self.data.clear()
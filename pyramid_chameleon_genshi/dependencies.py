@@ -0,0 +1,119 @@
+""" An index of which templates XInclude which, recorded as includes are
+resolved (see :class:`pyramid_chameleon_genshi.XIncludes`), so that a
+change to a fragment only affects the templates including it."""
+import threading
+
+class DependencyGraph(object):
+    """ A thread-safe directed graph of templates, keyed by normalized
+    filename, with an edge from each template to every template it
+    XIncludes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ Forget all edges."""
+        self.lock.acquire()
+        try:
+            self.children = {}
+            self.parents = {}
+        finally:
+            self.lock.release()
+
+    def add(self, parent, child):
+        """ Record that the template ``parent`` XIncludes ``child``."""
+        children = self.children.get(parent)
+        if children is not None and child in children:
+            return # the common case, on every render
+        self.lock.acquire()
+        try:
+            self.children.setdefault(parent, set()).add(child)
+            self.parents.setdefault(child, set()).add(parent)
+        finally:
+            self.lock.release()
+
+    def remove(self, path):
+        """ Forget the includes of the template ``path`` (but not those of
+        other templates including it), e.g. because its source changed."""
+        self.lock.acquire()
+        try:
+            for child in self.children.pop(path, ()):
+                parents = self.parents[child]
+                parents.discard(path)
+                if not parents:
+                    del self.parents[child]
+        finally:
+            self.lock.release()
+
+    def includes(self, path):
+        """ Return the set of templates the template ``path`` XIncludes."""
+        self.lock.acquire()
+        try:
+            return set(self.children.get(path, ()))
+        finally:
+            self.lock.release()
+
+    def included_by(self, path):
+        """ Return the set of templates which XInclude the template
+        ``path``."""
+        self.lock.acquire()
+        try:
+            return set(self.parents.get(path, ()))
+        finally:
+            self.lock.release()
+
+    def dependents(self, path):
+        """ Return the set of templates whose output depends on the
+        template ``path``: those including it, directly or through other
+        includes.  ``path`` itself is only part of it if it includes
+        itself."""
+        self.lock.acquire()
+        try:
+            result = set()
+            pending = [path]
+            while pending:
+                for parent in self.parents.get(pending.pop(), ()):
+                    if parent not in result:
+                        result.add(parent)
+                        pending.append(parent)
+            return result
+        finally:
+            self.lock.release()
+
+    def order(self, paths=None):
+        """ Return ``paths`` (by default, every template in the graph) as a
+        list in which each template comes after the templates it includes
+        which are in ``paths`` as well (directly or not), and otherwise
+        in the order given as far as possible.  The templates of an
+        include cycle are listed in no particular order."""
+        self.lock.acquire()
+        try:
+            if paths is None:
+                paths = set(self.children)
+                paths.update(self.parents)
+                paths = sorted(paths)
+            wanted = set(paths)
+            result = []
+            done = set()
+            for path in paths:
+                if path in done:
+                    continue
+                done.add(path)
+                # depth-first, emitting each template after its includes
+                stack = [(path, iter(sorted(self.children.get(path, ()))))]
+                while stack:
+                    current, children = stack[-1]
+                    for child in children:
+                        if child not in done:
+                            done.add(child)
+                            stack.append((child, iter(sorted(
+                                self.children.get(child, ())))))
+                            break
+                    else:
+                        stack.pop()
+                        if current in wanted:
+                            result.append(current)
+            return result
+        finally:
+            self.lock.release()
@@ -0,0 +1,198 @@
+""" A bounded pool of threads rendering templates on behalf of callers which
+must not block, such as event loops.  The futures it returns mimic those of
+``concurrent.futures``."""
+import sys
+import threading
+from Queue import Queue
+
+PENDING, RUNNING, CANCELLED, FINISHED = 'PENDING', 'RUNNING', 'CANCELLED', \
+                                        'FINISHED'
+
+class CancelledError(Exception):
+    """ The result of a cancelled :class:`RenderFuture` was asked for."""
+
+class TimeoutError(Exception):
+    """ A :class:`RenderFuture` did not complete in time."""
+
+class RenderFuture(object):
+    """ The eventual result of a call submitted to a
+    :class:`RenderExecutor`."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.state = PENDING
+        self.value = None
+        self.exc_info = None
+        self.callbacks = []
+
+    def cancel(self):
+        """ Cancel the call unless it is already running or done and
+        return whether the future is cancelled.  A running render cannot
+        be interrupted."""
+        self.condition.acquire()
+        try:
+            if self.state in (RUNNING, FINISHED):
+                return False
+            if self.state == CANCELLED:
+                return True
+            self.state = CANCELLED
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        self._invoke_callbacks()
+        return True
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def running(self):
+        return self.state == RUNNING
+
+    def done(self):
+        return self.state in (CANCELLED, FINISHED)
+
+    def result(self, timeout=None):
+        """ Return the result of the call, waiting at most ``timeout``
+        seconds (forever if ``None``) for it to complete.  Raises the
+        exception raised by the call, :exc:`CancelledError` or
+        :exc:`TimeoutError`."""
+        self._wait(timeout)
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def exception(self, timeout=None):
+        """ Return the exception raised by the call or ``None``, waiting
+        like :meth:`result`."""
+        self._wait(timeout)
+        if self.exc_info is not None:
+            return self.exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """ Call ``fn`` with the future as its only argument once it is
+        done (immediately if it already is), in the thread completing it.
+        An event loop can use this to wake itself up, e.g. with
+        ``loop.call_soon_threadsafe``."""
+        self.condition.acquire()
+        try:
+            if not self.done():
+                self.callbacks.append(fn)
+                return
+        finally:
+            self.condition.release()
+        fn(self)
+
+    def set_running(self):
+        """ Mark the future as running and return ``True``, unless it was
+        cancelled, in which case return ``False``."""
+        self.condition.acquire()
+        try:
+            if self.state == CANCELLED:
+                return False
+            self.state = RUNNING
+            return True
+        finally:
+            self.condition.release()
+
+    def set_result(self, value):
+        self._finish(value, None)
+
+    def set_exception(self, exc_info):
+        """ Complete the future with the exception described by the
+        ``sys.exc_info()`` triple ``exc_info``."""
+        self._finish(None, exc_info)
+
+    def _finish(self, value, exc_info):
+        self.condition.acquire()
+        try:
+            self.value = value
+            self.exc_info = exc_info
+            self.state = FINISHED
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        self._invoke_callbacks()
+
+    def _invoke_callbacks(self):
+        self.condition.acquire()
+        try:
+            callbacks, self.callbacks = self.callbacks, []
+        finally:
+            self.condition.release()
+        for callback in callbacks:
+            callback(self)
+
+    def _wait(self, timeout):
+        self.condition.acquire()
+        try:
+            if timeout is None:
+                while not self.done():
+                    self.condition.wait()
+            elif not self.done():
+                self.condition.wait(timeout)
+            if self.state == CANCELLED:
+                raise CancelledError()
+            if self.state != FINISHED:
+                raise TimeoutError()
+        finally:
+            self.condition.release()
+
+class RenderExecutor(object):
+    """ Runs submitted calls in at most ``max_workers`` daemon threads,
+    which are started as calls are submitted."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.queue = Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.shut_down = False
+
+    def submit(self, func, *arg, **kw):
+        """ Schedule ``func(*arg, **kw)`` and return a
+        :class:`RenderFuture` for its result."""
+        future = RenderFuture()
+        self.lock.acquire()
+        try:
+            if self.shut_down:
+                raise RuntimeError('cannot submit calls after shutdown')
+            self.queue.put((future, func, arg, kw))
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self.work)
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+        finally:
+            self.lock.release()
+        return future
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, func, arg, kw = item
+            if not future.set_running():
+                continue
+            try:
+                result = func(*arg, **kw)
+            except:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """ Stop the threads once the calls already submitted are done,
+        waiting for them if ``wait`` is true."""
+        self.lock.acquire()
+        try:
+            self.shut_down = True
+            threads = list(self.threads)
+        finally:
+            self.lock.release()
+        for thread in threads:
+            self.queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,53 @@
+from zope.interface import Interface
+
+class ICompiledTemplateCache(Interface):
+    """ A persistent store for the code generated when compiling
+    templates."""
+
+    def get_registry(template):
+        """ Return a Chameleon template registry for ``template`` which
+        loads compiled render functions from the store and saves newly
+        compiled ones to it."""
+
+class ITemplateMetrics(Interface):
+    """ Receives measurements about the templates used by renderers.  When
+    no such utility is registered, no measurements are taken."""
+
+    def compiled(path, seconds):
+        """ The template at ``path`` was loaded and compiled in
+        ``seconds``."""
+
+    def rendered(path, seconds, size):
+        """ The template at ``path`` was rendered in ``seconds``, producing
+        ``size`` characters of output."""
+
+    def included(path, filename):
+        """ The template at ``path`` resolved an XInclude to the template
+        at ``filename``."""
+
+class IOutputCache(Interface):
+    """ A store for rendered template output.  The methods are those of
+    a memcached client, so one may be used as well."""
+
+    def get(key):
+        """ Return the string stored under ``key`` or ``None``."""
+
+    def set(key, value, time=0):
+        """ Store the string ``value`` under ``key`` for ``time`` seconds
+        (forever if ``time`` is ``0``)."""
+
+    def delete(key):
+        """ Forget the value stored under ``key``, if any."""
+
+class ITemplateOutputCache(Interface):
+    """ Decides which template output is cached and under which key."""
+
+    def render(path, render, values):
+        """ Return the output of the template at ``path`` rendered with the
+        dictionary ``values``, calling ``render(values)`` to produce it if
+        it is not cached."""
+
+    def fragment(path, template):
+        """ Return the object whose ``render_xinclude`` method renders the
+        template at ``path`` when it is XIncluded: ``template`` itself or
+        a wrapper caching its output."""
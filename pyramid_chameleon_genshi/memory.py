@@ -0,0 +1,92 @@
+""" Introspection of the templates loaded in this process, to find the
+templates which use the most memory and those which are rarely used."""
+from types import CodeType
+
+from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+from pyramid_chameleon_genshi import get_xinclude_cache
+
+def code_size(code):
+    """ Return the approximate size in bytes of the code object ``code``:
+    the length of its bytecode, line number table and string constants,
+    including those of the code objects nested in it."""
+    size = len(code.co_code) + len(code.co_lnotab)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            size += code_size(const)
+        elif isinstance(const, basestring):
+            size += len(const)
+    return size
+
+def template_info(template):
+    """ Return a dictionary describing the memory used by ``template``
+    and how it is used:
+
+    ``filename``
+      The template file.
+    ``source_bytes``
+      The length of the source text held.
+    ``code_bytes``
+      The approximate size of the compiled render functions (see
+      :func:`code_size`).
+    ``functions``
+      The number of render functions compiled (one per combination of
+      macro and scope the template was rendered with).
+    ``parsed``
+      Whether the parse tree is held (see
+      :meth:`pyramid_chameleon_genshi.PyramidGenshiTemplateFile.evict`);
+      its size is roughly proportional to ``source_bytes``.
+    ``renders``
+      The number of renders, including renders as an XInclude.
+    ``last_rendered``
+      When the template was last rendered (as returned by
+      ``time.time``), or ``None``.
+    ``registered``
+      Whether the template is the one held in the XInclude cache for its
+      file (see :func:`pyramid_chameleon_genshi.get_xinclude_cache`).
+    ``stream``
+      Whether the template was compiled in stream mode."""
+    functions = getattr(template.registry, 'registry', None) or {}
+    functions = [function for key, function in functions.items()
+                 if isinstance(key, tuple) and function is not None]
+    code_bytes = 0
+    for function in functions:
+        code = getattr(function, 'func_code', None)
+        if code is not None:
+            code_bytes += code_size(code)
+    body = template.__dict__.get('body') or ''
+    registry = get_xinclude_cache()
+    peek = getattr(registry, 'peek', registry.get)
+    return {
+        'filename':template.filename,
+        'source_bytes':len(body),
+        'code_bytes':code_bytes,
+        'functions':len(functions),
+        'parsed':'compiler' in template.__dict__,
+        'renders':template.renders,
+        'last_rendered':template.last_rendered,
+        'registered':peek(template.filename) is template,
+        'stream':template.stream,
+        }
+
+def template_report(templates=None):
+    """ Return the list of :func:`template_info` dictionaries of
+    ``templates`` (by default every
+    :class:`pyramid_chameleon_genshi.PyramidGenshiTemplateFile` alive,
+    whether created by a renderer or to resolve an XInclude), heaviest
+    (by ``source_bytes`` plus ``code_bytes``) first."""
+    if templates is None:
+        templates = PyramidGenshiTemplateFile.instances.values()
+    report = [template_info(template) for template in templates]
+    report.sort(key=lambda info: -(info['source_bytes'] + info['code_bytes']))
+    return report
+
+def templates_view(request):
+    """ A view returning :func:`template_report` along with totals,
+    meant to be used with the ``json`` renderer."""
+    report = template_report()
+    return {
+        'templates':report,
+        'count':len(report),
+        'source_bytes':sum([info['source_bytes'] for info in report]),
+        'code_bytes':sum([info['code_bytes'] for info in report]),
+        }
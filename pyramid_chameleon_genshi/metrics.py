@@ -0,0 +1,157 @@
+""" Sinks for the per-template measurements taken by
+:class:`pyramid_chameleon_genshi.GenshiTemplateRenderer` when an
+:class:`pyramid_chameleon_genshi.interfaces.ITemplateMetrics` utility is
+registered."""
+import re
+import socket
+import threading
+
+from zope.interface import implements
+
+from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+
+# upper bounds (in seconds) of the render time histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+class CallbackMetrics(object):
+    """ Pass every measurement to ``callback`` as ``callback(event, path,
+    **data)``, where ``event`` is ``'compiled'`` (with ``seconds``),
+    ``'rendered'`` (with ``seconds`` and ``size``) or ``'included'`` (with
+    ``filename``)."""
+    implements(ITemplateMetrics)
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def compiled(self, path, seconds):
+        self.callback('compiled', path, seconds=seconds)
+
+    def rendered(self, path, seconds, size):
+        self.callback('rendered', path, seconds=seconds, size=size)
+
+    def included(self, path, filename):
+        self.callback('included', path, filename=filename)
+
+class StatsdMetrics(object):
+    """ Send measurements as statsd counters, timers and gauges over UDP to
+    ``host`` and ``port``.  Metric names start with ``prefix`` followed by
+    the template path with every run of characters other than letters,
+    digits, dashes and underscores replaced by a dot.  Failing to send a
+    packet is not an error."""
+    implements(ITemplateMetrics)
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='genshi'):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def name(self, path):
+        name = re.sub(r'[^A-Za-z0-9_-]+', '.', path).strip('.')
+        return '%s.%s' % (self.prefix, name)
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data, self.address)
+        except (IOError, socket.error):
+            pass
+
+    def compiled(self, path, seconds):
+        self.send('%s.compile_time:%d|ms' % (self.name(path), seconds * 1000))
+
+    def rendered(self, path, seconds, size):
+        name = self.name(path)
+        self.send('%s.renders:1|c\n%s.render_time:%d|ms\n%s.size:%d|g' % (
+            name, name, seconds * 1000, name, size))
+
+    def included(self, path, filename):
+        self.send('%s.xincludes:1|c' % self.name(path))
+
+class MetricsRegistry(object):
+    """ Accumulate measurements in memory, per template path; see
+    :meth:`stats`."""
+    implements(ITemplateMetrics)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.templates = {}
+
+    def _get(self, path):
+        stats = self.templates.get(path)
+        if stats is None:
+            stats = self.templates[path] = {
+                'renders':0,
+                'render_time':0.0,
+                'histogram':[0] * (len(self.buckets) + 1),
+                'compile_time':None,
+                'output_size':0,
+                'xincludes':0,
+                }
+        return stats
+
+    def compiled(self, path, seconds):
+        self.lock.acquire()
+        try:
+            self._get(path)['compile_time'] = seconds
+        finally:
+            self.lock.release()
+
+    def rendered(self, path, seconds, size):
+        index = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            index += 1
+        self.lock.acquire()
+        try:
+            stats = self._get(path)
+            stats['renders'] += 1
+            stats['render_time'] += seconds
+            stats['histogram'][index] += 1
+            stats['output_size'] += size
+        finally:
+            self.lock.release()
+
+    def included(self, path, filename):
+        self.lock.acquire()
+        try:
+            self._get(path)['xincludes'] += 1
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """ Return a dictionary mapping each template path to a dictionary
+        of its measurements: the number of ``renders``, the cumulative
+        ``render_time`` in seconds, a ``histogram`` of render times mapping
+        each bucket's upper bound (as a string, the last one being
+        ``'+Inf'``) to the number of renders that fell into it, the
+        ``compile_time`` of the template, the total ``output_size`` (in
+        characters) rendered and the number of ``xincludes`` resolved."""
+        bounds = ['%g' % bound for bound in self.buckets] + ['+Inf']
+        self.lock.acquire()
+        try:
+            result = {}
+            for path, stats in self.templates.items():
+                stats = dict(stats)
+                stats['histogram'] = dict(zip(bounds, stats['histogram']))
+                result[path] = stats
+            return result
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.templates.clear()
+        finally:
+            self.lock.release()
+
+def metrics_view(request):
+    """ A view returning the measurements of the
+    :class:`MetricsRegistry` registered as the ``ITemplateMetrics``
+    utility, meant to be used with the ``json`` renderer."""
+    metrics = request.registry.queryUtility(ITemplateMetrics)
+    stats = getattr(metrics, 'stats', None)
+    if stats is None:
+        return {}
+    return stats()
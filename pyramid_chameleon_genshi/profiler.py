@@ -0,0 +1,137 @@
+""" Per-request profiling of template renders, recording how the time
+spent rendering a page divides between the template and the templates it
+XIncludes.  Profiling is off unless enabled with the
+``chameleon_genshi.profile`` or ``chameleon_genshi.profile_header``
+and ``chameleon_genshi.profile_header_secret`` settings (see
+:func:`pyramid_chameleon_genshi.includeme`), and then only applies to
+requests asking for it."""
+import os
+import time
+
+timer = time.time
+clock = time.clock # process CPU time on Unix
+
+class RenderProfile(dict):
+    """ The renders of :class:`pyramid_chameleon_genshi.PyramidGenshiTemplateFile`
+    instances during one request, as a dictionary holding the list of the
+    top-level ``spans`` and the total ``wall`` and ``cpu`` time (in
+    seconds) they took.  Each span is a dictionary holding the
+    ``template`` filename, its ``kind`` (``'template'`` for a top-level
+    render, ``'xinclude'`` for an include), its ``wall`` and ``cpu`` time,
+    the ``size`` of its output (in characters, ``None`` if the render
+    failed) and the list of the spans of the includes it rendered, its
+    ``children``.  The time of a span includes that of its children."""
+
+    def __init__(self):
+        dict.__init__(self, spans=[], wall=0.0, cpu=0.0)
+        self.stack = []
+
+    def measure(self, filename, kind, out, render, *arg):
+        """ Return ``render(*arg)``, recording it as a span.  ``out`` is
+        the output stream the render writes to, if it does not return its
+        output."""
+        span = {'template':filename, 'kind':kind, 'wall':None, 'cpu':None,
+                'size':None, 'children':[]}
+        if self.stack:
+            self.stack[-1]['children'].append(span)
+        else:
+            self['spans'].append(span)
+        self.stack.append(span)
+        position = out is not None and len(out) or 0
+        start, cpu_start = timer(), clock()
+        try:
+            result = render(*arg)
+        finally:
+            span['wall'] = timer() - start
+            span['cpu'] = clock() - cpu_start
+            self.stack.pop()
+            if not self.stack:
+                self['wall'] += span['wall']
+                self['cpu'] += span['cpu']
+        if result is None:
+            fragments = out is not None and out[position:] or ()
+        elif isinstance(result, basestring):
+            fragments = (result,)
+        else:
+            fragments = result
+        span['size'] = sum([len(fragment) for fragment in fragments])
+        return result
+
+    def walk(self):
+        """ Return the list of all spans, each followed by its children."""
+        result = []
+        pending = list(reversed(self['spans']))
+        while pending:
+            span = pending.pop()
+            result.append(span)
+            pending.extend(reversed(span['children']))
+        return result
+
+    def server_timing(self):
+        """ Return the profile as the value of a ``Server-Timing`` header:
+        the total time, followed by the time of every span, described by
+        the name of its template file."""
+        entries = ['genshi;dur=%.3f' % (self['wall'] * 1000)]
+        for index, span in enumerate(self.walk()):
+            desc = os.path.basename(span['template'] or '')
+            desc = desc.replace('\\', '\\\\').replace('"', '\\"')
+            entries.append('genshi-%d;dur=%.3f;desc="%s"' % (
+                index + 1, span['wall'] * 1000, desc))
+        return ', '.join(entries)
+
+def find_profile(namespace):
+    """ Return the :class:`RenderProfile` of the request in the template
+    ``namespace``, if the request is being profiled, or ``None``.  A
+    request is profiled if its ``genshi_profile`` attribute is true; the
+    profile replaces that value when first needed, and adds a
+    ``Server-Timing`` header to the response (see
+    :func:`add_server_timing`)."""
+    request = namespace.get('request')
+    profile = getattr(request, 'genshi_profile', None)
+    if not profile:
+        return None
+    if not isinstance(profile, RenderProfile):
+        profile = request.genshi_profile = RenderProfile()
+        add_response_callback = getattr(request, 'add_response_callback',
+                                        None)
+        if add_response_callback is not None:
+            add_response_callback(add_server_timing)
+    return profile
+
+def add_server_timing(request, response):
+    """ A response callback adding the ``Server-Timing`` header of the
+    profile of ``request`` to ``response``."""
+    profile = request.genshi_profile
+    if profile['spans']:
+        response.headers.add('Server-Timing', profile.server_timing())
+
+class HeaderActivation(object):
+    """ A :class:`pyramid.events.NewRequest` subscriber profiling the
+    requests whose ``header`` has the value ``secret``, so that only the
+    clients knowing it can see the filenames and timings sent in the
+    ``Server-Timing`` header."""
+    def __init__(self, header, secret):
+        if not secret:
+            raise ValueError('a secret is required to activate profiling '
+                             'with the %s header' % header)
+        self.header = header
+        self.secret = secret
+
+    def __call__(self, event):
+        request = event.request
+        value = request.headers.get(self.header)
+        if value is not None and self.matches(value):
+            request.genshi_profile = True
+
+    def matches(self, value):
+        """ Return whether the header ``value`` is the secret, taking the
+        same time whichever of its characters differ."""
+        secret = self.secret
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+        result = len(value) ^ len(secret)
+        for a, b in zip(value, secret):
+            result |= ord(a) ^ ord(b)
+        return result == 0
@@ -0,0 +1,242 @@
+import unittest
+
+class Test_measure(unittest.TestCase):
+    def _callFUT(self, func, number):
+        from pyramid_chameleon_genshi.bench import measure
+        return measure(func, number)
+
+    def test_it(self):
+        calls = []
+        result = self._callFUT(lambda: calls.append(1), 3)
+        self.failUnless(len(calls) >= 3)
+        self.assertEqual(result['number'], 3)
+        self.failUnless(result['seconds'] >= 0)
+        self.failUnless(result['peak_objects'] >= 0)
+        self.failUnless(result['peak_bytes'] >= 0)
+
+class Test_allocations(unittest.TestCase):
+    def _callFUT(self, func):
+        from pyramid_chameleon_genshi.bench import allocations
+        return allocations(func)
+
+    def test_it(self):
+        import sys
+        def func():
+            # more lists than Python keeps for reuse, see allocations
+            held = [[i] for i in range(500)]
+            held = None
+            return [[i] for i in range(10)]
+        objects, size = self._callFUT(func)
+        self.failUnless(500 <= objects < 520, objects)
+        self.failUnless(size >= 500 * sys.getsizeof([1]))
+
+    def test_restores_state(self):
+        import gc
+        import sys
+        self._callFUT(lambda: None)
+        self.failUnless(gc.isenabled())
+        self.assertEqual(sys.gettrace(), None)
+        gc.disable()
+        try:
+            self._callFUT(lambda: None)
+            self.failIf(gc.isenabled())
+        finally:
+            gc.enable()
+
+class Test_run(unittest.TestCase):
+    def setUp(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        self.original = PyramidGenshiTemplateFile.global_registry
+
+    def tearDown(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+
+    def _callFUT(self, names, number=1):
+        from pyramid_chameleon_genshi.bench import run
+        return run(names, number)
+
+    def test_single_template(self):
+        report = self._callFUT(['loop'])
+        self.assertEqual(report['number'], 1)
+        self.assertEqual(report['scenarios'].keys(), ['loop'])
+        result = report['scenarios']['loop']
+        self.assertEqual(sorted(result.keys()),
+                         ['compile', 'get_renderer', 'get_renderer_uncached',
+                          'keywords_extra_bytes', 'max_rss_kb',
+                          'render_template', 'renderer', 'renderer_inlined',
+                          'renderer_keywords', 'renderer_unfolded'])
+        self.assertEqual(result['compile']['number'], 1)
+        self.assertEqual(result['keywords_extra_bytes'],
+                         result['renderer_keywords']['peak_bytes'] -
+                         result['renderer']['peak_bytes'])
+
+    def test_xinclude_chain(self):
+        result = self._callFUT(['xinclude_chain'])['scenarios']
+        self.failUnless('xincludes_get' in result['xinclude_chain'])
+
+    def test_scenarios_render(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.bench import SCENARIOS
+        for scenario in SCENARIOS:
+            template = PyramidGenshiTemplateFile(scenario.path)
+            self.failUnless(template(**scenario.values()))
+
+class Test_i18n(unittest.TestCase):
+    def test_translates(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        from pyramid_chameleon_genshi.bench import Lookup
+        from pyramid_chameleon_genshi.bench import SCENARIOS
+        scenario, = [s for s in SCENARIOS if s.name == 'i18n']
+        renderer = GenshiTemplateRenderer(scenario.path, Lookup())
+        result = renderer(scenario.values(), {})
+        self.failUnless(u'<p>Willkommen zur\xfcck, bob.</p>' in result)
+        self.failUnless(u'von sender99 zum Thema Subject number 99' in result)
+        self.failUnless(u'<th>Feld 49</th>' in result)
+        self.failIf(u'Welcome' in result)
+
+    def test_render_template_translates(self):
+        from pyramid import testing
+        from pyramid.interfaces import IChameleonTranslate
+        from pyramid_chameleon_genshi import render_template
+        from pyramid_chameleon_genshi import renderer_factory
+        from pyramid_chameleon_genshi.bench import Lookup
+        from pyramid_chameleon_genshi.bench import SCENARIOS
+        scenario, = [s for s in SCENARIOS if s.name == 'i18n']
+        config = testing.setUp()
+        try:
+            config.add_renderer('.genshi', renderer_factory)
+            config.registry.registerUtility(Lookup.translate,
+                                            IChameleonTranslate)
+            result = render_template(scenario.path, **scenario.values())
+        finally:
+            testing.tearDown()
+        self.failUnless(u'<h1>Konto\xfcbersicht</h1>' in result)
+
+class Test_keywords_extra_bytes(unittest.TestCase):
+    def _callFUT(self, result):
+        from pyramid_chameleon_genshi.bench import keywords_extra_bytes
+        return keywords_extra_bytes(result)
+
+    def test_it(self):
+        result = {'renderer':{'peak_bytes':100},
+                  'renderer_keywords':{'peak_bytes':1500}}
+        self.assertEqual(self._callFUT(result), 1400)
+
+    def test_missing(self):
+        self.assertEqual(self._callFUT({'renderer':{'peak_bytes':100}}),
+                         None)
+
+    def test_large_context_saves_memory(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.bench import SCENARIOS
+        from pyramid_chameleon_genshi.bench import bench_renderer
+        from pyramid_chameleon_genshi.bench import bench_renderer_keywords
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            scenario = [scenario for scenario in SCENARIOS
+                        if scenario.name == 'large_context'][0]
+            result = {
+                'renderer':bench_renderer(scenario, 1),
+                'renderer_keywords':bench_renderer_keywords(scenario, 1),
+                }
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+        # the keyword render copies the large dictionary of values
+        self.failUnless(self._callFUT(result) > 100000)
+
+class Test_fork_memory(unittest.TestCase):
+    def _callFUT(self, preloaded):
+        from pyramid_chameleon_genshi.bench import fork_memory
+        return fork_memory(preloaded, workers=1)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi.bench import smaps
+        if smaps() is None: # pragma: no cover
+            return
+        result = self._callFUT(True)
+        self.assertEqual(sorted(result.keys()), ['private_kb', 'shared_kb'])
+        self.failUnless(result['private_kb'] > 0)
+
+class Test_compare(unittest.TestCase):
+    def _callFUT(self, old, new):
+        from pyramid_chameleon_genshi.bench import compare
+        return compare(old, new)
+
+    def test_it(self):
+        old = {'scenarios':{'loop':{'renderer':{'seconds':2.0},
+                                    'max_rss_kb':1}}}
+        new = {'scenarios':{'loop':{'renderer':{'seconds':1.0},
+                                    'compile':{'seconds':1.0},
+                                    'max_rss_kb':1},
+                            'other':{'renderer':{'seconds':1.0}}}}
+        self.assertEqual(self._callFUT(old, new),
+                         [('loop', 'renderer', 2.0, 1.0, 0.5)])
+
+class Test_compare_objects(unittest.TestCase):
+    def _callFUT(self, old, new):
+        from pyramid_chameleon_genshi.bench import compare_objects
+        return compare_objects(old, new)
+
+    def test_it(self):
+        old = {'object_bytes':{'renderer':200, 'total':400}}
+        new = {'object_bytes':{'renderer':100, 'xincludes':100, 'total':200}}
+        self.assertEqual(self._callFUT(old, new),
+                         [('renderer', 200, 100, 0.5), ('total', 400, 200, 0.5)])
+        self.assertEqual(self._callFUT({}, new), [])
+
+class Test_object_sizes(unittest.TestCase):
+    def _callFUT(self):
+        from pyramid_chameleon_genshi.bench import object_sizes
+        return object_sizes()
+
+    def test_it(self):
+        result = self._callFUT()
+        self.assertEqual(sorted(result.keys()),
+                         ['renderer', 'total', 'xincludes'])
+        self.assertEqual(result['total'],
+                         result['renderer'] + result['xincludes'])
+        self.failUnless(result['renderer'] > 0)
+
+class Test_main(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        self.original = PyramidGenshiTemplateFile.global_registry
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+        shutil.rmtree(self.directory)
+
+    def _callFUT(self, *args):
+        from StringIO import StringIO
+        from pyramid_chameleon_genshi.bench import main
+        out = StringIO()
+        result = main(['pgenshi-bench'] + list(args), out)
+        return result, out.getvalue()
+
+    def test_stdout(self):
+        import json
+        result, output = self._callFUT('-n', '1', 'i18n')
+        self.assertEqual(result, 0)
+        self.assertEqual(json.loads(output)['scenarios'].keys(), [u'i18n'])
+
+    def test_output_and_compare(self):
+        import os
+        import json
+        filename = os.path.join(self.directory, 'report.json')
+        self._callFUT('-n', '1', '-o', filename, 'i18n')
+        report = json.load(open(filename))
+        self.assertEqual(report['scenarios'].keys(), [u'i18n'])
+        result, output = self._callFUT('-n', '1', '-c', filename, 'i18n')
+        lines = output.splitlines()
+        self.failUnless(lines[-1].startswith('i18n'))
+        self.assertEqual(len([l for l in lines
+                              if l.startswith('object_bytes ')]), 3)
+        self.assertEqual(len([l for l in lines if l.startswith('i18n ')]), 8)
+
+    def test_unknown_scenario(self):
+        self.assertRaises(SystemExit, self._callFUT, 'nonesuch')
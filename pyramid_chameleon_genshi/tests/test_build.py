@@ -0,0 +1,162 @@
+import unittest
+
+class Base(object):
+    def setUp(self):
+        import tempfile
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        self.original = PyramidGenshiTemplateFile.global_registry
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+        shutil.rmtree(self.directory)
+
+    def _getTemplatePath(self, name):
+        import os
+        here = os.path.abspath(os.path.dirname(__file__))
+        return os.path.join(here, 'fixtures', name)
+
+    def _makeBroken(self):
+        import os
+        path = os.path.join(self.directory, 'templates')
+        os.mkdir(path)
+        filename = os.path.join(path, 'broken.genshi')
+        f = open(filename, 'w')
+        f.write('<div xmlns="http://www.w3.org/1999/xhtml"><p></div>')
+        f.close()
+        return filename
+
+    def _cacheDir(self):
+        import os
+        return os.path.join(self.directory, 'cache')
+
+class Test_compile_template(Base, unittest.TestCase):
+    def _callFUT(self, *args):
+        from pyramid_chameleon_genshi.build import compile_template
+        return compile_template(args)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+        path = self._getTemplatePath('minimal.genshi')
+        result = self._callFUT(path, self._cacheDir(), False, False)
+        self.assertEqual(result[0], path)
+        self.failUnless(result[1] >= 0)
+        self.assertEqual(result[2], None)
+        template = PyramidGenshiTemplateFile(
+            path, cache=CompiledTemplateCache(self._cacheDir()))
+        self.failUnless((None, True, template.signature) in template.registry)
+        included = template.clone(path, 'xml')
+        self.failUnless(('', False, included.signature) in included.registry)
+
+    def test_debug_i18n(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+        path = self._getTemplatePath('minimal.genshi')
+        self._callFUT(path, self._cacheDir(), True, True)
+        cache = CompiledTemplateCache(self._cacheDir())
+        template = PyramidGenshiTemplateFile(path, cache=cache, debug='true',
+                                             translate=lambda *arg: None)
+        self.failUnless((None, True, template.signature) in template.registry)
+        template = PyramidGenshiTemplateFile(path, cache=cache)
+        self.failIf((None, True, template.signature) in template.registry)
+
+    def test_error(self):
+        path = self._makeBroken()
+        result = self._callFUT(path, self._cacheDir(), False, False)
+        self.failUnless(result[2])
+
+    def test_no_compile_at_render_time(self):
+        import os
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+        from pyramid_chameleon_genshi.cache import TemplateLRUCache
+        including = self._getTemplatePath('including.genshi')
+        nested = self._getTemplatePath('sub/nested.genshi')
+        for path in (including, nested):
+            self.assertEqual(self._callFUT(path, self._cacheDir(), False,
+                                           False)[2], None)
+        compiled = sorted(os.listdir(self._cacheDir()))
+        PyramidGenshiTemplateFile.global_registry = TemplateLRUCache()
+        template = PyramidGenshiTemplateFile(
+            including, cache=CompiledTemplateCache(self._cacheDir()))
+        self.failUnless('<span>abc</span>' in template(name='abc'))
+        fragment = PyramidGenshiTemplateFile.global_registry[nested]
+        self.assertEqual(fragment.format, 'xml')
+        # nothing was compiled, so nothing was added to the cache
+        self.assertEqual(sorted(os.listdir(self._cacheDir())), compiled)
+
+class Test_normalize_spec(unittest.TestCase):
+    def _callFUT(self, spec):
+        from pyramid_chameleon_genshi.build import normalize_spec
+        return normalize_spec(spec)
+
+    def test_spec(self):
+        self.assertEqual(self._callFUT('pkg:templates'), 'pkg:templates')
+
+    def test_abspath(self):
+        self.assertEqual(self._callFUT('/templates'), '/templates')
+
+    def test_relpath(self):
+        import os
+        here = os.path.dirname(__file__)
+        self.assertEqual(self._callFUT(here), os.path.abspath(here))
+
+    def test_package(self):
+        self.assertEqual(self._callFUT('nonexistent_package'),
+                         'nonexistent_package:')
+
+class Test_compile_templates(Base, unittest.TestCase):
+    def _callFUT(self, specs, **kw):
+        from pyramid_chameleon_genshi.build import compile_templates
+        return compile_templates(specs, self._cacheDir(), **kw)
+
+    def test_serial(self):
+        results = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures',
+                                 self._getTemplatePath('minimal.genshi')],
+                                processes=1)
+        self.assertEqual([result[0] for result in results], [
+            self._getTemplatePath('including.genshi'),
+            self._getTemplatePath('minimal.genshi'),
+            self._getTemplatePath('sub/nested.genshi'),
+            ])
+        self.assertEqual([result[2] for result in results], [None] * 3)
+
+    def test_pool(self):
+        results = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures'],
+                                processes=2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual([result[2] for result in results], [None] * 3)
+
+class Test_main(Base, unittest.TestCase):
+    def _callFUT(self, *args):
+        from StringIO import StringIO
+        from pyramid_chameleon_genshi.build import main
+        out = StringIO()
+        result = main(['pgenshi-compile'] + list(args), out)
+        return result, out.getvalue()
+
+    def test_it(self):
+        result, output = self._callFUT(
+            '-j', '1', '-d', self._cacheDir(),
+            'pyramid_chameleon_genshi.tests:fixtures/sub')
+        self.assertEqual(result, 0)
+        self.failUnless('nested.genshi' in output)
+        self.failUnless(output.endswith('1 templates compiled, 0 errors\n'))
+
+    def test_errors(self):
+        import os
+        broken = self._makeBroken()
+        result, output = self._callFUT('-j', '1', '-d', self._cacheDir(),
+                                       os.path.dirname(broken))
+        self.assertEqual(result, 1)
+        self.failUnless('ERROR  %s' % broken in output)
+        self.failUnless(output.endswith('0 templates compiled, 1 errors\n'))
+
+    def test_no_cache_dir(self):
+        self.assertRaises(SystemExit, self._callFUT, 'pkg:templates')
+
+    def test_no_specs(self):
+        self.assertRaises(SystemExit, self._callFUT, '-d', self._cacheDir())
@@ -0,0 +1,428 @@
+import unittest
+
+class Base(object):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def _getTemplatePath(self, name):
+        import os
+        here = os.path.abspath(os.path.dirname(__file__))
+        return os.path.join(here, 'fixtures', name)
+
+    def _makeTemplate(self, cache=None, name='minimal.genshi', **kw):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        return PyramidGenshiTemplateFile(self._getTemplatePath(name),
+                                         cache=cache, **kw)
+
+class TestCompiledTemplateCache(Base, unittest.TestCase):
+    def _getTargetClass(self):
+        from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+        return CompiledTemplateCache
+
+    def _makeOne(self, directory=None):
+        if directory is None:
+            directory = self.directory
+        return self._getTargetClass()(directory)
+
+    def test_class_implements_ICompiledTemplateCache(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi.interfaces import ICompiledTemplateCache
+        verifyClass(ICompiledTemplateCache, self._getTargetClass())
+
+    def test_creates_directory(self):
+        import os
+        directory = os.path.join(self.directory, 'a', 'b')
+        cache = self._makeOne(directory)
+        self.failUnless(os.path.isdir(directory))
+        self.assertEqual(cache.directory, directory)
+
+    def test_store_and_load(self):
+        import os
+        cache = self._makeOne()
+        code = compile('x = 1', '<string>', 'exec')
+        cache.store('abc', code)
+        self.assertEqual(os.listdir(self.directory), ['abc.pyc'])
+        self.assertEqual(cache.load('abc'), code)
+
+    def test_load_missing(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.load('abc'), None)
+
+    def test_load_bad_magic(self):
+        cache = self._makeOne()
+        f = open(cache.path('abc'), 'wb')
+        f.write('garbage')
+        f.close()
+        self.assertEqual(cache.load('abc'), None)
+
+    def test_load_truncated(self):
+        from pyramid_chameleon_genshi.cache import MAGIC
+        cache = self._makeOne()
+        f = open(cache.path('abc'), 'wb')
+        f.write(MAGIC + 'c')
+        f.close()
+        self.assertEqual(cache.load('abc'), None)
+
+    def test_store_unwritable(self):
+        import os
+        cache = self._makeOne()
+        cache.directory = os.path.join(self.directory, 'missing')
+        cache.store('abc', compile('x = 1', '<string>', 'exec'))
+        self.assertEqual(cache.load('abc'), None)
+
+    def test_digest_depends_on_settings(self):
+        cache = self._makeOne()
+        template = self._makeTemplate()
+        key = None, True, template.signature
+        digest = cache.digest(template, key)
+        self.assertEqual(cache.digest(template, key), digest)
+        self.assertNotEqual(cache.digest(template, ('', False, 'x')), digest)
+        template.debug = not template.debug
+        self.assertNotEqual(cache.digest(template, key), digest)
+
+    def test_digest_depends_on_source_rewrites(self):
+        cache = self._makeOne()
+        template = self._makeTemplate()
+        key = None, True, template.signature
+        digest = cache.digest(template, key)
+        template.fold_static = not template.fold_static
+        folded = cache.digest(template, key)
+        self.assertNotEqual(folded, digest)
+        template.source_version = template.source_version + 1
+        self.assertNotEqual(cache.digest(template, key), folded)
+
+    def test_digest_unicode_filename(self):
+        cache = self._makeOne()
+        template = self._makeTemplate()
+        key = None, True, template.signature
+        digest = cache.digest(template, key)
+        template.filename = unicode(template.filename)
+        self.assertEqual(cache.digest(template, key), digest)
+
+    def test_digest_depends_on_body(self):
+        cache = self._makeOne()
+        template = self._makeTemplate()
+        key = None, True, template.signature
+        digest = cache.digest(template, key)
+        template.body = template.body + ' '
+        self.assertNotEqual(cache.digest(template, key), digest)
+
+class TestCachingTemplateRegistry(Base, unittest.TestCase):
+    def _makeCache(self):
+        from pyramid_chameleon_genshi.cache import CompiledTemplateCache
+        return CompiledTemplateCache(self.directory)
+
+    def test_compiles_once_across_templates(self):
+        import os
+        cache = self._makeCache()
+        first = self._makeTemplate(cache)
+        self.assertEqual(first(),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        second = self._makeTemplate(cache)
+        def compiler(*arg): # pragma: no cover
+            raise AssertionError('recompiled')
+        second.compiler = compiler
+        self.assertEqual(second(),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+
+    def test_fold_static_not_shared(self):
+        import os
+        cache = self._makeCache()
+        self._makeTemplate(cache)()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        unfolded = self._makeTemplate(cache)
+        unfolded.fold_static = False
+        unfolded()
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_miss(self):
+        cache = self._makeCache()
+        template = self._makeTemplate(cache)
+        self.failIf((None, True, template.signature) in template.registry)
+
+    def test_in_memory(self):
+        cache = self._makeCache()
+        template = self._makeTemplate(cache)
+        template()
+        key = None, True, template.signature
+        self.failUnless(key in template.registry)
+        self.failUnless(callable(template.registry[key]))
+
+    def test_inlined_xincludes_not_cached(self):
+        import os
+        cache = self._makeCache()
+        template = self._makeTemplate(cache, name='including.genshi',
+                                      inline_xincludes=True)
+        template(name='abc')
+        self.assertEqual(os.listdir(self.directory), [])
+        from pyramid_chameleon_genshi import cook
+        cook(template, '', False)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.failIf(template.registry.cacheable((None, True, 'x')))
+        self.failUnless(template.registry.cacheable(('', False, 'x')))
+
+class TestLRUCache(unittest.TestCase):
+    def _getTargetClass(self):
+        from pyramid_chameleon_genshi.cache import LRUCache
+        return LRUCache
+
+    def _makeOne(self, max_entries=None, max_bytes=None):
+        class Sized(self._getTargetClass()):
+            def sizeof(self, value):
+                return len(value)
+        return Sized(max_entries, max_bytes)
+
+    def test_get_and_set(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('a'), None)
+        cache['a'] = '1'
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache['a'], '1')
+        self.failUnless('a' in cache)
+        self.assertEqual(len(cache), 1)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+
+    def test_replace(self):
+        cache = self._makeOne()
+        cache['a'] = '1'
+        cache['a'] = '22'
+        self.assertEqual(cache['a'], '22')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 2)
+
+    def test_peek(self):
+        cache = self._makeOne(2)
+        cache['a'] = 'x'
+        cache['b'] = 'y'
+        self.assertEqual(cache.peek('a'), 'x')
+        self.assertEqual(cache.peek('c', 'z'), 'z')
+        cache['c'] = 'z'
+        self.failIf('a' in cache)
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_setdefault(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.setdefault('a', '1'), '1')
+        self.assertEqual(cache.setdefault('a', '2'), '1')
+        self.assertEqual(cache['a'], '1')
+
+    def test_pop_and_delitem(self):
+        cache = self._makeOne()
+        cache['a'] = '1'
+        cache['b'] = '22'
+        self.assertEqual(cache.pop('a'), '1')
+        self.assertEqual(cache.pop('a'), None)
+        del cache['b']
+        self.assertRaises(KeyError, cache.__delitem__, 'b')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = self._makeOne(max_entries=2)
+        cache['a'] = '1'
+        cache['b'] = '2'
+        cache.get('a')
+        cache['c'] = '3'
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_setdefault_touches(self):
+        cache = self._makeOne(max_entries=2)
+        cache['a'] = '1'
+        cache['b'] = '2'
+        cache.setdefault('a', '3')
+        cache['c'] = '3'
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+
+    def test_max_bytes(self):
+        cache = self._makeOne(max_bytes=5)
+        cache['a'] = '111'
+        cache['b'] = '22'
+        self.assertEqual(sorted(cache.keys()), ['a', 'b'])
+        cache['c'] = '3'
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertEqual(cache.size, 3)
+
+    def test_oversized_item_kept(self):
+        cache = self._makeOne(max_bytes=2)
+        cache['a'] = '1'
+        cache['b'] = '333'
+        self.assertEqual(cache.keys(), ['b'])
+
+    def test_stats(self):
+        cache = self._makeOne(max_entries=1, max_bytes=10)
+        cache['a'] = '1'
+        cache.get('a')
+        cache.get('b')
+        cache['b'] = '22'
+        self.assertEqual(cache.stats(), {
+            'entries':1, 'bytes':2, 'max_entries':1, 'max_bytes':10,
+            'hits':1, 'misses':1, 'evictions':1})
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache['a'] = '1'
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_default_sizeof(self):
+        cache = self._getTargetClass()(max_bytes=1)
+        cache['a'] = '111'
+        cache['b'] = '222'
+        self.assertEqual(len(cache), 2)
+
+class TestTemplateLRUCache(Base, unittest.TestCase):
+    def _makeOne(self, *arg):
+        from pyramid_chameleon_genshi.cache import TemplateLRUCache
+        return TemplateLRUCache(*arg)
+
+    def test_sizeof(self):
+        cache = self._makeOne()
+        template = self._makeTemplate()
+        self.assertEqual(cache.sizeof(template), len(template.body))
+        self.assertEqual(cache.sizeof(object()), 0)
+
+    def test_share_stored(self):
+        cache = self._makeOne()
+        template = object()
+        cache['a'] = template
+        self.failUnless(cache.share('a', object) is template)
+        self.assertEqual(cache.stats()['shared'], 1)
+
+    def test_share_missing(self):
+        cache = self._makeOne()
+        template = object()
+        self.failUnless(cache.share('a', lambda: template) is template)
+        self.assertEqual(cache.stats()['shared'], 0)
+
+    def test_share_not_accepted(self):
+        cache = self._makeOne()
+        cache['a'] = object()
+        template = object()
+        result = cache.share('a', lambda: template, lambda t: False)
+        self.failUnless(result is template)
+        self.assertEqual(cache.stats()['shared'], 0)
+
+    def test_clear_resets_shared(self):
+        cache = self._makeOne()
+        cache['a'] = object()
+        cache.share('a', object)
+        cache.clear()
+        self.assertEqual(cache.stats()['shared'], 0)
+
+class TestOutputCache(unittest.TestCase):
+    def _makeOne(self, *arg):
+        from pyramid_chameleon_genshi.cache import OutputCache
+        self.now = 100.0
+        return OutputCache(timer=lambda: self.now, *arg)
+
+    def test_class_implements_IOutputCache(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi.cache import OutputCache
+        from pyramid_chameleon_genshi.interfaces import IOutputCache
+        verifyClass(IOutputCache, OutputCache)
+
+    def test_get_set(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', u'value')
+        self.now += 1000000
+        self.assertEqual(cache.get('a'), u'value')
+
+    def test_set_time(self):
+        cache = self._makeOne()
+        cache.set('a', u'value', 10)
+        self.now = 109.0
+        self.assertEqual(cache.get('a'), u'value')
+        self.now = 110.0
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_delete(self):
+        cache = self._makeOne()
+        cache.set('a', u'value')
+        cache.delete('a')
+        cache.delete('b')
+        self.assertEqual(cache.get('a'), None)
+
+    def test_bounds(self):
+        cache = self._makeOne(None, 10)
+        cache.set('a', u'12345')
+        cache.set('b', u'12345')
+        cache.set('c', u'1')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['bytes'], 6)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.set('a', u'value')
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+
+class TestMtimeCache(Base, unittest.TestCase):
+    def _makeOne(self):
+        from pyramid_chameleon_genshi.cache import MtimeCache
+        self.now = 100.0
+        return MtimeCache(timer=lambda: self.now)
+
+    def _makeFile(self, mtime):
+        import os
+        filename = os.path.join(self.directory, 'template.genshi')
+        open(filename, 'w').close()
+        os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_getmtime(self):
+        import os
+        filename = self._makeFile(1000)
+        cache = self._makeOne()
+        self.assertEqual(cache.getmtime(filename, 5), 1000)
+        os.utime(filename, (2000, 2000))
+        self.now = 104.0
+        self.assertEqual(cache.getmtime(filename, 5), 1000)
+        self.now = 105.0
+        self.assertEqual(cache.getmtime(filename, 5), 2000)
+
+    def test_forget(self):
+        import os
+        filename = self._makeFile(1000)
+        cache = self._makeOne()
+        cache.getmtime(filename, 5)
+        os.utime(filename, (2000, 2000))
+        cache.forget(filename)
+        cache.forget(filename)
+        self.assertEqual(cache.getmtime(filename, 5), 2000)
+
+    def test_getmtime_clock_moved_backwards(self):
+        import os
+        filename = self._makeFile(1000)
+        cache = self._makeOne()
+        cache.getmtime(filename, 5)
+        os.utime(filename, (2000, 2000))
+        self.now = 50.0
+        self.assertEqual(cache.getmtime(filename, 5), 2000)
+
+    def test_getmtime_missing(self):
+        import os
+        cache = self._makeOne()
+        filename = os.path.join(self.directory, 'nonexistent')
+        self.assertEqual(cache.getmtime(filename, 5), 0)
+
+    def test_clear(self):
+        import os
+        filename = self._makeFile(1000)
+        cache = self._makeOne()
+        cache.getmtime(filename, 5)
+        os.utime(filename, (2000, 2000))
+        cache.clear()
+        self.assertEqual(cache.getmtime(filename, 5), 2000)
@@ -57,19 +57,96 @@ class GenshiTemplateRendererTests(Base, unittest.TestCase):
         self.assertEqual(result,
                      '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
 
+    def test_call_does_not_mutate_arguments(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        lookup = DummyLookup()
+        instance = self._makeOne(nested, lookup)
+        value = {'name':'abc'}
+        system = {'name':'system', 'request':None}
+        result = instance(value, system)
+        self.failUnless('<span>abc</span>' in result)
+        self.assertEqual(value, {'name':'abc'})
+        self.assertEqual(system, {'name':'system', 'request':None})
+
     def test_template_reified(self):
         minimal = self._getTemplatePath('minimal.genshi')
         lookup = DummyLookup()
         instance = self._makeOne(minimal, lookup)
-        self.failIf('template' in instance.__dict__)
+        self.failIf(filled(instance, 'template'))
         template  = instance.template
-        self.assertEqual(template, instance.__dict__['template'])
+        self.failUnless(filled(instance, 'template'))
+        self.failUnless(instance.template is template)
+        self.failIf(hasattr(instance, '__dict__'))
+        instance.template = None
+        self.assertEqual(instance.template, None)
+        del instance.template
+        self.failIf(filled(instance, 'template'))
+        self.failIf(instance.template is template)
+
+    def test_metrics_and_output_cache_reified(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        metrics = DummyMetrics()
+        lookup.registry.registerUtility(metrics, ITemplateMetrics)
+        instance = self._makeOne(minimal, lookup)
+        self.failIf(filled(instance, 'metrics'))
+        self.failUnless(instance.metrics is metrics)
+        self.failUnless(filled(instance, 'metrics'))
+        self.assertEqual(instance.output_cache, None)
+        self.failUnless(filled(instance, 'output_cache'))
+        lookup.registry.registerUtility(object(), ITemplateOutputCache)
+        self.assertEqual(instance.output_cache, None)
+
+    def test_unknown_attribute(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        instance = self._makeOne(minimal, DummyLookup())
+        self.assertRaises(AttributeError, getattr, instance, 'nonesuch')
+        self.assertRaises(AttributeError, setattr, instance, 'nonesuch', 1)
+
+    def test_template_compiled(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        instance = self._makeOne(minimal, DummyLookup())
+        template = instance.template
+        self.failUnless((None, True, template.signature) in template.registry)
+
+    def test_template_single_flight(self):
+        import threading
+        import time
+        minimal = self._getTemplatePath('minimal.genshi')
+        made = []
+        class Renderer(self._getTargetClass()):
+            __slots__ = ()
+            def make_template(self, **kw):
+                made.append(1)
+                time.sleep(0.05)
+                return super(Renderer, self).make_template(**kw)
+        instance = Renderer(minimal, DummyLookup())
+        start = threading.Event()
+        results = []
+        def render():
+            start.wait()
+            results.append((instance.template, instance({}, {})))
+        threads = [threading.Thread(target=render) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(made), 1)
+        self.assertEqual(len(results), 20)
+        for template, result in results:
+            self.failUnless(template is instance.template)
+            self.assertEqual(result,
+                     '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
 
     def test_template_with_ichameleon_translate(self):
         minimal = self._getTemplatePath('minimal.genshi')
         lookup = DummyLookup()
         instance = self._makeOne(minimal, lookup)
-        self.failIf('template' in instance.__dict__)
+        self.failIf(filled(instance, 'template'))
         template  = instance.template
         self.assertEqual(template.translate, lookup.translate)
 
@@ -78,7 +155,7 @@ class GenshiTemplateRendererTests(Base, unittest.TestCase):
         lookup = DummyLookup()
         lookup.debug = True
         instance = self._makeOne(minimal, lookup)
-        self.failIf('template' in instance.__dict__)
+        self.failIf(filled(instance, 'template'))
         template  = instance.template
         self.assertEqual(template.debug, True)
 
@@ -87,7 +164,7 @@ class GenshiTemplateRendererTests(Base, unittest.TestCase):
         lookup = DummyLookup()
         lookup.auto_reload = True
         instance = self._makeOne(minimal, lookup)
-        self.failIf('template' in instance.__dict__)
+        self.failIf(filled(instance, 'template'))
         template  = instance.template
         self.assertEqual(template.auto_reload, True)
 
@@ -96,16 +173,165 @@ class GenshiTemplateRendererTests(Base, unittest.TestCase):
         lookup = DummyLookup()
         lookup.auto_reload = False
         instance = self._makeOne(minimal, lookup)
-        self.failIf('template' in instance.__dict__)
+        self.failIf(filled(instance, 'template'))
         template  = instance.template
         self.assertEqual(template.auto_reload, False)
 
+    def test_template_with_compiled_template_cache(self):
+        from pyramid_chameleon_genshi.interfaces import ICompiledTemplateCache
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        cache = DummyCompiledTemplateCache()
+        lookup.registry = DummyRegistry()
+        lookup.registry.registerUtility(cache, ICompiledTemplateCache)
+        instance = self._makeOne(minimal, lookup)
+        template = instance.template
+        self.failUnless(template.cache is cache)
+        self.failUnless(template.registry.template is template)
+
+    def test_template_without_compiled_template_cache(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        instance = self._makeOne(minimal, lookup)
+        self.assertEqual(instance.template.cache, None)
+
+    def test_call_with_output_cache(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        nested = self._getTemplatePath('sub/nested.genshi')
+        output_cache = TemplateOutputCache()
+        output_cache.add(nested, vary=('name',))
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        lookup.registry.registerUtility(output_cache, ITemplateOutputCache)
+        rendered = []
+        class Renderer(self._getTargetClass()):
+            __slots__ = ()
+            def render(self, values):
+                rendered.append(values['name'])
+                return self.template(**values)
+        instance = Renderer(nested, lookup)
+        result = instance({'name':'abc'}, {'request':object()})
+        self.failUnless('<span>abc</span>' in result)
+        self.assertEqual(instance({'name':'abc'}, {'request':object()}),
+                         result)
+        self.failUnless('<span>def</span>' in instance({'name':'def'}, {}))
+        self.assertEqual(rendered, ['abc', 'def'])
+        self.failUnless(instance.template.output_cache is output_cache)
+
+    def test_call_with_output_cache_other_template(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        minimal = self._getTemplatePath('minimal.genshi')
+        output_cache = TemplateOutputCache()
+        output_cache.add(self._getTemplatePath('sub/nested.genshi'))
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        lookup.registry.registerUtility(output_cache, ITemplateOutputCache)
+        instance = self._makeOne(minimal, lookup)
+        instance({}, {})
+        self.assertEqual(output_cache.backend.stats()['entries'], 0)
+
+    def test_render_gzip(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        nested = self._getTemplatePath('sub/nested.genshi')
+        output_cache = TemplateOutputCache()
+        output_cache.add(nested, vary=('name',), gzip_level=6)
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        lookup.registry.registerUtility(output_cache, ITemplateOutputCache)
+        instance = self._makeOne(nested, lookup)
+        text, body, etag = instance.render_gzip({'name':'abc'}, {})
+        self.assertEqual(text, None)
+        self.assertEqual(len(etag), 40)
+        self.assertEqual(gunzip(body), instance({'name':'abc'}, {}))
+
+    def test_render_gzip_without_output_cache(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        instance = self._makeOne(minimal, DummyLookup())
+        self.assertEqual(instance.render_gzip({}, {}),
+                         (instance({}, {}), None, None))
+
+    def test_template_with_reload_interval(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry(
+            {'chameleon_genshi.reload_interval':'2.5'})
+        instance = self._makeOne(minimal, lookup)
+        self.assertEqual(instance.template.reload_interval, 2.5)
+
+    def test_template_without_reload_interval(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        instance = self._makeOne(minimal, lookup)
+        self.assertEqual(instance.template.reload_interval, 0)
+
+    def test_template_with_inline_xincludes(self):
+        including = self._getTemplatePath('including.genshi')
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry(
+            {'chameleon_genshi.inline_xincludes':'true'})
+        lookup.debug = False
+        instance = self._makeOne(including, lookup)
+        self.assertEqual(instance.template.inline_xincludes, True)
+        self.assertEqual(instance.template.inlined,
+                         (self._getTemplatePath('sub/nested.genshi'),))
+
     def test_call_with_nondict_value(self):
         minimal = self._getTemplatePath('minimal.genshi')
         lookup = DummyLookup()
         instance = self._makeOne(minimal, lookup)
         self.assertRaises(ValueError, instance, None, {})
 
+    def test_call_with_metrics(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        minimal = self._getTemplatePath('minimal.genshi')
+        metrics = DummyMetrics()
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        lookup.registry.registerUtility(metrics, ITemplateMetrics)
+        instance = self._makeOne(minimal, lookup)
+        result = instance({}, {})
+        instance({}, {})
+        self.failUnless(instance.template.metrics is metrics)
+        self.assertEqual([event[:2] for event in metrics.events], [
+            ('compiled', minimal),
+            ('rendered', minimal),
+            ('rendered', minimal),
+            ])
+        self.assertEqual(metrics.events[1][3], len(result))
+
+    def test_call_without_metrics(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        lookup.registry = DummyRegistry()
+        instance = self._makeOne(minimal, lookup)
+        instance({}, {})
+        self.assertEqual(instance.metrics, None)
+        self.assertEqual(instance.template.metrics, None)
+
+    def test_stream(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        lookup = DummyLookup()
+        instance = self._makeOne(nested, lookup)
+        result = instance.stream({'name':'abc'}, {}, chunk_size=1)
+        self.failIf(isinstance(result, basestring))
+        result = list(result)
+        self.failUnless(len(result) > 1)
+        self.assertEqual(''.join(result),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n'
+                         '  <span>abc</span>\n</div>')
+        self.failUnless(instance.stream_template.stream)
+        self.failIf(filled(instance, 'template'))
+
+    def test_stream_with_nondict_value(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        lookup = DummyLookup()
+        instance = self._makeOne(minimal, lookup)
+        self.assertRaises(ValueError, instance.stream, None, {})
+
     def test_implementation(self):
         minimal = self._getTemplatePath('minimal.genshi')
         lookup = DummyLookup()
@@ -114,8 +340,556 @@ class GenshiTemplateRendererTests(Base, unittest.TestCase):
         self.failUnless(isinstance(result, unicode))
         self.assertEqual(result,
                      '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+
+    def test_render_many(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        instance = self._makeOne(nested, DummyLookup())
+        def values():
+            yield {'name':'a'}
+            raise AssertionError('rendered eagerly')
+        result = instance.render_many(values(), {})
+        self.failUnless(filled(instance, 'template'))
+        self.failUnless('<span>a</span>' in result.next())
+        self.assertRaises(AssertionError, result.next)
+
+    def test_render_many_system(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        instance = self._makeOne(nested, DummyLookup())
+        system = {'name':'system'}
+        result = list(instance.render_many([{}, {'name':'a'}, {}], system))
+        self.failUnless('<span>system</span>' in result[0])
+        self.failUnless('<span>a</span>' in result[1])
+        self.failUnless('<span>system</span>' in result[2])
+        self.assertEqual(system, {'name':'system'})
+
+    def test_render_many_processes(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        nested = self._getTemplatePath('sub/nested.genshi')
+        instance = self._makeOne(nested, DummyLookup())
+        result = instance.render_many([{'name':'a'}, {'name':'b'}], {},
+                                      processes=2)
+        self.assertEqual(GenshiTemplateRenderer.batches, {})
+        result = list(result)
+        self.failUnless('<span>a</span>' in result[0])
+        self.failUnless('<span>b</span>' in result[1])
+        self.assertEqual(GenshiTemplateRenderer.batches, {})
+
+    def test_render_many_processes_error(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        instance = self._makeOne(nested, DummyLookup())
+        result = instance.render_many([None], {}, processes=1)
+        self.assertRaises(ValueError, list, result)
+
+    def test_template_shared_by_canonical_path(self):
+        import os
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            cache = configure_xinclude_cache()
+            nested = self._getTemplatePath('sub/nested.genshi')
+            alias = os.path.join(os.path.dirname(nested), '..', 'sub',
+                                 'nested.genshi')
+            lookup = DummyLookup()
+            lookup.translate = None
+            first = self._makeOne(nested, lookup)
+            second = self._makeOne(alias, lookup)
+            self.failUnless(first.template is second.template)
+            self.failUnless(cache.get(nested) is first.template)
+            including = self._makeOne(
+                self._getTemplatePath('including.genshi'), lookup)
+            including({'name':'abc'}, {})
+            self.assertEqual(cache.stats()['shared'], 2)
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+
+    def test_template_not_shared_with_other_settings(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            cache = configure_xinclude_cache()
+            minimal = self._getTemplatePath('minimal.genshi')
+            first = self._makeOne(minimal, DummyLookup())
+            lookup = DummyLookup()
+            lookup.debug = False
+            second = self._makeOne(minimal, lookup)
+            self.failIf(first.template is second.template)
+            self.failUnless(cache.get(minimal) is first.template)
+            self.assertEqual(cache.stats()['shared'], 0)
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
         
 
+class PyramidGenshiTemplateFileTests(Base, unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        return PyramidGenshiTemplateFile(*arg, **kw)
+
+    def test_matches(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        def translate(msg): pass
+        template = self._makeOne(minimal, debug=True, translate=translate,
+                                 reload_interval=5)
+        self.failUnless(template.matches({}))
+        self.failUnless(template.matches({'debug':True, 'reload_interval':5,
+                                          'translate':translate}))
+        self.failIf(template.matches({'debug':False}))
+        self.failIf(template.matches({'translate':None}))
+        self.failIf(template.matches({'stream':True}))
+        self.failIf(template.matches({'format':'text'}))
+        template = self._makeOne(minimal, format='text')
+        self.failUnless(template.matches({'translate':None,
+                                          'reload_interval':None,
+                                          'format':'text'}))
+        self.failIf(template.matches({}))
+
+    def test_filter_source_folds_static_writes(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        source = "_write(u'a')\n_write(u'b')"
+        template = self._makeOne(minimal, debug=False)
+        self.assertEqual(template.filter_source(source, None, True),
+                         "_write(u'a' u'b')")
+        template = self._makeOne(minimal, debug=True)
+        self.assertEqual(template.filter_source(source, None, True), source)
+        template = self._makeOne(minimal, debug=False)
+        template.fold_static = False
+        self.assertEqual(template.filter_source(source, None, True), source)
+
+    def test_inline_xincludes(self):
+        from pyramid_chameleon_genshi import XIncludes
+        from pyramid_chameleon_genshi import cook
+        including = self._getTemplatePath('including.genshi')
+        nested = self._getTemplatePath('sub/nested.genshi')
+        expected = self._makeOne(including)(name='abc')
+        template = self._makeOne(including, inline_xincludes=True)
+        XIncludes.dependencies.clear()
+        try:
+            cook(template)
+            self.assertEqual(template.inlined, (nested,))
+            self.assertEqual(XIncludes.dependencies.includes(including),
+                             set([nested]))
+        finally:
+            XIncludes.dependencies.clear()
+        class Unused(object):
+            def get(self, filename, format): # pragma: no cover
+                raise AssertionError('dispatched')
+        template.xincludes = Unused()
+        self.assertEqual(template(name='abc'), expected)
+
+    def test_inline_xincludes_off_by_default(self):
+        including = self._getTemplatePath('including.genshi')
+        template = self._makeOne(including)
+        source = template.compiler(None, True)
+        self.failUnless("'render_xinclude'" in source)
+        self.assertEqual(template.inlined, ())
+        template = self._makeOne(including, inline_xincludes=True)
+        self.failIf("'render_xinclude'" in template.compiler(None, True))
+        self.failUnless("'render_xinclude'" in template.compiler('', False))
+        template = self._makeOne(including, inline_xincludes=True,
+                                 debug=True)
+        self.failUnless("'render_xinclude'" in template.compiler(None, True))
+
+    def test_inline_xincludes_signature_and_clone(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal, inline_xincludes=True)
+        self.assertNotEqual(template.signature,
+                            self._makeOne(minimal).signature)
+        self.assertEqual(template.clone(minimal).inline_xincludes, True)
+        self.failUnless(template.matches({'inline_xincludes':True}))
+        self.failIf(template.matches({'inline_xincludes':False}))
+
+    def test_inline_xincludes_leaves_cached_output(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        including = self._getTemplatePath('including.genshi')
+        nested = self._getTemplatePath('sub/nested.genshi')
+        output_cache = TemplateOutputCache()
+        output_cache.add(nested)
+        template = self._makeOne(including, inline_xincludes=True,
+                                 output_cache=output_cache)
+        self.failUnless("'render_xinclude'" in template.compiler(None, True))
+        self.assertEqual(template.inlined, ())
+
+    def test_inline_xincludes_leaves_broken_includes(self):
+        import os
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            page = os.path.join(directory, 'page.genshi')
+            f = open(page, 'w')
+            f.write('<div xmlns="http://www.w3.org/1999/xhtml" '
+                    'xmlns:py="http://genshi.edgewall.org/" '
+                    'xmlns:xi="http://www.w3.org/2001/XInclude">'
+                    '<py:if test="show">'
+                    '<xi:include href="missing.genshi"/>'
+                    '<xi:include href="broken.genshi"/>'
+                    '</py:if>ok</div>')
+            f.close()
+            f = open(os.path.join(directory, 'broken.genshi'), 'w')
+            f.write('<p xmlns="http://www.w3.org/1999/xhtml">')
+            f.close()
+            template = self._makeOne(page, inline_xincludes=True,
+                                     debug=False)
+            self.failUnless('ok' in template(show=False))
+            self.assertEqual(template.inlined, ())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_inline_xincludes_reloads_on_fragment_change(self):
+        import os
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            page = os.path.join(directory, 'page.genshi')
+            fragment = os.path.join(directory, 'fragment.genshi')
+            f = open(page, 'w')
+            f.write('<div xmlns="http://www.w3.org/1999/xhtml" '
+                    'xmlns:xi="http://www.w3.org/2001/XInclude">'
+                    '<xi:include href="fragment.genshi"/></div>')
+            f.close()
+            f = open(fragment, 'w')
+            f.write('<p xmlns="http://www.w3.org/1999/xhtml">one</p>')
+            f.close()
+            os.utime(page, (1000, 1000))
+            os.utime(fragment, (2000, 2000))
+            template = self._makeOne(page, auto_reload=True,
+                                     inline_xincludes=True)
+            self.failUnless('one' in template())
+            self.assertEqual(template.mtime(), 2000)
+            self.assertEqual(template._v_last_read, 2000)
+            f = open(fragment, 'w')
+            f.write('<p xmlns="http://www.w3.org/1999/xhtml">two</p>')
+            f.close()
+            os.utime(fragment, (3000, 3000))
+            self.failUnless('two' in template())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tracked_and_counts_renders(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal)
+        self.failUnless(
+            PyramidGenshiTemplateFile.instances[id(template)] is template)
+        self.assertEqual(template.renders, 0)
+        self.assertEqual(template.last_rendered, None)
+        template()
+        template()
+        self.assertEqual(template.renders, 2)
+        self.failUnless(template.last_rendered > 0)
+
+    def test_evict(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal)
+        expected = template()
+        self.failUnless('compiler' in template.__dict__)
+        template.evict()
+        self.failIf('compiler' in template.__dict__)
+        self.failIf('macros' in template.__dict__)
+        self.assertEqual(template(), expected)
+        from pyramid_chameleon_genshi import cook
+        cook(template, '', False)
+        self.failUnless('compiler' in template.__dict__)
+
+    def test_stream_mode_not_registered(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            cache = configure_xinclude_cache()
+            minimal = self._getTemplatePath('minimal.genshi')
+            self._makeOne(minimal, stream=True)
+            self.assertEqual(cache.keys(), [])
+            template = self._makeOne(minimal)
+            self._makeOne(minimal, stream=True)
+            self.failUnless(cache.get(minimal) is template)
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+
+    def test_clone_keeps_settings(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        nested = self._getTemplatePath('sub/nested.genshi')
+        def translate(msg): pass
+        cache = DummyCompiledTemplateCache()
+        metrics = DummyMetrics()
+        template = self._makeOne(minimal, auto_reload=True, debug=True,
+                                 translate=translate, cache=cache,
+                                 metrics=metrics, reload_interval=5)
+        clone = template.clone(nested, format='xml')
+        self.failUnless(clone.__class__ is template.__class__)
+        self.assertEqual(clone.filename, nested)
+        self.assertEqual(clone.format, 'xml')
+        self.assertEqual(clone.auto_reload, True)
+        self.assertEqual(clone.debug, True)
+        self.failUnless(clone.translate is translate)
+        self.failUnless(clone.cache is cache)
+        self.failUnless(clone.registry.template is clone)
+        self.failUnless(clone.metrics is metrics)
+        self.assertEqual(clone.reload_interval, 5)
+
+    def test_mtime_with_reload_interval(self):
+        from pyramid_chameleon_genshi.cache import MtimeCache
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal, auto_reload=True,
+                                 reload_interval=5)
+        template.mtimes = MtimeCache(timer=lambda: 0)
+        template.mtimes.data[minimal] = (0, 1234)
+        self.assertEqual(template.mtime(), 1234)
+
+    def test_mtime_without_reload_interval(self):
+        import os
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal, auto_reload=True)
+        template.mtimes = None
+        self.assertEqual(template.mtime(), os.path.getmtime(minimal))
+
+    def test_reload_interval_delays_reload(self):
+        import os
+        import shutil
+        import tempfile
+        from pyramid_chameleon_genshi.cache import MtimeCache
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'page.genshi')
+            shutil.copy(self._getTemplatePath('minimal.genshi'), filename)
+            os.utime(filename, (1000, 1000))
+            now = [0]
+            template = self._makeOne(filename, auto_reload=True,
+                                     reload_interval=5)
+            template.mtimes = MtimeCache(timer=lambda: now[0])
+            template()
+            f = open(filename, 'w')
+            f.write('<p xmlns="http://www.w3.org/1999/xhtml">changed</p>')
+            f.close()
+            os.utime(filename, (2000, 2000))
+            now[0] = 4
+            self.failIf('changed' in template())
+            now[0] = 5
+            self.failUnless('changed' in template())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stream_mode(self):
+        nested = self._getTemplatePath('sub/nested.genshi')
+        template = self._makeOne(nested, stream=True)
+        result = template.iterrender(name='abc')
+        self.failUnless(isinstance(result, list))
+        self.failUnless(len(result) > 1)
+        self.assertEqual(''.join(result), self._makeOne(nested)(name='abc'))
+        self.assertEqual(template(name='abc'), ''.join(result))
+
+    def test_stream_mode_signature(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        self.assertNotEqual(self._makeOne(minimal, stream=True).signature,
+                            self._makeOne(minimal).signature)
+
+    def test_stream_mode_not_cloned(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal, stream=True)
+        clone = template.clone(minimal)
+        self.assertEqual(clone.stream, False)
+        self.assertEqual(clone.signature, self._makeOne(minimal).signature)
+
+    def test_iterrender_without_stream_mode(self):
+        minimal = self._getTemplatePath('minimal.genshi')
+        template = self._makeOne(minimal)
+        self.assertEqual(template.iterrender(),
+                     ['<div xmlns="http://www.w3.org/1999/xhtml">\n</div>'])
+
+    def test_registered_in_global_registry(self):
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            cache = configure_xinclude_cache(max_entries=1)
+            minimal = self._getTemplatePath('minimal.genshi')
+            nested = self._getTemplatePath('sub/nested.genshi')
+            template = self._makeOne(minimal)
+            self.failUnless(cache.get(minimal) is template)
+            self.failUnless(template.xincludes.registry is cache)
+            clone = template.xincludes.get(nested, 'xml')
+            self.assertEqual(cache.keys(), [nested])
+            self.failUnless(template.xincludes.get(nested, 'xml') is clone)
+            self.assertEqual(cache.stats()['evictions'], 1)
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+
+class Test_single_flight(unittest.TestCase):
+    def test_fill(self):
+        from pyramid_chameleon_genshi import single_flight
+        calls = []
+        class Foo(object):
+            __slots__ = ('path', 'value')
+            def compute(self):
+                calls.append(1)
+                return 'abc'
+        foo = Foo()
+        foo.path = '/a'
+        self.assertEqual(single_flight.fill(foo, 'value', foo.compute), 'abc')
+        self.assertEqual(foo.value, 'abc')
+        self.assertEqual(single_flight.fill(foo, 'value', foo.compute), 'abc')
+        self.assertEqual(calls, [1])
+
+    def test_lock_per_path(self):
+        from pyramid_chameleon_genshi import single_flight
+        self.failUnless(single_flight.get_lock('/a') is
+                        single_flight.get_lock('/a'))
+        self.failIf(single_flight.get_lock('/a') is
+                    single_flight.get_lock('/b'))
+
+class Test_namespace(unittest.TestCase):
+    def _callFUT(self, system, value):
+        from pyramid_chameleon_genshi import namespace
+        return namespace(system, value)
+
+    def test_it(self):
+        from chameleon.core.utils import econtext
+        system = {'a':1, 'b':2}
+        value = {'b':3}
+        result = self._callFUT(system, value)
+        self.failUnless(isinstance(result, econtext))
+        self.assertEqual(result, {'a':1, 'b':3})
+        self.assertEqual(system, {'a':1, 'b':2})
+
+    def test_nondict_value(self):
+        self.assertRaises(ValueError, self._callFUT, {}, None)
+        self.assertRaises(ValueError, self._callFUT, {}, ['a'])
+
+class Test_configure_xinclude_cache(unittest.TestCase):
+    def setUp(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        self.original = PyramidGenshiTemplateFile.global_registry
+
+    def tearDown(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+
+    def _callFUT(self, *arg, **kw):
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        return configure_xinclude_cache(*arg, **kw)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi import get_xinclude_cache
+        from pyramid_chameleon_genshi.cache import TemplateLRUCache
+        cache = self._callFUT(max_entries=5, max_bytes=100)
+        self.failUnless(isinstance(cache, TemplateLRUCache))
+        self.assertEqual(cache.max_entries, 5)
+        self.assertEqual(cache.max_bytes, 100)
+        self.failUnless(get_xinclude_cache() is cache)
+
+class Test_fold_static_writes(unittest.TestCase):
+    def _callFUT(self, source):
+        from pyramid_chameleon_genshi import fold_static_writes
+        return fold_static_writes(source)
+
+    def test_folds_runs(self):
+        source = '\n'.join([
+            "def render():",
+            "    attrs = _attrs_1",
+            "    _write(u'<div>')",
+            "    attrs = _attrs_2",
+            "    u'title'",
+            "    _write(u\"<h1 title='a'>\")",
+            "    _write(title)",
+            "    _write(u'</h1>\\n')",
+            "    if x:",
+            "        _write(u'a')",
+            "        _write('b')",
+            "    _write(u'</div>')",
+            ])
+        self.assertEqual(self._callFUT(source), '\n'.join([
+            "def render():",
+            "    attrs = _attrs_2",
+            "    _write(u'<div>' u\"<h1 title='a'>\")",
+            "    _write(title)",
+            "    _write(u'</h1>\\n')",
+            "    if x:",
+            "        _write(u'a' 'b')",
+            "    _write(u'</div>')",
+            ]))
+
+    def test_empty_block(self):
+        source = '\n'.join([
+            "if x:",
+            "    u'documentation'",
+            "y = 1",
+            ])
+        self.assertEqual(self._callFUT(source), '\n'.join([
+            "if x:",
+            "    pass",
+            "y = 1",
+            ]))
+
+    def test_multiline_statements_untouched(self):
+        source = '\n'.join([
+            "x = [",
+            "    'a'",
+            "    ]",
+            'y = """',
+            "_write(u'a')",
+            '"""',
+            ])
+        self.assertEqual(self._callFUT(source), source)
+
+    def test_templates(self):
+        import os
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        original = PyramidGenshiTemplateFile.global_registry
+        here = os.path.dirname(os.path.dirname(__file__))
+        path = os.path.join(here, 'bench_templates', 'loop.genshi')
+        values = {'title':'Title', 'rows':[
+            {'id':1, 'name':'a', 'owner':'o', 'size':1, 'active':True}]}
+        try:
+            results = []
+            for fold_static in (False, True):
+                configure_xinclude_cache()
+                template = PyramidGenshiTemplateFile(path, debug=False)
+                template.fold_static = fold_static
+                results.append(template(**values))
+                source = template.compiler(None, True)
+                results.append(source.count('_write('))
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+        self.assertEqual(results[0], results[2])
+        self.failUnless(results[3] < results[1])
+
+class Test_render_inlined(unittest.TestCase):
+    def _callFUT(self, *arg, **kw):
+        from pyramid_chameleon_genshi import render_inlined
+        return render_inlined(*arg, **kw)
+
+    def test_it(self):
+        calls = []
+        def render(econtext, rcontext):
+            calls.append((econtext, rcontext))
+        econtext = {'a':1, '_slots':{'x':None}}
+        self.assertEqual(self._callFUT(render, econtext, _out=2), None)
+        self.assertEqual(calls, [({'a':1, '_out':2, '_slots':{}}, econtext)])
+        self.assertEqual(econtext, {'a':1, '_slots':{'x':None}})
+
+class Test_iter_chunks(unittest.TestCase):
+    def _callFUT(self, fragments, *arg):
+        from pyramid_chameleon_genshi import iter_chunks
+        return list(iter_chunks(fragments, *arg))
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT([]), [])
+
+    def test_chunk_size(self):
+        result = self._callFUT([u'ab', u'c', u'de', u'f'], 'utf-8', 3)
+        self.assertEqual(result, ['abc', 'def'])
+
+    def test_remainder(self):
+        result = self._callFUT([u'ab', u'c', u'd'], 'utf-8', 3)
+        self.assertEqual(result, ['abc', 'd'])
+
+    def test_encoding(self):
+        result = self._callFUT([u'\xe9'], 'latin-1')
+        self.assertEqual(result, ['\xe9'])
+
 class RenderTemplateTests(Base, unittest.TestCase):
     def _callFUT(self, name, **kw):
         from pyramid_chameleon_genshi import render_template
@@ -145,6 +919,95 @@ class RenderTemplateToResponseTests(Base, unittest.TestCase):
         self.assertEqual(result.status, '200 OK')
         self.assertEqual(len(result.headerlist), 2)
 
+    def _addGzipPolicy(self, name, **kw):
+        from pyramid_chameleon_genshi import get_output_cache
+        path = self._getTemplatePath(name)
+        get_output_cache(self.config.registry).add(path, **kw)
+        return path
+
+    def _makeRequest(self, accept_encoding='gzip, deflate'):
+        from webob import Request
+        return Request.blank('/', headers={'Accept-Encoding':accept_encoding})
+
+    def test_gzip(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9)
+        result = self._callFUT(minimal, request=self._makeRequest())
+        self.assertEqual(gunzip(result.body),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+        self.assertEqual(result.content_encoding, 'gzip')
+        self.assertEqual(len(result.etag), 40)
+        self.assertEqual(result.headers['Vary'], 'Accept-Encoding')
+        again = self._callFUT(minimal, request=self._makeRequest())
+        self.assertEqual(again.body, result.body)
+        self.assertEqual(again.etag, result.etag)
+
+    def test_gzip_not_accepted(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9)
+        result = self._callFUT(minimal, request=self._makeRequest('gzip;q=0'))
+        self.assertEqual(result.content_encoding, None)
+        self.assertEqual(result.body,
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+        self.assertEqual(result.headers['Vary'], 'Accept-Encoding')
+
+    def test_gzip_keeps_vary(self):
+        from pyramid.testing import DummyRequest
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9)
+        for accept_encoding, content_encoding in (('gzip', 'gzip'),
+                                                  ('identity', None)):
+            request = DummyRequest()
+            request.accept_encoding = [accept_encoding]
+            request.response_headerlist = [('Vary', 'Cookie')]
+            result = self._callFUT(minimal, request=request)
+            self.assertEqual(result.content_encoding, content_encoding)
+            self.assertEqual(result.headers['Vary'], 'Cookie, Accept-Encoding')
+            request = DummyRequest()
+            request.accept_encoding = [accept_encoding]
+            request.response_headerlist = [('Vary', 'accept-encoding')]
+            result = self._callFUT(minimal, request=request)
+            self.assertEqual(result.headers['Vary'], 'accept-encoding')
+
+    def test_gzip_no_request(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9)
+        result = self._callFUT(minimal)
+        self.assertEqual(result.content_encoding, None)
+        self.assertEqual(result.headers['Vary'], 'Accept-Encoding')
+
+    def test_gzip_uncacheable(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9,
+                                      cache_key=lambda values: None)
+        result = self._callFUT(minimal, request=self._makeRequest())
+        self.assertEqual(result.content_encoding, None)
+        self.assertEqual(result.etag, None)
+        self.assertEqual(result.headers['Vary'], 'Accept-Encoding')
+
+    def test_gzip_without_policy(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi')
+        result = self._callFUT(minimal, request=self._makeRequest())
+        self.assertEqual(result.content_encoding, None)
+        self.assertEqual(result.etag, None)
+        self.assertEqual(result.body,
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+        self.failIf('Vary' in result.headers)
+
+    def test_gzip_other_charset(self):
+        self._registerRenderer()
+        minimal = self._addGzipPolicy('minimal.genshi', gzip_level=9)
+        from webob import Response
+        class Latin1Response(Response):
+            default_charset = 'latin-1'
+        from pyramid.interfaces import IResponseFactory
+        self._registerUtility(Latin1Response, IResponseFactory)
+        result = self._callFUT(minimal, request=self._makeRequest())
+        self.assertEqual(result.content_encoding, None)
+        self.assertEqual(result.charset, 'latin-1')
+        self.assertEqual(result.headers['Vary'], 'Accept-Encoding')
+
     def test_iresponsefactory_override(self):
         self._registerRenderer()
         from webob import Response
@@ -156,6 +1019,82 @@ class RenderTemplateToResponseTests(Base, unittest.TestCase):
         result = self._callFUT(minimal)
         self.failUnless(isinstance(result, Response2))
 
+class StreamTemplateToResponseTests(Base, unittest.TestCase):
+    def _callFUT(self, path, **kw):
+        from pyramid_chameleon_genshi import stream_template_to_response
+        return stream_template_to_response(path, **kw)
+
+    def test_it(self):
+        self._registerRenderer()
+        nested = self._getTemplatePath('sub/nested.genshi')
+        result = self._callFUT(nested, name='abc')
+        from webob import Response
+        self.failUnless(isinstance(result, Response))
+        self.failIf(isinstance(result.app_iter, list))
+        self.assertEqual(result.status, '200 OK')
+        self.assertEqual(result.content_length, None)
+        self.assertEqual(''.join(result.app_iter),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n'
+                         '  <span>abc</span>\n</div>')
+
+    def test_system_values(self):
+        self._registerRenderer()
+        from pyramid.interfaces import IRendererGlobalsFactory
+        from pyramid.interfaces import IBeforeRender
+        def globals_factory(system):
+            return {'name':system['renderer_name'][-13:]}
+        self._registerUtility(globals_factory, IRendererGlobalsFactory)
+        events = []
+        self.config.add_subscriber(events.append, IBeforeRender)
+        nested = self._getTemplatePath('sub/nested.genshi')
+        request = DummyRequest()
+        result = self._callFUT(nested, request=request)
+        self.failUnless('<span>nested.genshi</span>' in
+                        ''.join(result.app_iter))
+        self.assertEqual(len(events), 1)
+        self.failUnless(events[0]['request'] is request)
+        self.failUnless(events[0]['context'] is request.context)
+
+    def test_response_attributes(self):
+        self._registerRenderer()
+        minimal = self._getTemplatePath('minimal.genshi')
+        request = DummyRequest()
+        request.response_status = '404 Not Found'
+        result = self._callFUT(minimal, request=request)
+        self.assertEqual(result.status, '404 Not Found')
+
+class RenderManyTests(Base, unittest.TestCase):
+    def _callFUT(self, path, values, **kw):
+        from pyramid_chameleon_genshi import render_many
+        return render_many(path, values, **kw)
+
+    def test_it(self):
+        self._registerRenderer()
+        from pyramid.interfaces import IBeforeRender
+        events = []
+        self.config.add_subscriber(events.append, IBeforeRender)
+        nested = self._getTemplatePath('sub/nested.genshi')
+        request = DummyRequest()
+        result = self._callFUT(nested, [{'name':'a'}, {'name':'b'}],
+                               request=request)
+        self.failIf(isinstance(result, list))
+        result = list(result)
+        self.assertEqual(len(result), 2)
+        self.failUnless('<span>a</span>' in result[0])
+        self.failUnless('<span>b</span>' in result[1])
+        self.assertEqual(len(events), 1)
+        self.failUnless(events[0]['request'] is request)
+
+    def test_processes(self):
+        self._registerRenderer()
+        nested = self._getTemplatePath('sub/nested.genshi')
+        values = [{'name':str(i)} for i in range(5)]
+        result = list(self._callFUT(nested, values, processes=2,
+                                    chunksize=2))
+        self.assertEqual(len(result), 5)
+        for i, text in enumerate(result):
+            self.failUnless('<span>%d</span>' % i in text)
+
 class GetRendererTests(Base, unittest.TestCase):
     def _callFUT(self, name):
         from pyramid_chameleon_genshi import get_renderer
@@ -174,6 +1113,42 @@ class GetRendererTests(Base, unittest.TestCase):
         result = self._callFUT('foo')
         self.failUnless(result is renderer)
 
+    def test_memoized_per_module_and_path(self):
+        from pyramid.interfaces import IRendererFactory
+        from pyramid.threadlocal import get_current_registry
+        infos = []
+        def rf(info):
+            infos.append(info)
+            return object()
+        self._registerUtility(rf, IRendererFactory, name='foo')
+        result = self._callFUT('foo')
+        self.failUnless(self._callFUT('foo') is result)
+        self.assertEqual(len(infos), 1)
+        import pyramid_chameleon_genshi.tests
+        self.failUnless(infos[0].package is pyramid_chameleon_genshi.tests)
+        helpers = get_current_registry().genshi_renderer_helpers
+        self.assertEqual(helpers.keys(), [(__name__, 'foo')])
+        from pyramid_chameleon_genshi import get_renderer
+        get_renderer('foo')
+        self.assertEqual(len(infos), 1)
+        self._registerUtility(rf, IRendererFactory, name='bar')
+        self._callFUT('bar')
+        self.assertEqual(len(infos), 2)
+
+    def test_not_memoized_with_reload_assets(self):
+        from pyramid.interfaces import IRendererFactory
+        from pyramid.threadlocal import get_current_registry
+        get_current_registry().settings = {'reload_assets':True}
+        infos = []
+        def rf(info):
+            infos.append(info)
+            return object()
+        self._registerUtility(rf, IRendererFactory, name='foo')
+        self.failIf(self._callFUT('foo') is self._callFUT('foo'))
+        self.assertEqual(len(infos), 2)
+        import pyramid_chameleon_genshi.tests
+        self.failUnless(infos[0].package is pyramid_chameleon_genshi.tests)
+
 class GetTemplateTests(Base, unittest.TestCase):
     def _callFUT(self, name):
         from pyramid_chameleon_genshi import get_template
@@ -255,19 +1230,693 @@ class Test_includeme(unittest.TestCase):
 
     def test_it(self):
         from pyramid_chameleon_genshi import renderer_factory
-        class DummyConfigurator(object):
-            def __init__(self):
-                self.renderers = {}
+        config = DummyConfigurator()
+        self._callFUT(config)
+        self.assertEqual(config.renderers['.genshi'], renderer_factory)
+        self.assertEqual(config.actions, [])
+        self.assertEqual(config.subscribers, [])
+
+    def test_it_precompile(self):
+        from pyramid_chameleon_genshi import precompile
+        config = DummyConfigurator({
+            'chameleon_genshi.precompile':'true',
+            'chameleon_genshi.precompile_paths':'a:templates\n /b/templates',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.actions,
+                         [(None, precompile,
+                           (config.registry, ['a:templates', '/b/templates']))])
+
+    def test_it_precompile_concurrently(self):
+        import sys
+        from pyramid_chameleon_genshi import warm_up
+        config = DummyConfigurator({
+            'chameleon_genshi.precompile':'true',
+            'chameleon_genshi.precompile_paths':'a:templates',
+            'chameleon_genshi.precompile_processes':'4',
+            'chameleon_genshi.precompile_report':'true',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.actions,
+                         [(None, warm_up, (config.registry, ['a:templates']))])
+        self.assertEqual(config.action_kws, [{
+            'threads':None, 'processes':4, 'out':sys.stderr, 'strict':True}])
+
+    def test_it_precompile_threads(self):
+        config = DummyConfigurator({
+            'chameleon_genshi.precompile':'true',
+            'chameleon_genshi.precompile_paths':'a:templates',
+            'chameleon_genshi.precompile_threads':'8',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.action_kws, [{
+            'threads':8, 'processes':None, 'out':None, 'strict':True}])
+
+    def test_it_cache_dir(self):
+        import shutil
+        import tempfile
+        from pyramid_chameleon_genshi.interfaces import ICompiledTemplateCache
+        directory = tempfile.mkdtemp()
+        try:
+            config = DummyConfigurator({'chameleon_genshi.cache_dir':directory})
+            self._callFUT(config)
+            cache = config.registry.queryUtility(ICompiledTemplateCache)
+            self.assertEqual(cache.directory, directory)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_it_xinclude_cache(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        original = PyramidGenshiTemplateFile.global_registry
+        try:
+            config = DummyConfigurator({
+                'chameleon_genshi.xinclude_cache_max_entries':'10',
+                })
+            self._callFUT(config)
+            cache = PyramidGenshiTemplateFile.global_registry
+            self.failIf(cache is original)
+            self.assertEqual(cache.max_entries, 10)
+            self.assertEqual(cache.max_bytes, None)
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
 
-            def add_renderer(self, name, impl):
-                self.renderers[name] = impl
+    def test_it_metrics_registry(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import MetricsRegistry
+        config = DummyConfigurator({'chameleon_genshi.metrics':'registry'})
+        self._callFUT(config)
+        utility = config.registry.queryUtility(ITemplateMetrics)
+        self.failUnless(isinstance(utility, MetricsRegistry))
+        self.assertEqual(config.routes, [])
+
+    def test_it_metrics_registry_view(self):
+        from pyramid_chameleon_genshi.metrics import metrics_view
+        config = DummyConfigurator({
+            'chameleon_genshi.metrics':'registry',
+            'chameleon_genshi.metrics_path':'/_genshi_metrics',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.routes,
+                         [('chameleon_genshi.metrics', '/_genshi_metrics')])
+        self.assertEqual(config.views, [(metrics_view, {
+            'route_name':'chameleon_genshi.metrics', 'renderer':'json'})])
+
+    def test_it_templates_view(self):
+        from pyramid_chameleon_genshi.memory import templates_view
+        config = DummyConfigurator({
+            'chameleon_genshi.templates_path':'/_genshi_templates',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.routes,
+                         [('chameleon_genshi.templates', '/_genshi_templates')])
+        self.assertEqual(config.views, [(templates_view, {
+            'route_name':'chameleon_genshi.templates', 'renderer':'json'})])
+
+    def test_it_profile(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        config = DummyConfigurator({'chameleon_genshi.profile':'true'})
+        try:
+            self._callFUT(config)
+            self.assertEqual(PyramidGenshiTemplateFile.profiling, True)
+            self.assertEqual(config.subscribers, [])
+        finally:
+            PyramidGenshiTemplateFile.profiling = False
+
+    def test_it_profile_header(self):
+        from pyramid.events import NewRequest
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        config = DummyConfigurator({
+            'chameleon_genshi.profile_header':'X-Genshi-Profile',
+            'chameleon_genshi.profile_header_secret':'s3cret'})
+        try:
+            self._callFUT(config)
+            self.assertEqual(PyramidGenshiTemplateFile.profiling, True)
+            (subscriber, iface), = config.subscribers
+            self.failUnless(iface is NewRequest)
+            self.assertEqual(subscriber.header, 'X-Genshi-Profile')
+            self.assertEqual(subscriber.secret, 's3cret')
+        finally:
+            PyramidGenshiTemplateFile.profiling = False
+
+    def test_it_profile_header_without_secret(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        config = DummyConfigurator({
+            'chameleon_genshi.profile_header':'X-Genshi-Profile'})
+        self.assertRaises(ValueError, self._callFUT, config)
+        self.assertEqual(config.subscribers, [])
+        self.assertEqual(PyramidGenshiTemplateFile.profiling, False)
+
+    def test_it_metrics_statsd(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import StatsdMetrics
+        config = DummyConfigurator({
+            'chameleon_genshi.metrics':'statsd',
+            'chameleon_genshi.statsd_port':'9125',
+            'chameleon_genshi.statsd_prefix':'app',
+            })
+        self._callFUT(config)
+        utility = config.registry.queryUtility(ITemplateMetrics)
+        self.failUnless(isinstance(utility, StatsdMetrics))
+        self.assertEqual(utility.address, ('127.0.0.1', 9125))
+        self.assertEqual(utility.prefix, 'app')
 
+    def test_it_metrics_unknown(self):
+        config = DummyConfigurator({'chameleon_genshi.metrics':'bogus'})
+        self.assertRaises(ValueError, self._callFUT, config)
+
+    def test_it_output_cache(self):
+        from pyramid_chameleon_genshi import add_genshi_output_cache
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
         config = DummyConfigurator()
         self._callFUT(config)
-        self.assertEqual(config.renderers['.genshi'], renderer_factory)
-        
+        self.assertEqual(config.directives['add_genshi_output_cache'],
+                         add_genshi_output_cache)
+        self.assertEqual(
+            config.registry.queryUtility(ITemplateOutputCache), None)
+
+    def test_it_output_cache_bounds(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        config = DummyConfigurator({
+            'chameleon_genshi.output_cache_max_bytes':'1000',
+            })
+        self._callFUT(config)
+        output_cache = config.registry.queryUtility(ITemplateOutputCache)
+        self.assertEqual(output_cache.backend.stats()['max_entries'], None)
+        self.assertEqual(output_cache.backend.stats()['max_bytes'], 1000)
+
+    def test_it_render_threads(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        original = GenshiTemplateRenderer.executor
+        try:
+            config = DummyConfigurator({
+                'chameleon_genshi.render_threads':'3'})
+            self._callFUT(config)
+            executor = GenshiTemplateRenderer.executor
+            self.assertEqual(executor.max_workers, 3)
+            executor.shutdown()
+        finally:
+            GenshiTemplateRenderer.executor = original
+
+    def test_it_precompile_false(self):
+        config = DummyConfigurator({
+            'chameleon_genshi.precompile':'false',
+            'chameleon_genshi.precompile_paths':'a:templates',
+            })
+        self._callFUT(config)
+        self.assertEqual(config.actions, [])
+
+class Test_aslist(unittest.TestCase):
+    def _callFUT(self, value):
+        from pyramid_chameleon_genshi import aslist
+        return aslist(value)
+
+    def test_None(self):
+        self.assertEqual(self._callFUT(None), [])
+
+    def test_string(self):
+        self.assertEqual(self._callFUT(' a\nb  c\n'), ['a', 'b', 'c'])
+
+    def test_sequence(self):
+        self.assertEqual(self._callFUT(('a', 'b')), ['a', 'b'])
+
+class Test_cook(unittest.TestCase):
+    def _callFUT(self, template, *arg):
+        from pyramid_chameleon_genshi import cook
+        return cook(template, *arg)
+
+    def _makeTemplate(self):
+        import os
+        from pyramid_chameleon_genshi import GenshiTemplateFile
+        here = os.path.abspath(os.path.dirname(__file__))
+        return GenshiTemplateFile(os.path.join(here, 'fixtures',
+                                               'minimal.genshi'))
+
+    def test_compiles_without_rendering(self):
+        template = self._makeTemplate()
+        key = None, True, template.signature
+        self.failIf(key in template.registry)
+        func = self._callFUT(template)
+        self.failUnless(key in template.registry)
+        self.failUnless(func is template.registry[key])
+
+    def test_already_compiled(self):
+        template = self._makeTemplate()
+        func = self._callFUT(template)
+        def compiler(*arg): # pragma: no cover
+            raise AssertionError('recompiled')
+        template.compiler = compiler
+        self.failUnless(self._callFUT(template) is func)
+
+    def test_xinclude_macro(self):
+        template = self._makeTemplate()
+        self._callFUT(template, '', False)
+        self.failUnless(('', False, template.signature) in template.registry)
+
+class Test_find_templates(Base, unittest.TestCase):
+    def _callFUT(self, spec):
+        from pyramid_chameleon_genshi import find_templates
+        return list(find_templates(spec))
+
+    def test_resource_spec_directory(self):
+        result = self._callFUT('pyramid_chameleon_genshi.tests:fixtures')
+        self.assertEqual(result, [
+            ('pyramid_chameleon_genshi.tests:fixtures/including.genshi',
+             self._getTemplatePath('including.genshi')),
+            ('pyramid_chameleon_genshi.tests:fixtures/minimal.genshi',
+             self._getTemplatePath('minimal.genshi')),
+            ('pyramid_chameleon_genshi.tests:fixtures/sub/nested.genshi',
+             self._getTemplatePath('sub/nested.genshi')),
+            ])
+
+    def test_resource_spec_package(self):
+        result = self._callFUT('pyramid_chameleon_genshi.tests:')
+        self.assertEqual(result[-1], (
+            'pyramid_chameleon_genshi.tests:fixtures/sub/nested.genshi',
+            self._getTemplatePath('sub/nested.genshi')))
+
+    def test_resource_spec_trailing_slash(self):
+        result = self._callFUT('pyramid_chameleon_genshi.tests:fixtures/sub/')
+        self.assertEqual(result, [
+            ('pyramid_chameleon_genshi.tests:fixtures/sub/nested.genshi',
+             self._getTemplatePath('sub/nested.genshi'))])
+
+    def test_abspath_directory(self):
+        path = self._getTemplatePath('sub')
+        result = self._callFUT(path)
+        nested = self._getTemplatePath('sub/nested.genshi')
+        self.assertEqual(result, [(nested, nested)])
+
+    def test_file(self):
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        result = self._callFUT(spec)
+        self.assertEqual(result,
+                         [(spec, self._getTemplatePath('minimal.genshi'))])
+
+class Test_precompile(Base, unittest.TestCase):
+    def _callFUT(self, specs):
+        from pyramid_chameleon_genshi import precompile
+        return precompile(self.config.registry, specs)
+
+    def _queryRenderer(self, name):
+        from pyramid.interfaces import ITemplateRenderer
+        return self.config.registry.queryUtility(ITemplateRenderer, name=name)
+
+    def test_it(self):
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        result = self._callFUT([spec])
+        self.assertEqual(len(result), 1)
+        renderer = result[0]
+        self.failUnless(filled(renderer, 'template'))
+        template = renderer.template
+        self.failUnless((None, True, template.signature) in template.registry)
+        self.failUnless(self._queryRenderer(spec) is renderer)
+        path = self._getTemplatePath('minimal.genshi')
+        self.failUnless(self._queryRenderer(path) is renderer)
+
+    def test_package_spec(self):
+        result = self._callFUT(['pyramid_chameleon_genshi.tests:'])
+        self.failUnless(result)
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        renderer = self._queryRenderer(spec)
+        self.failUnless(renderer is not None)
+        self.failUnless(renderer in result)
+
+    def test_reuses_registered_renderer(self):
+        path = self._getTemplatePath('minimal.genshi')
+        first = self._callFUT([path])[0]
+        second = self._callFUT([path])[0]
+        self.failUnless(first is second)
+
+    def test_reload_assets(self):
+        self.config.registry.settings = {'reload_assets':'true'}
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        self._callFUT([spec])
+        self.assertEqual(self._queryRenderer(spec), None)
+
+    def test_renderer_lookup_uses_precompiled(self):
+        self._registerRenderer()
+        from pyramid.renderers import RendererHelper
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        renderer = self._callFUT([spec])[0]
+        helper = RendererHelper(name=spec, registry=self.config.registry)
+        self.failUnless(helper.get_renderer() is renderer)
+        self.assertEqual(helper.render({}, None),
+                     '<div xmlns="http://www.w3.org/1999/xhtml">\n</div>')
+
+class Test_preload(Base, unittest.TestCase):
+    def _callFUT(self, config, specs=None):
+        from pyramid_chameleon_genshi import preload
+        return preload(config, specs)
+
+    def _assertPreloaded(self, renderer):
+        template = renderer.template
+        self.failUnless((None, True, template.signature) in template.registry)
+        self.failUnless(('', False, template.signature) in template.registry)
+
+    def test_it(self):
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/sub'
+        result = self._callFUT(self.config, [spec])
+        self.assertEqual(len(result), 1)
+        self._assertPreloaded(result[0])
+
+    def test_default_specs(self):
+        spec = 'pyramid_chameleon_genshi.tests:fixtures/minimal.genshi'
+        self.config.registry.settings = {
+            'chameleon_genshi.precompile_paths':spec}
+        result = self._callFUT(self.config)
+        self.assertEqual(len(result), 1)
+        self._assertPreloaded(result[0])
+
+    def test_no_specs(self):
+        self.assertEqual(self._callFUT(self.config), [])
+
+class Test_warm_up(Base, unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        Base.setUp(self)
+        self.original = PyramidGenshiTemplateFile.global_registry
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+        shutil.rmtree(self.directory)
+        Base.tearDown(self)
+
+    def _callFUT(self, specs, **kw):
+        from pyramid_chameleon_genshi import warm_up
+        return warm_up(self.config.registry, specs, **kw)
+
+    def _makeBroken(self):
+        import os
+        filename = os.path.join(self.directory, 'broken.genshi')
+        f = open(filename, 'w')
+        f.write('<div xmlns="http://www.w3.org/1999/xhtml"><p></div>')
+        f.close()
+        return filename
+
+    def _assertCompiled(self, report):
+        self.assertEqual(len(report.renderers), 3)
+        for renderer in report.renderers:
+            template = renderer.template
+            self.failUnless(
+                (None, True, template.signature) in template.registry)
+        self.assertEqual([result[0] for result in report.results],
+                         [renderer.path for renderer in report.renderers])
+        self.assertEqual(report.errors, [])
+
+    def test_threads(self):
+        report = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures'],
+                               threads=2)
+        self._assertCompiled(report)
+
+    def test_processes(self):
+        report = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures'],
+                               processes=2)
+        self._assertCompiled(report)
+
+    def test_out(self):
+        from StringIO import StringIO
+        out = StringIO()
+        self._callFUT(['pyramid_chameleon_genshi.tests:fixtures/sub'],
+                      out=out)
+        lines = out.getvalue().splitlines()
+        self.failUnless(lines[0].startswith('1 templates compiled in'))
+        self.failUnless(lines[1].endswith('nested.genshi'))
+
+    def test_errors(self):
+        broken = self._makeBroken()
+        minimal = self._getTemplatePath('minimal.genshi')
+        report = self._callFUT([broken, minimal], processes=2)
+        self.assertEqual([path for path, error in report.errors], [broken])
+        report = self._callFUT([broken, minimal], threads=2)
+        self.assertEqual([path for path, error in report.errors], [broken])
+
+    def test_strict(self):
+        broken = self._makeBroken()
+        self.assertRaises(RuntimeError, self._callFUT, [broken], strict=True)
+
+    def test_import_lock_held(self):
+        import imp
+        import multiprocessing
+        import threading
+        def fail(*arg, **kw):
+            raise AssertionError('would wait for the import lock')
+        originals = threading.Thread.start, multiprocessing.Pool
+        threading.Thread.start, multiprocessing.Pool = fail, fail
+        imp.acquire_lock()
+        try:
+            report = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures'],
+                                   threads=2)
+            self._assertCompiled(report)
+            report = self._callFUT(['pyramid_chameleon_genshi.tests:fixtures'],
+                                   processes=2)
+            self._assertCompiled(report)
+        finally:
+            imp.release_lock()
+            threading.Thread.start, multiprocessing.Pool = originals
+
+class Test_generate_source(unittest.TestCase):
+    def _callFUT(self, path, debug):
+        from pyramid_chameleon_genshi import generate_source
+        return generate_source((path, debug))
+
+    def test_debug(self):
+        import os
+        here = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(here, 'fixtures', 'minimal.genshi')
+        signature, debug, source, seconds, error = self._callFUT(path, 1)
+        self.assertEqual(debug, True)
+        self.assertEqual(error, None)
+        self.failUnless('def bind' in source)
+        self.assertNotEqual(self._callFUT(path, False)[2], source)
+
+class Test_warm_up_renderer(Base, unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.cache import TemplateLRUCache
+        Base.setUp(self)
+        self.original = PyramidGenshiTemplateFile.global_registry
+        PyramidGenshiTemplateFile.global_registry = TemplateLRUCache()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+        shutil.rmtree(self.directory)
+        Base.tearDown(self)
+
+    def _callFUT(self, renderer, generated):
+        from pyramid_chameleon_genshi import warm_up_renderer
+        return warm_up_renderer(renderer, generated)
+
+    def _makeRenderer(self):
+        # a new file, whose code Chameleon cannot have cached
+        import os
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        path = os.path.join(self.directory, 'page.genshi')
+        f = open(path, 'w')
+        f.write('<div xmlns="http://www.w3.org/1999/xhtml">%s</div>' % id(self))
+        f.close()
+        lookup = DummyLookup() # debug
+        return GenshiTemplateRenderer(path, lookup)
+
+    def _generated(self, renderer, debug):
+        signature = renderer.make_template().signature
+        source = 'def bind():\n    return "generated"\n'
+        return signature, debug, source, 0.5, None
+
+    def test_uses_generated_source(self):
+        renderer = self._makeRenderer()
+        path, seconds, error = self._callFUT(
+            renderer, self._generated(renderer, True))
+        self.assertEqual(error, None)
+        self.failUnless(seconds >= 0.5)
+        template = renderer.template
+        self.assertEqual(template.registry[(None, True, template.signature)],
+                         'generated')
+
+    def test_ignores_source_generated_without_debug(self):
+        renderer = self._makeRenderer()
+        self._callFUT(renderer, self._generated(renderer, False))
+        template = renderer.template
+        self.assertNotEqual(
+            template.registry[(None, True, template.signature)], 'generated')
+
+    def test_error(self):
+        renderer = self._makeRenderer()
+        result = self._callFUT(renderer, (None, True, None, 0.5, 'Error: x'))
+        self.assertEqual(result[2], 'Error: x')
+        self.failIf(filled(renderer, 'template'))
+
+class TestWarmUpReport(unittest.TestCase):
+    def _makeOne(self, results):
+        from pyramid_chameleon_genshi import WarmUpReport
+        return WarmUpReport([], results, 1.5)
+
+    def test_slowest(self):
+        report = self._makeOne([('a', 1, None), ('b', 3, None),
+                                ('c', 2, 'error')])
+        self.assertEqual(report.slowest(2), [('b', 3, None),
+                                             ('c', 2, 'error')])
+
+    def test_format(self):
+        report = self._makeOne([('a', 1, None), ('c', 2, 'error')])
+        self.assertEqual(report.format(1),
+                         '2 templates compiled in 1.500s, 1 errors\n'
+                         '   2.000s  c\n'
+                         '   ERROR  c: error\n')
+
+
+class AsyncRenderTests(Base, unittest.TestCase):
+    def setUp(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        from pyramid_chameleon_genshi import configure_render_executor
+        Base.setUp(self)
+        self.original = GenshiTemplateRenderer.executor
+        self.executor = configure_render_executor(2)
+
+    def tearDown(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        self.executor.shutdown()
+        GenshiTemplateRenderer.executor = self.original
+        Base.tearDown(self)
+
+    def test_async_render_template(self):
+        from pyramid_chameleon_genshi import async_render_template
+        self._registerRenderer()
+        future = async_render_template('fixtures/sub/nested.genshi',
+                                       name='abc')
+        self.assertEqual(future.result(5),
+                         '<div xmlns="http://www.w3.org/1999/xhtml">\n'
+                         '  <span>abc</span>\n</div>')
+
+    def test_async_render_template_error(self):
+        from pyramid_chameleon_genshi import async_render_template
+        self._registerRenderer()
+        future = async_render_template('fixtures/sub/nested.genshi')
+        self.assertRaises(NameError, future.result, 5)
+
+    def test_async_stream_template(self):
+        from pyramid_chameleon_genshi import async_stream_template
+        self._registerRenderer()
+        future = async_stream_template('fixtures/sub/nested.genshi',
+                                       chunk_size=1, name='abc')
+        chunks = list(future.result(5))
+        self.failUnless(len(chunks) > 1)
+        self.failUnless('<span>abc</span>' in ''.join(chunks))
+
+    def _translating(self):
+        import shutil
+        import tempfile
+        from pyramid.testing import DummyRequest
+        from pyramid.threadlocal import manager
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.config.add_translation_dirs(directory)
+        request = DummyRequest()
+        manager.get()['request'] = request
+        return request
+
+    def test_async_render_template_translates(self):
+        from translationstring import TranslationString
+        from pyramid_chameleon_genshi import async_render_template
+        self._registerRenderer()
+        request = self._translating()
+        future = async_render_template('fixtures/sub/nested.genshi',
+                                       name=TranslationString(u'Hi'),
+                                       request=request)
+        self.failUnless('<span>Hi</span>' in future.result(5))
+        self.assertEqual(request.locale_name, 'en')
+
+    def test_async_stream_template_translates(self):
+        from translationstring import TranslationString
+        from pyramid_chameleon_genshi import async_stream_template
+        self._registerRenderer()
+        request = self._translating()
+        future = async_stream_template('fixtures/sub/nested.genshi',
+                                       name=TranslationString(u'Hi'),
+                                       request=request)
+        self.failUnless('<span>Hi</span>' in ''.join(future.result(5)))
+
+    def test_renderer_submit_threadlocals(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        from pyramid.threadlocal import get_current_registry
+        from pyramid.threadlocal import get_current_request
+        seen = []
+        class Renderer(GenshiTemplateRenderer):
+            def __call__(self, value, system):
+                seen.append((get_current_registry(), get_current_request()))
+                return u''
+        nested = self._getTemplatePath('sub/nested.genshi')
+        renderer = Renderer(nested, DummyLookup())
+        request = object()
+        renderer.submit({}, {'request':request}).result(5)
+        self.assertEqual(seen, [(self.config.registry, request)])
+
+    def test_renderer_submit(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        nested = self._getTemplatePath('sub/nested.genshi')
+        renderer = GenshiTemplateRenderer(nested, DummyLookup())
+        future = renderer.submit({'name':'abc'}, {})
+        self.failUnless('<span>abc</span>' in future.result(5))
+
+    def test_get_render_executor(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        from pyramid_chameleon_genshi import get_render_executor
+        from pyramid_chameleon_genshi.executor import RenderExecutor
+        self.failUnless(get_render_executor() is self.executor)
+        GenshiTemplateRenderer.executor = None
+        executor = get_render_executor()
+        try:
+            self.failUnless(isinstance(executor, RenderExecutor))
+            self.failUnless(get_render_executor() is executor)
+        finally:
+            executor.shutdown()
+
+    def test_configure_render_executor_shuts_down_previous(self):
+        from pyramid_chameleon_genshi import configure_render_executor
+        previous = self.executor
+        self.executor = configure_render_executor(1)
+        self.assertEqual(self.executor.max_workers, 1)
+        self.failUnless(previous.shut_down)
+
+class Test_call_with_threadlocals(unittest.TestCase):
+    def _callFUT(self, threadlocals, func, *arg, **kw):
+        from pyramid_chameleon_genshi import call_with_threadlocals
+        return call_with_threadlocals(threadlocals, func, *arg, **kw)
+
+    def test_it(self):
+        from pyramid.threadlocal import get_current_request
+        from pyramid.threadlocal import manager
+        before = list(manager.stack)
+        def func(a, b=None):
+            return get_current_request(), a, b
+        self.assertEqual(self._callFUT({'registry':None, 'request':'r'},
+                                       func, 1, b=2), ('r', 1, 2))
+        self.assertEqual(manager.stack, before)
+
+    def test_exception(self):
+        from pyramid.threadlocal import manager
+        before = list(manager.stack)
+        def func():
+            raise ValueError
+        self.assertRaises(ValueError, self._callFUT,
+                          {'registry':None, 'request':None}, func)
+        self.assertEqual(manager.stack, before)
 
 class TestXIncludes(unittest.TestCase):
+    def setUp(self):
+        self._getTargetClass().clear()
+
+    def tearDown(self):
+        self._getTargetClass().clear()
+        self._getTargetClass().dependencies.clear()
+
     def _getTargetClass(self):
         from pyramid_chameleon_genshi import XIncludes
         return XIncludes
@@ -278,6 +1927,24 @@ class TestXIncludes(unittest.TestCase):
         cls = self._getTargetClass()
         return cls(registry, relpath, factory)
 
+    def test_slots(self):
+        xi = self._makeOne(relpath='/foo')
+        self.failIf(hasattr(xi, '__dict__'))
+        self.assertRaises(AttributeError, setattr, xi, 'nonesuch', 1)
+
+    def test_including(self):
+        xi = self._makeOne(relpath='/foo', factory=lambda *arg, **kw: arg)
+        xi.filename = '/foo/page'
+        other = xi.including('/foo/sub/fragment')
+        self.assertEqual(other.filename, '/foo/sub/fragment')
+        self.assertEqual(xi.filename, '/foo/page')
+        self.assertEqual(other.relpath, '/foo')
+        other.get('bar', 'xml')
+        dependencies = self._getTargetClass().dependencies
+        self.assertEqual(dependencies.includes('/foo/sub/fragment'),
+                         set(['/foo/bar']))
+        self.assertEqual(dependencies.includes('/foo/page'), set())
+
     def test_get_isabs(self):
         expected_filename = '/foo/bar'
         expected_format = 'format'
@@ -325,6 +1992,102 @@ class TestXIncludes(unittest.TestCase):
         result = xi.get(expected_filename, expected_format)
         self.assertEqual(result, expected_result)
 
+    def test_get_memoizes_resolution(self):
+        import os
+        here = os.path.dirname(__file__)
+        expected_filename = os.path.join(here, 'abc')
+        filenames = []
+        def factory(filename, format):
+            filenames.append(filename)
+            return filename
+        xi = self._makeOne(relpath='/foo', factory=factory)
+        xi.get('pyramid_chameleon_genshi.tests:abc', 'xml')
+        xi.get('bar/../baz', 'xml')
+        self.assertEqual(xi.resolved, {
+            ('/foo', 'pyramid_chameleon_genshi.tests:abc'):expected_filename,
+            ('/foo', 'bar/../baz'):'/foo/baz',
+            })
+        class Memoized(self._getTargetClass()):
+            __slots__ = ()
+            def resolve(self, filename): # pragma: no cover
+                raise AssertionError('resolved again')
+        xi = Memoized({}, '/foo', factory)
+        other = Memoized({}, '/foo', factory)
+        xi.get('pyramid_chameleon_genshi.tests:abc', 'xml')
+        other.get('bar/../baz', 'xml')
+        self.assertEqual(filenames, [expected_filename, '/foo/baz'] * 2)
+
+    def test_get_memoizes_per_relpath(self):
+        def factory(filename, format):
+            return filename
+        self.assertEqual(self._makeOne(relpath='/foo', factory=factory).get(
+            'bar', 'xml'), '/foo/bar')
+        self.assertEqual(self._makeOne(relpath='/baz', factory=factory).get(
+            'bar', 'xml'), '/baz/bar')
+
+    def test_get_auto_reload_resource_spec_not_memoized(self):
+        class Template(object):
+            auto_reload = True
+            def clone(self, filename, format):
+                return filename
+        xi = self._makeOne(relpath='/foo', factory=Template().clone)
+        self.assertEqual(xi.auto_reload, True)
+        xi.get('pyramid_chameleon_genshi.tests:abc', 'xml')
+        xi.get('bar', 'xml')
+        self.assertEqual(xi.resolved.keys(), [('/foo', 'bar')])
+
+    def test_get_with_metrics(self):
+        metrics = DummyMetrics()
+        class Template(object):
+            filename = '/foo/index.genshi'
+            def __init__(self):
+                self.metrics = metrics
+            def clone(self, filename, format):
+                return filename
+        xi = self._makeOne(relpath='/foo', factory=Template().clone)
+        xi.get('bar', 'xml')
+        self.assertEqual(metrics.events,
+                         [('included', '/foo/index.genshi', '/foo/bar')])
+
+    def test_get_records_dependency(self):
+        from pyramid_chameleon_genshi import get_dependencies
+        class Template(object):
+            filename = '/foo/index.genshi'
+            def clone(self, filename, format):
+                return filename
+        xi = self._makeOne(relpath='/foo', factory=Template().clone)
+        xi.get('bar', 'xml')
+        xi.get('bar', 'xml')
+        dependencies = get_dependencies()
+        self.failUnless(dependencies is xi.dependencies)
+        self.assertEqual(dependencies.includes('/foo/index.genshi'),
+                         set(['/foo/bar']))
+        self.assertEqual(dependencies.included_by('/foo/bar'),
+                         set(['/foo/index.genshi']))
+
+    def test_get_with_output_cache(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        output_cache = TemplateOutputCache()
+        output_cache.add('/foo/bar')
+        class Template(object):
+            def __init__(self):
+                self.output_cache = output_cache
+            def clone(self, filename, format):
+                return filename
+        xi = self._makeOne(relpath='/foo', factory=Template().clone)
+        fragment = xi.get('bar', 'xml')
+        self.assertEqual(fragment.template, '/foo/bar')
+        self.failUnless(fragment.output_cache is output_cache)
+        self.assertEqual(xi.get('baz', 'xml'), '/foo/baz')
+
+    def test_clear(self):
+        def factory(filename, format):
+            return filename
+        xi = self._makeOne(relpath='/foo', factory=factory)
+        xi.get('bar', 'xml')
+        self._getTargetClass().clear()
+        self.assertEqual(xi.resolved, {})
+
     def test_activate(self):
         from chameleon.core.template import TemplateFile
         original_xinclude_cls = TemplateFile.xincludes_class
@@ -335,6 +2098,482 @@ class TestXIncludes(unittest.TestCase):
         finally:
             TemplateFile.xinclude_class = original_xinclude_cls
 
+class Test_invalidate_template(Base, unittest.TestCase):
+    def tearDown(self):
+        from pyramid_chameleon_genshi import XIncludes
+        XIncludes.dependencies.clear()
+        Base.tearDown(self)
+
+    def _callFUT(self, path, registry=None):
+        from pyramid_chameleon_genshi import invalidate_template
+        return invalidate_template(path, registry)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import XIncludes
+        dependencies = XIncludes.dependencies
+        dependencies.add('/page', '/layout')
+        dependencies.add('/layout', '/footer')
+        dependencies.add('/footer', '/links')
+        dependencies.add('/other', '/links')
+        mtimes = PyramidGenshiTemplateFile.mtimes
+        mtimes.data['/footer'] = (0, 0)
+        result = self._callFUT('/x/../footer')
+        self.assertEqual(result, set(['/footer', '/layout', '/page']))
+        self.failIf('/footer' in mtimes.data)
+        self.assertEqual(dependencies.includes('/footer'), set())
+        self.assertEqual(dependencies.included_by('/links'),
+                         set(['/other']))
+        self.assertEqual(dependencies.includes('/layout'),
+                         set(['/footer']))
+
+    def test_output_cache(self):
+        from pyramid_chameleon_genshi import XIncludes
+        from pyramid_chameleon_genshi import get_output_cache
+        XIncludes.dependencies.add('/page', '/footer')
+        output_cache = get_output_cache(self.config.registry)
+        output_cache.add('/page')
+        output_cache.add('/other')
+        self._callFUT('/footer', self.config.registry)
+        self.assertEqual(output_cache.policies['/page'].generation, 1)
+        self.assertEqual(output_cache.policies['/other'].generation, 0)
+
+    def test_no_output_cache(self):
+        self.assertEqual(self._callFUT('/footer', self.config.registry),
+                         set(['/footer']))
+
+    def _makeTemplates(self):
+        # a.genshi includes sub/b.genshi, which includes c.genshi (resolved
+        # relative to a.genshi, like every include of a fragment)
+        import os
+        import tempfile
+        directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(directory, 'sub'))
+        xi = ('<div xmlns="http://www.w3.org/1999/xhtml" '
+              'xmlns:xi="http://www.w3.org/2001/XInclude">%s</div>')
+        for name, body in (('a.genshi', '<xi:include href="sub/b.genshi"/>'),
+                           ('sub/b.genshi', '<xi:include href="c.genshi"/>'),
+                           ('c.genshi', 'one')):
+            self._write(os.path.join(directory, name), xi % body)
+        return directory
+
+    def _write(self, path, body, delay=0):
+        import os
+        f = open(path, 'w')
+        f.write(body)
+        f.close()
+        if delay:
+            mtime = os.path.getmtime(path) + delay
+            os.utime(path, (mtime, mtime))
+
+    def _withTemplates(self, test):
+        import os
+        import shutil
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi.cache import TemplateLRUCache
+        original = PyramidGenshiTemplateFile.global_registry
+        PyramidGenshiTemplateFile.global_registry = TemplateLRUCache()
+        directory = self._makeTemplates()
+        try:
+            test(*[os.path.join(directory, name)
+                   for name in ('a.genshi', 'sub/b.genshi', 'c.genshi')])
+        finally:
+            PyramidGenshiTemplateFile.global_registry = original
+            shutil.rmtree(directory)
+
+    def test_nested_include_with_cached_output(self):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        from pyramid_chameleon_genshi import get_output_cache
+        registry = self.config.registry
+        def test(a, b, c):
+            get_output_cache(registry).add(b)
+            lookup = DummyLookup()
+            lookup.registry = registry
+            lookup.translate = None
+            renderer = GenshiTemplateRenderer(a, lookup)
+            self.failUnless('one' in renderer({}, {}))
+            self._write(c, 'two', delay=10)
+            self.assertEqual(self._callFUT(c, registry), set([a, b, c]))
+            result = renderer({}, {})
+            self.failUnless('two' in result, result)
+        self._withTemplates(test)
+
+    def test_same_graph_when_inlined(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import XIncludes
+        dependencies = XIncludes.dependencies
+        def test(a, b, c):
+            for inline in (False, True):
+                dependencies.clear()
+                template = PyramidGenshiTemplateFile(
+                    a, inline_xincludes=inline, debug=False)
+                self.failUnless('one' in template())
+                self.assertEqual(dependencies.includes(a), set([b]))
+                self.assertEqual(dependencies.includes(b), set([c]))
+                self.assertEqual(dependencies.dependents(c), set([a, b]))
+        self._withTemplates(test)
+
+class TestOutputCachePolicy(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from pyramid_chameleon_genshi import OutputCachePolicy
+        return OutputCachePolicy(*arg, **kw)
+
+    def test_key_constant(self):
+        policy = self._makeOne()
+        self.assertEqual(policy.key('/a', {'name':1}),
+                         policy.key('/a', {'name':2}))
+        self.assertNotEqual(policy.key('/a', {}), policy.key('/b', {}))
+
+    def test_key_vary(self):
+        policy = self._makeOne(vary=['name'])
+        self.assertEqual(policy.key('/a', {'name':1, 'other':1}),
+                         policy.key('/a', {'name':1, 'other':2}))
+        self.assertNotEqual(policy.key('/a', {'name':1}),
+                            policy.key('/a', {'name':2}))
+
+    def test_key_cache_key(self):
+        def cache_key(values):
+            return values.get('user')
+        policy = self._makeOne(cache_key=cache_key)
+        self.assertEqual(policy.key('/a', {}), None)
+        self.assertNotEqual(policy.key('/a', {'user':'bob'}),
+                            policy.key('/a', {'user':'fred'}))
+
+class TestTemplateOutputCache(Base, unittest.TestCase):
+    def _makeOne(self, *arg):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        return TemplateOutputCache(*arg)
+
+    def test_class_implements_ITemplateOutputCache(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        from pyramid_chameleon_genshi.interfaces import ITemplateOutputCache
+        verifyClass(ITemplateOutputCache, TemplateOutputCache)
+
+    def test_default_backend(self):
+        from pyramid_chameleon_genshi.cache import OutputCache
+        self.failUnless(isinstance(self._makeOne().backend, OutputCache))
+
+    def test_render(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/foo/../a', ttl=60)
+        calls = []
+        def render(values):
+            calls.append(values)
+            return u'result'
+        self.assertEqual(output_cache.render('/a', render, {}), u'result')
+        self.assertEqual(output_cache.render('/a', render, {}), u'result')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(backend.data.values(), [(u'result', 60)])
+
+    def test_invalidate(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a')
+        calls = []
+        def render(values):
+            calls.append(values)
+            return u'result'
+        output_cache.render('/a', render, {})
+        output_cache.invalidate(['/foo/../a', '/b'])
+        output_cache.render('/a', render, {})
+        output_cache.render('/a', render, {})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(backend.data), 2)
+
+    def test_render_without_policy(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        render = lambda values: u'result'
+        self.assertEqual(output_cache.render('/a', render, {}), u'result')
+        self.assertEqual(backend.data, {})
+
+    def test_render_uncacheable(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a', cache_key=lambda values: None)
+        render = lambda values: u'result'
+        self.assertEqual(output_cache.render('/a', render, {}), u'result')
+        self.assertEqual(backend.data, {})
+
+    def test_render_stores_gzip_copy(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a', ttl=60, gzip_level=1)
+        render = lambda values: u'r\xe9sult'
+        self.assertEqual(output_cache.render('/a', render, {}), u'r\xe9sult')
+        self.assertEqual(len(backend.data), 2)
+        key = [key for key in backend.data if key.endswith(':gzip')][0]
+        compressed, ttl = backend.data[key]
+        self.assertEqual(ttl, 60)
+        self.assertEqual(gunzip(compressed[40:]), 'r\xc3\xa9sult')
+
+    def test_render_gzip(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a', gzip_level=6)
+        calls = []
+        def render(values):
+            calls.append(values)
+            return u'result'
+        text, body, etag = output_cache.render_gzip('/a', render, {})
+        self.assertEqual(text, None)
+        self.assertEqual(gunzip(body), 'result')
+        from pyramid_chameleon_genshi import sha
+        self.assertEqual(etag, sha('result').hexdigest())
+        self.assertEqual(output_cache.render_gzip('/a', render, {}),
+                         (None, body, etag))
+        self.assertEqual(output_cache.render('/a', render, {}), u'result')
+        self.assertEqual(len(calls), 1)
+
+    def test_render_gzip_copy_evicted(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a', gzip_level=6)
+        calls = []
+        def render(values):
+            calls.append(values)
+            return u'result'
+        output_cache.render('/a', render, {})
+        for key in backend.data.keys():
+            if key.endswith(':gzip'):
+                del backend.data[key]
+        text, body, etag = output_cache.render_gzip('/a', render, {})
+        self.assertEqual(gunzip(body), 'result')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(backend.data), 2)
+
+    def test_render_gzip_without_gzip_level(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a')
+        render = lambda values: u'result'
+        self.assertEqual(output_cache.render_gzip('/a', render, {}),
+                         (u'result', None, None))
+        self.assertEqual(len(backend.data), 1)
+
+    def test_compresses(self):
+        output_cache = self._makeOne()
+        output_cache.add('/a', gzip_level=6)
+        output_cache.add('/b')
+        self.failUnless(output_cache.compresses('/a'))
+        self.failIf(output_cache.compresses('/b'))
+        self.failIf(output_cache.compresses('/c'))
+
+    def test_render_gzip_uncacheable(self):
+        backend = DummyOutputCache()
+        output_cache = self._makeOne(backend)
+        output_cache.add('/a', cache_key=lambda values: None, gzip_level=6)
+        render = lambda values: u'result'
+        self.assertEqual(output_cache.render_gzip('/a', render, {}),
+                         (u'result', None, None))
+        self.assertEqual(backend.data, {})
+
+    def test_fragment(self):
+        output_cache = self._makeOne()
+        output_cache.add('/a')
+        template = object()
+        self.failUnless(output_cache.fragment('/b', template) is template)
+        self.failUnless(output_cache.fragment('/a', template).template
+                        is template)
+
+    def test_fragment_rendering(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        output_cache = self._makeOne()
+        nested = self._getTemplatePath('sub/nested.genshi')
+        output_cache.add(nested, vary=('name',))
+        template = PyramidGenshiTemplateFile(
+            self._getTemplatePath('including.genshi'),
+            output_cache=output_cache)
+        expected = template(name='abc')
+        self.failUnless('<span>abc</span>' in expected)
+        self.assertEqual(output_cache.backend.stats()['entries'], 1)
+        rendered = []
+        fragment = PyramidGenshiTemplateFile.global_registry[nested]
+        original = fragment.render_xinclude
+        def render_xinclude(**kw):
+            rendered.append(kw)
+            return original(**kw)
+        fragment.render_xinclude = render_xinclude
+        try:
+            self.assertEqual(template(name='abc'), expected)
+            self.assertEqual(rendered, [])
+            self.failUnless('<span>def</span>' in template(name='def'))
+            self.assertEqual(len(rendered), 1)
+        finally:
+            del fragment.render_xinclude
+
+class Test_compress_output(unittest.TestCase):
+    def _callFUT(self, text, *arg):
+        from pyramid_chameleon_genshi import compress_output
+        return compress_output(text, *arg)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi import sha
+        result = self._callFUT(u'caf\xe9' * 100)
+        self.failUnless(isinstance(result, str))
+        self.assertEqual(result[:40], sha('caf\xc3\xa9' * 100).hexdigest())
+        self.assertEqual(gunzip(result[40:]), 'caf\xc3\xa9' * 100)
+        self.failUnless(len(result) < 100)
+
+    def test_reproducible(self):
+        import time
+        first = self._callFUT('abc', 9)
+        time.sleep(1.1) # the gzip header could hold a timestamp
+        self.assertEqual(self._callFUT('abc', 9), first)
+
+class Test_accepts_gzip(unittest.TestCase):
+    def _callFUT(self, request):
+        from pyramid_chameleon_genshi import accepts_gzip
+        return accepts_gzip(request)
+
+    def test_it(self):
+        from webob import Request
+        self.failIf(self._callFUT(None))
+        self.failIf(self._callFUT(DummyRequest()))
+        self.failIf(self._callFUT(Request.blank('/')))
+        for header, expected in (('gzip', True), ('deflate, gzip', True),
+                                 ('*', True), ('gzip;q=0', False),
+                                 ('deflate', False)):
+            request = Request.blank('/', headers={'Accept-Encoding':header})
+            self.assertEqual(self._callFUT(request), expected)
+
+class Test_get_output_cache(unittest.TestCase):
+    def _callFUT(self, registry):
+        from pyramid_chameleon_genshi import get_output_cache
+        return get_output_cache(registry)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi import TemplateOutputCache
+        registry = DummyRegistry()
+        output_cache = self._callFUT(registry)
+        self.failUnless(isinstance(output_cache, TemplateOutputCache))
+        self.failUnless(self._callFUT(registry) is output_cache)
+
+class Test_add_genshi_output_cache(unittest.TestCase):
+    def _callFUT(self, config, spec, **kw):
+        from pyramid_chameleon_genshi import add_genshi_output_cache
+        return add_genshi_output_cache(config, spec, **kw)
+
+    def test_abspath(self):
+        from pyramid_chameleon_genshi import get_output_cache
+        config = DummyConfigurator()
+        self._callFUT(config, '/foo/bar.genshi', vary=['a'], ttl=5)
+        policy = get_output_cache(config.registry).policies['/foo/bar.genshi']
+        self.assertEqual(policy.vary, ('a',))
+        self.assertEqual(policy.ttl, 5)
+        self.assertEqual(policy.gzip_level, None)
+
+    def test_gzip_level(self):
+        from pyramid_chameleon_genshi import get_output_cache
+        config = DummyConfigurator()
+        self._callFUT(config, '/foo/bar.genshi', gzip_level=9)
+        policy = get_output_cache(config.registry).policies['/foo/bar.genshi']
+        self.assertEqual(policy.gzip_level, 9)
+
+    def test_relative_spec(self):
+        import os
+        import pyramid_chameleon_genshi.tests
+        from pyramid_chameleon_genshi import get_output_cache
+        config = DummyConfigurator()
+        config.package = pyramid_chameleon_genshi.tests
+        self._callFUT(config, 'fixtures/minimal.genshi')
+        here = os.path.dirname(pyramid_chameleon_genshi.tests.__file__)
+        self.assertEqual(get_output_cache(config.registry).policies.keys(),
+                         [os.path.join(here, 'fixtures', 'minimal.genshi')])
+
+def gunzip(body):
+    import gzip
+    from StringIO import StringIO
+    return gzip.GzipFile(fileobj=StringIO(body)).read()
+
+def filled(obj, name):
+    """ Return whether the slot ``name`` of ``obj`` holds a value, without
+    having it computed."""
+    try:
+        object.__getattribute__(obj, name)
+    except AttributeError:
+        return False
+    return True
+
+class DummyConfigurator(object):
+    def __init__(self, settings=None):
+        self.renderers = {}
+        self.actions = []
+        self.action_kws = []
+        self.routes = []
+        self.views = []
+        self.directives = {}
+        self.subscribers = []
+        self.registry = DummyRegistry(settings)
+        self.package = None
+
+    def add_renderer(self, name, impl):
+        self.renderers[name] = impl
+
+    def add_directive(self, name, directive):
+        self.directives[name] = directive
+
+    def add_route(self, name, pattern):
+        self.routes.append((name, pattern))
+
+    def add_subscriber(self, subscriber, iface):
+        self.subscribers.append((subscriber, iface))
+
+    def add_view(self, view, **kw):
+        self.views.append((view, kw))
+
+    def action(self, discriminator, callable=None, args=(), kw=None, order=0):
+        self.actions.append((discriminator, callable, args))
+        self.action_kws.append(kw)
+
+class DummyRegistry(object):
+    def __init__(self, settings=None):
+        self.settings = settings
+        self.utilities = {}
+
+    def registerUtility(self, utility, iface, name=''):
+        self.utilities[(iface, name)] = utility
+
+    def queryUtility(self, iface, name='', default=None):
+        return self.utilities.get((iface, name), default)
+
+class DummyCompiledTemplateCache(object):
+    def get_registry(self, template):
+        from chameleon.core.filecache import TemplateRegistry
+        registry = TemplateRegistry()
+        registry.template = template
+        return registry
+
+class DummyRequest(object):
+    context = None
+    def __init__(self):
+        self.context = object()
+
+class DummyOutputCache(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, (None,))[0]
+
+    def set(self, key, value, time=0):
+        self.data[key] = (value, time)
+
+class DummyMetrics(object):
+    def __init__(self):
+        self.events = []
+
+    def compiled(self, path, seconds):
+        self.events.append(('compiled', path, seconds))
+
+    def rendered(self, path, seconds, size):
+        self.events.append(('rendered', path, seconds, size))
+
+    def included(self, path, filename):
+        self.events.append(('included', path, filename))
+
 class DummyLookup(object):
     auto_reload=True
     debug = True
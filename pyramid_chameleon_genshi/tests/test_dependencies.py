@@ -0,0 +1,62 @@
+import unittest
+
+class TestDependencyGraph(unittest.TestCase):
+    def _makeOne(self, *edges):
+        from pyramid_chameleon_genshi.dependencies import DependencyGraph
+        graph = DependencyGraph()
+        for parent, child in edges:
+            graph.add(parent, child)
+        return graph
+
+    def test_add(self):
+        graph = self._makeOne(('a', 'b'), ('a', 'c'), ('a', 'b'))
+        self.assertEqual(graph.includes('a'), set(['b', 'c']))
+        self.assertEqual(graph.included_by('b'), set(['a']))
+        self.assertEqual(graph.includes('b'), set())
+        self.assertEqual(graph.included_by('a'), set())
+
+    def test_results_are_copies(self):
+        graph = self._makeOne(('a', 'b'))
+        graph.includes('a').add('x')
+        graph.included_by('b').add('x')
+        self.assertEqual(graph.includes('a'), set(['b']))
+        self.assertEqual(graph.included_by('b'), set(['a']))
+
+    def test_remove(self):
+        graph = self._makeOne(('a', 'b'), ('c', 'b'), ('a', 'd'))
+        graph.remove('a')
+        graph.remove('nonesuch')
+        self.assertEqual(graph.includes('a'), set())
+        self.assertEqual(graph.included_by('b'), set(['c']))
+        self.assertEqual(graph.parents.keys(), ['b'])
+
+    def test_clear(self):
+        graph = self._makeOne(('a', 'b'))
+        graph.clear()
+        self.assertEqual(graph.includes('a'), set())
+        self.assertEqual(graph.order(), [])
+
+    def test_dependents(self):
+        graph = self._makeOne(('page', 'layout'), ('layout', 'footer'),
+                              ('other', 'footer'), ('page', 'nav'))
+        self.assertEqual(graph.dependents('footer'),
+                         set(['layout', 'other', 'page']))
+        self.assertEqual(graph.dependents('nav'), set(['page']))
+        self.assertEqual(graph.dependents('page'), set())
+
+    def test_dependents_cycle(self):
+        graph = self._makeOne(('a', 'b'), ('b', 'a'))
+        self.assertEqual(graph.dependents('a'), set(['a', 'b']))
+
+    def test_order(self):
+        graph = self._makeOne(('page', 'layout'), ('layout', 'footer'),
+                              ('page', 'nav'))
+        self.assertEqual(graph.order(), ['footer', 'layout', 'nav', 'page'])
+        self.assertEqual(graph.order(['page', 'other', 'footer']),
+                         ['footer', 'page', 'other'])
+
+    def test_order_cycle(self):
+        graph = self._makeOne(('a', 'b'), ('b', 'a'), ('c', 'a'))
+        result = graph.order()
+        self.assertEqual(sorted(result), ['a', 'b', 'c'])
+        self.assertEqual(result[-1], 'c')
@@ -0,0 +1,119 @@
+import unittest
+
+class TestRenderFuture(unittest.TestCase):
+    def _makeOne(self):
+        from pyramid_chameleon_genshi.executor import RenderFuture
+        return RenderFuture()
+
+    def test_result(self):
+        future = self._makeOne()
+        self.failIf(future.done())
+        future.set_result('abc')
+        self.failUnless(future.done())
+        self.assertEqual(future.result(), 'abc')
+        self.assertEqual(future.exception(), None)
+
+    def test_exception(self):
+        import sys
+        future = self._makeOne()
+        try:
+            raise KeyError('abc')
+        except KeyError:
+            future.set_exception(sys.exc_info())
+        self.assertRaises(KeyError, future.result)
+        self.failUnless(isinstance(future.exception(), KeyError))
+
+    def test_timeout(self):
+        from pyramid_chameleon_genshi.executor import TimeoutError
+        future = self._makeOne()
+        self.assertRaises(TimeoutError, future.result, 0.01)
+
+    def test_cancel(self):
+        from pyramid_chameleon_genshi.executor import CancelledError
+        future = self._makeOne()
+        self.assertEqual(future.cancel(), True)
+        self.assertEqual(future.cancel(), True)
+        self.failUnless(future.cancelled())
+        self.failUnless(future.done())
+        self.assertEqual(future.set_running(), False)
+        self.assertRaises(CancelledError, future.result)
+
+    def test_cancel_running(self):
+        future = self._makeOne()
+        self.assertEqual(future.set_running(), True)
+        self.failUnless(future.running())
+        self.assertEqual(future.cancel(), False)
+        future.set_result(1)
+        self.assertEqual(future.cancel(), False)
+
+    def test_add_done_callback(self):
+        future = self._makeOne()
+        done = []
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [])
+        future.set_result(1)
+        self.assertEqual(done, [future])
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [future, future])
+
+    def test_add_done_callback_cancel(self):
+        future = self._makeOne()
+        done = []
+        future.add_done_callback(done.append)
+        future.cancel()
+        self.assertEqual(done, [future])
+
+class TestRenderExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executors = []
+
+    def tearDown(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+    def _makeOne(self, max_workers=2):
+        from pyramid_chameleon_genshi.executor import RenderExecutor
+        executor = RenderExecutor(max_workers)
+        self.executors.append(executor)
+        return executor
+
+    def test_submit(self):
+        executor = self._makeOne()
+        future = executor.submit(lambda a, b=0: a + b, 1, b=2)
+        self.assertEqual(future.result(5), 3)
+
+    def test_submit_exception(self):
+        executor = self._makeOne()
+        future = executor.submit(lambda: {}['a'])
+        self.assertRaises(KeyError, future.result, 5)
+
+    def test_bounded(self):
+        import threading
+        executor = self._makeOne(2)
+        event = threading.Event()
+        futures = [executor.submit(event.wait, 5) for i in range(5)]
+        self.assertEqual(len(executor.threads), 2)
+        event.set()
+        for future in futures:
+            future.result(5)
+
+    def test_cancel_pending(self):
+        import threading
+        executor = self._makeOne(1)
+        event = threading.Event()
+        calls = []
+        first = executor.submit(event.wait, 5)
+        second = executor.submit(calls.append, 1)
+        self.assertEqual(second.cancel(), True)
+        event.set()
+        first.result(5)
+        executor.shutdown()
+        self.assertEqual(calls, [])
+
+    def test_shutdown(self):
+        executor = self._makeOne()
+        executor.submit(lambda: None).result(5)
+        executor.shutdown()
+        for thread in executor.threads:
+            self.failIf(thread.isAlive())
+        self.assertRaises(RuntimeError, executor.submit, lambda: None)
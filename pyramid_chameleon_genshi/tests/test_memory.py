@@ -0,0 +1,102 @@
+import unittest
+
+class Base(object):
+    def setUp(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        from pyramid_chameleon_genshi import configure_xinclude_cache
+        self.original = PyramidGenshiTemplateFile.global_registry
+        configure_xinclude_cache()
+
+    def tearDown(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.global_registry = self.original
+
+    def _makeTemplate(self, name, **kw):
+        import os
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        here = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(here, 'fixtures', name)
+        return PyramidGenshiTemplateFile(path, **kw)
+
+class Test_code_size(unittest.TestCase):
+    def _callFUT(self, code):
+        from pyramid_chameleon_genshi.memory import code_size
+        return code_size(code)
+
+    def test_it(self):
+        def inner():
+            return 'a string constant'
+        def outer():
+            def nested():
+                return 'a string constant'
+            return nested
+        self.failUnless(self._callFUT(inner.func_code) > len('a string'))
+        self.failUnless(self._callFUT(outer.func_code) >
+                        self._callFUT(inner.func_code))
+
+class Test_template_info(Base, unittest.TestCase):
+    def _callFUT(self, template):
+        from pyramid_chameleon_genshi.memory import template_info
+        return template_info(template)
+
+    def test_unrendered(self):
+        template = self._makeTemplate('minimal.genshi')
+        info = self._callFUT(template)
+        self.assertEqual(info['filename'], template.filename)
+        self.assertEqual(info['source_bytes'], len(template.body))
+        self.assertEqual(info['code_bytes'], 0)
+        self.assertEqual(info['functions'], 0)
+        self.assertEqual(info['renders'], 0)
+        self.assertEqual(info['last_rendered'], None)
+        self.assertEqual(info['registered'], True)
+        self.assertEqual(info['stream'], False)
+
+    def test_rendered(self):
+        template = self._makeTemplate('minimal.genshi')
+        from pyramid_chameleon_genshi import cook
+        template()
+        cook(template, '', False)
+        info = self._callFUT(template)
+        self.failUnless(info['code_bytes'] > 0)
+        self.assertEqual(info['functions'], 2)
+        self.assertEqual(info['parsed'], True)
+        self.assertEqual(info['renders'], 1)
+        self.failUnless(info['last_rendered'] > 0)
+        template.evict()
+        self.assertEqual(self._callFUT(template)['parsed'], False)
+
+    def test_not_registered(self):
+        self._makeTemplate('minimal.genshi')
+        template = self._makeTemplate('minimal.genshi', stream=True)
+        info = self._callFUT(template)
+        self.assertEqual(info['registered'], False)
+        self.assertEqual(info['stream'], True)
+
+class Test_template_report(Base, unittest.TestCase):
+    def _callFUT(self, templates=None):
+        from pyramid_chameleon_genshi.memory import template_report
+        return template_report(templates)
+
+    def test_heaviest_first(self):
+        minimal = self._makeTemplate('minimal.genshi')
+        including = self._makeTemplate('including.genshi')
+        report = self._callFUT([minimal, including])
+        self.assertEqual([info['filename'] for info in report],
+                         [including.filename, minimal.filename])
+
+    def test_all_templates(self):
+        template = self._makeTemplate('minimal.genshi')
+        filenames = [info['filename'] for info in self._callFUT()]
+        self.failUnless(template.filename in filenames)
+
+class Test_templates_view(Base, unittest.TestCase):
+    def test_it(self):
+        from pyramid_chameleon_genshi.memory import templates_view
+        template = self._makeTemplate('minimal.genshi')
+        result = templates_view(None)
+        self.assertEqual(result['count'], len(result['templates']))
+        self.failUnless(result['count'] >= 1)
+        self.assertEqual(result['source_bytes'], sum(
+            [info['source_bytes'] for info in result['templates']]))
+        self.assertEqual(result['code_bytes'], sum(
+            [info['code_bytes'] for info in result['templates']]))
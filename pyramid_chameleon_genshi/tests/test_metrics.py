@@ -0,0 +1,151 @@
+import unittest
+
+class CallbackMetricsTests(unittest.TestCase):
+    def _makeOne(self, callback):
+        from pyramid_chameleon_genshi.metrics import CallbackMetrics
+        return CallbackMetrics(callback)
+
+    def test_class_implements_ITemplateMetrics(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import CallbackMetrics
+        verifyClass(ITemplateMetrics, CallbackMetrics)
+
+    def test_it(self):
+        events = []
+        def callback(event, path, **data):
+            events.append((event, path, data))
+        metrics = self._makeOne(callback)
+        metrics.compiled('a', 0.5)
+        metrics.rendered('a', 0.25, 10)
+        metrics.included('a', 'b')
+        self.assertEqual(events, [
+            ('compiled', 'a', {'seconds':0.5}),
+            ('rendered', 'a', {'seconds':0.25, 'size':10}),
+            ('included', 'a', {'filename':'b'}),
+            ])
+
+class StatsdMetricsTests(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from pyramid_chameleon_genshi.metrics import StatsdMetrics
+        metrics = StatsdMetrics(**kw)
+        metrics.socket = DummySocket()
+        return metrics
+
+    def test_class_implements_ITemplateMetrics(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import StatsdMetrics
+        verifyClass(ITemplateMetrics, StatsdMetrics)
+
+    def test_name(self):
+        metrics = self._makeOne(prefix='app')
+        self.assertEqual(metrics.name('/srv/templates/index.genshi'),
+                         'app.srv.templates.index.genshi')
+        self.assertEqual(metrics.name('pkg:templates/my-page.genshi'),
+                         'app.pkg.templates.my-page.genshi')
+
+    def test_compiled(self):
+        metrics = self._makeOne(port='9125')
+        metrics.compiled('/a.genshi', 0.0125)
+        self.assertEqual(metrics.socket.sent,
+                         [('genshi.a.genshi.compile_time:12|ms',
+                           ('127.0.0.1', 9125))])
+
+    def test_rendered(self):
+        metrics = self._makeOne()
+        metrics.rendered('/a.genshi', 0.002, 100)
+        self.assertEqual(metrics.socket.sent[0][0],
+                         'genshi.a.genshi.renders:1|c\n'
+                         'genshi.a.genshi.render_time:2|ms\n'
+                         'genshi.a.genshi.size:100|g')
+
+    def test_included(self):
+        metrics = self._makeOne()
+        metrics.included('/a.genshi', '/b.genshi')
+        self.assertEqual(metrics.socket.sent[0][0],
+                         'genshi.a.genshi.xincludes:1|c')
+
+    def test_send_error_ignored(self):
+        import socket
+        metrics = self._makeOne()
+        metrics.socket.error = socket.error
+        metrics.included('/a.genshi', '/b.genshi')
+        self.assertEqual(metrics.socket.sent, [])
+
+class MetricsRegistryTests(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from pyramid_chameleon_genshi.metrics import MetricsRegistry
+        return MetricsRegistry(**kw)
+
+    def test_class_implements_ITemplateMetrics(self):
+        from zope.interface.verify import verifyClass
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import MetricsRegistry
+        verifyClass(ITemplateMetrics, MetricsRegistry)
+
+    def test_stats(self):
+        metrics = self._makeOne(buckets=(0.01, 0.1))
+        metrics.compiled('a', 0.5)
+        metrics.rendered('a', 0.005, 10)
+        metrics.rendered('a', 0.01, 20)
+        metrics.rendered('a', 0.05, 30)
+        metrics.rendered('a', 1.0, 40)
+        metrics.included('a', 'b')
+        metrics.rendered('b', 0.001, 5)
+        stats = metrics.stats()
+        self.assertEqual(stats['a'], {
+            'renders':4,
+            'render_time':1.065,
+            'histogram':{'0.01':2, '0.1':1, '+Inf':1},
+            'compile_time':0.5,
+            'output_size':100,
+            'xincludes':1,
+            })
+        self.assertEqual(stats['b']['renders'], 1)
+        self.assertEqual(stats['b']['compile_time'], None)
+
+    def test_stats_is_a_copy(self):
+        metrics = self._makeOne()
+        metrics.rendered('a', 0.005, 10)
+        metrics.stats()['a']['renders'] = 10
+        self.assertEqual(metrics.stats()['a']['renders'], 1)
+
+    def test_clear(self):
+        metrics = self._makeOne()
+        metrics.rendered('a', 0.005, 10)
+        metrics.clear()
+        self.assertEqual(metrics.stats(), {})
+
+class Test_metrics_view(unittest.TestCase):
+    def _callFUT(self, request):
+        from pyramid_chameleon_genshi.metrics import metrics_view
+        return metrics_view(request)
+
+    def test_it(self):
+        from pyramid_chameleon_genshi.interfaces import ITemplateMetrics
+        from pyramid_chameleon_genshi.metrics import MetricsRegistry
+        from pyramid.registry import Registry
+        metrics = MetricsRegistry()
+        metrics.rendered('a', 0.005, 10)
+        request = DummyRequest(Registry())
+        request.registry.registerUtility(metrics, ITemplateMetrics)
+        self.assertEqual(self._callFUT(request), metrics.stats())
+
+    def test_without_registry(self):
+        from pyramid.registry import Registry
+        self.assertEqual(self._callFUT(DummyRequest(Registry())), {})
+
+class DummySocket(object):
+    error = None
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((data, address))
+
+class DummyRequest(object):
+    def __init__(self, registry):
+        self.registry = registry
@@ -0,0 +1,211 @@
+import unittest
+
+class TestRenderProfile(unittest.TestCase):
+    def _makeOne(self):
+        from pyramid_chameleon_genshi.profiler import RenderProfile
+        return RenderProfile()
+
+    def test_measure_nested(self):
+        profile = self._makeOne()
+        out = ['before']
+        def include():
+            out.append(u'abc')
+            out.append(u'de')
+        def page():
+            profile.measure('/inc.genshi', 'xinclude', out, include)
+            return u'12345678'
+        self.assertEqual(profile.measure('/page.genshi', 'template', None,
+                                         page), u'12345678')
+        self.assertEqual(len(profile['spans']), 1)
+        span = profile['spans'][0]
+        self.assertEqual(span['template'], '/page.genshi')
+        self.assertEqual(span['kind'], 'template')
+        self.assertEqual(span['size'], 8)
+        self.assertEqual(len(span['children']), 1)
+        child = span['children'][0]
+        self.assertEqual(child['template'], '/inc.genshi')
+        self.assertEqual(child['kind'], 'xinclude')
+        self.assertEqual(child['size'], 5)
+        self.assertEqual(child['children'], [])
+        self.failUnless(span['wall'] >= child['wall'] >= 0)
+        self.assertEqual(profile['wall'], span['wall'])
+        self.assertEqual(profile['cpu'], span['cpu'])
+        self.assertEqual(profile.stack, [])
+
+    def test_measure_fragments(self):
+        profile = self._makeOne()
+        profile.measure('/page.genshi', 'template', None, lambda: [u'ab', u'c'])
+        self.assertEqual(profile['spans'][0]['size'], 3)
+
+    def test_measure_raises(self):
+        profile = self._makeOne()
+        def fail():
+            raise ValueError
+        self.assertRaises(ValueError, profile.measure, '/page.genshi',
+                          'template', None, fail)
+        span = profile['spans'][0]
+        self.assertEqual(span['size'], None)
+        self.failIf(span['wall'] is None)
+        self.assertEqual(profile.stack, [])
+
+    def test_walk_and_server_timing(self):
+        profile = self._makeOne()
+        profile['wall'] = 0.003
+        def span(template, wall, *children):
+            return {'template':template, 'wall':wall, 'children':list(children)}
+        profile['spans'] = [span('/a/page.genshi', 0.003,
+                                 span('/a/x"y.genshi', 0.001,
+                                      span('/a/z.genshi', 0.0005)),
+                                 span('/a/w.genshi', 0.001))]
+        self.assertEqual([s['template'] for s in profile.walk()],
+                         ['/a/page.genshi', '/a/x"y.genshi', '/a/z.genshi',
+                          '/a/w.genshi'])
+        self.assertEqual(profile.server_timing(),
+                         'genshi;dur=3.000, '
+                         'genshi-1;dur=3.000;desc="page.genshi", '
+                         'genshi-2;dur=1.000;desc="x\\"y.genshi", '
+                         'genshi-3;dur=0.500;desc="z.genshi", '
+                         'genshi-4;dur=1.000;desc="w.genshi"')
+
+class Test_find_profile(unittest.TestCase):
+    def _callFUT(self, namespace):
+        from pyramid_chameleon_genshi.profiler import find_profile
+        return find_profile(namespace)
+
+    def test_no_request(self):
+        self.assertEqual(self._callFUT({}), None)
+        self.assertEqual(self._callFUT({'request':None}), None)
+
+    def test_not_profiled(self):
+        from pyramid.testing import DummyRequest
+        request = DummyRequest()
+        self.assertEqual(self._callFUT({'request':request}), None)
+        request.genshi_profile = False
+        self.assertEqual(self._callFUT({'request':request}), None)
+
+    def test_profiled(self):
+        from pyramid.testing import DummyRequest
+        from pyramid_chameleon_genshi.profiler import RenderProfile
+        from pyramid_chameleon_genshi.profiler import add_server_timing
+        request = DummyRequest()
+        request.genshi_profile = True
+        profile = self._callFUT({'request':request})
+        self.failUnless(isinstance(profile, RenderProfile))
+        self.failUnless(request.genshi_profile is profile)
+        self.failUnless(self._callFUT({'request':request}) is profile)
+        self.assertEqual(list(request.response_callbacks),
+                         [add_server_timing])
+
+class Test_add_server_timing(unittest.TestCase):
+    def _callFUT(self, request, response):
+        from pyramid_chameleon_genshi.profiler import add_server_timing
+        add_server_timing(request, response)
+
+    def test_it(self):
+        from pyramid.testing import DummyRequest
+        from pyramid.response import Response
+        from pyramid_chameleon_genshi.profiler import RenderProfile
+        request = DummyRequest()
+        request.genshi_profile = RenderProfile()
+        response = Response()
+        self._callFUT(request, response)
+        self.failIf('Server-Timing' in response.headers)
+        request.genshi_profile.measure('/page.genshi', 'template', None,
+                                       lambda: u'')
+        self._callFUT(request, response)
+        self.failUnless(response.headers['Server-Timing'].startswith(
+            'genshi;dur='))
+
+class TestHeaderActivation(unittest.TestCase):
+    def _makeOne(self, header, secret='s3cret'):
+        from pyramid_chameleon_genshi.profiler import HeaderActivation
+        return HeaderActivation(header, secret)
+
+    def test_it(self):
+        from pyramid.testing import DummyRequest
+        from pyramid.events import NewRequest
+        subscriber = self._makeOne('X-Genshi-Profile')
+        request = DummyRequest()
+        subscriber(NewRequest(request))
+        self.failIf(getattr(request, 'genshi_profile', False))
+        request = DummyRequest(headers={'X-Genshi-Profile':'s3cret'})
+        subscriber(NewRequest(request))
+        self.assertEqual(request.genshi_profile, True)
+
+    def test_wrong_secret(self):
+        from pyramid.testing import DummyRequest
+        from pyramid.events import NewRequest
+        subscriber = self._makeOne('X-Genshi-Profile')
+        for value in ('1', '', 's3cre', 's3cret!', 'S3CRET'):
+            request = DummyRequest(headers={'X-Genshi-Profile':value})
+            subscriber(NewRequest(request))
+            self.failIf(getattr(request, 'genshi_profile', False))
+
+    def test_matches_unicode(self):
+        subscriber = self._makeOne('X-Genshi-Profile', u'caf\xe9')
+        self.failUnless(subscriber.matches('caf\xc3\xa9'))
+        self.failUnless(subscriber.matches(u'caf\xe9'))
+        self.failIf(subscriber.matches(u'cafe'))
+
+    def test_secret_required(self):
+        self.assertRaises(ValueError, self._makeOne, 'X-Genshi-Profile', None)
+        self.assertRaises(ValueError, self._makeOne, 'X-Genshi-Profile', '')
+
+class ProfiledRenderTests(unittest.TestCase):
+    def setUp(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.profiling = True
+
+    def tearDown(self):
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.profiling = False
+
+    def _getTemplatePath(self, name):
+        import os
+        here = os.path.abspath(os.path.dirname(__file__))
+        return os.path.join(here, 'fixtures', name)
+
+    def _makeRenderer(self, name):
+        from pyramid_chameleon_genshi import GenshiTemplateRenderer
+        class Lookup(object):
+            auto_reload = False
+            debug = False
+            translate = None
+        return GenshiTemplateRenderer(self._getTemplatePath(name), Lookup())
+
+    def test_records_includes(self):
+        from pyramid.testing import DummyRequest
+        renderer = self._makeRenderer('including.genshi')
+        request = DummyRequest()
+        request.genshi_profile = True
+        result = renderer({'name':'abc'}, {'request':request})
+        profile = request.genshi_profile
+        span, = profile['spans']
+        self.assertEqual(span['template'],
+                         self._getTemplatePath('including.genshi'))
+        self.assertEqual(span['kind'], 'template')
+        self.assertEqual(span['size'], len(result))
+        child, = span['children']
+        self.assertEqual(child['template'],
+                         self._getTemplatePath('sub/nested.genshi'))
+        self.assertEqual(child['kind'], 'xinclude')
+        self.assertEqual(child['size'], len(
+            '<div xmlns="http://www.w3.org/1999/xhtml">\n'
+            '  <span>abc</span>\n</div>'))
+
+    def test_not_requested(self):
+        from pyramid.testing import DummyRequest
+        renderer = self._makeRenderer('including.genshi')
+        request = DummyRequest()
+        renderer({'name':'abc'}, {'request':request})
+        self.failIf(hasattr(request, 'genshi_profile'))
+
+    def test_disabled(self):
+        from pyramid.testing import DummyRequest
+        from pyramid_chameleon_genshi import PyramidGenshiTemplateFile
+        PyramidGenshiTemplateFile.profiling = False
+        renderer = self._makeRenderer('including.genshi')
+        request = DummyRequest()
+        request.genshi_profile = True
+        renderer({'name':'abc'}, {'request':request})
+        self.assertEqual(request.genshi_profile, True)
@@ -53,6 +53,9 @@ setup(name='pyramid_chameleon_genshi',
       install_requires = requires,
       test_suite="pyramid_chameleon_genshi.tests",
       entry_points = """\
+      [console_scripts]
+      pgenshi-bench = pyramid_chameleon_genshi.bench:main
+      pgenshi-compile = pyramid_chameleon_genshi.build:main
       """
       )
 